@@ -0,0 +1,126 @@
+"""
+Agency Health — per-agency form health and fast-fail routing for bulk runs.
+
+Some agency forms fail every time (CAPTCHA, a form that never renders, an
+embedded provider the agent cannot fill), and each bulk run used to spend a
+browser session and a credit refund finding that out again. Every finished
+application now appends its outcome to agencies.form_health (see
+scripts/add_agency_form_health.sql):
+
+    {"recent": [{"o": "applied" | "failed" | "captcha" | "no_form",
+                 "ms": 41200, "at": "<iso>"}, ...],   # newest last
+     "updated_at": "<iso>"}
+
+and apply_bulk routes each selected agency with route():
+  - "skip"   the last HARD_FAIL_STREAK attempts all hit a CAPTCHA or found
+             no form: no credit is charged, the submission is recorded as
+             failed. After a back-off (RETRY_AFTER_HOURS, doubling per extra
+             failure, capped at a week) one run is let through as a probe.
+  - "defer"  recently unreliable (failure streak, or under half successful):
+             still applied, but queued after the healthy agencies
+  - "apply"  everything else, including agencies with no history
+
+summary() is what /api/agencies exposes as "health". The record is
+read-modify-written after each application; concurrent bulk runs hitting
+the same agency may drop an entry, which only costs a little history.
+Set AGENCY_HEALTH_ROUTING=false to record without routing.
+"""
+import os
+import statistics
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+HEALTH_ROUTING = os.getenv("AGENCY_HEALTH_ROUTING", "true").lower() != "false"
+HEALTH_WINDOW = 10  # outcomes kept per agency
+HARD_FAIL_STREAK = 3
+RETRY_AFTER_HOURS = 24
+MAX_RETRY_AFTER_HOURS = 24 * 7
+HARD_FAILURES = ("captcha", "no_form")
+NO_FORM_ERROR = "No form found on the application page"  # apply_engine's wording
+
+
+def outcome_of(result: Dict[str, Any]) -> str:
+    """Health outcome for an apply_to_agency result."""
+    if result.get("status") == "applied":
+        return "applied"
+    if result.get("status") == "captcha_blocked":
+        return "captcha"
+    if NO_FORM_ERROR in (result.get("errors") or []):
+        return "no_form"
+    return "failed"
+
+
+def updated(health: Optional[Dict[str, Any]], outcome: str, duration_ms: Optional[int],
+            now: Optional[datetime] = None) -> Dict[str, Any]:
+    """A new health record with this outcome appended (the input is not modified)."""
+    now = now or datetime.now(timezone.utc)
+    recent = list((health or {}).get("recent") or [])
+    recent.append({"o": outcome, "ms": duration_ms, "at": now.isoformat()})
+    return {"recent": recent[-HEALTH_WINDOW:], "updated_at": now.isoformat()}
+
+
+def _streak(recent: List[Dict[str, Any]], outcomes) -> int:
+    n = 0
+    for entry in reversed(recent):
+        if entry["o"] not in outcomes:
+            break
+        n += 1
+    return n
+
+
+def summary(health: Optional[Dict[str, Any]], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Derived view: status, success rate, CAPTCHA flag, median duration, retry time."""
+    recent = (health or {}).get("recent") or []
+    if not recent:
+        return {"status": "unknown", "attempts": 0, "success_rate": None, "captcha": False,
+                "median_seconds": None, "last_outcome": None, "retry_after": None}
+    now = now or datetime.now(timezone.utc)
+    successes = sum(1 for e in recent if e["o"] == "applied")
+    durations = [e["ms"] for e in recent if e.get("ms") is not None]
+    hard_streak = _streak(recent, HARD_FAILURES)
+    fail_streak = _streak(recent, HARD_FAILURES + ("failed",))
+    retry_after = None
+    if hard_streak >= HARD_FAIL_STREAK:
+        hours = min(RETRY_AFTER_HOURS * 2 ** (hard_streak - HARD_FAIL_STREAK), MAX_RETRY_AFTER_HOURS)
+        retry_after = datetime.fromisoformat(recent[-1]["at"]) + timedelta(hours=hours)
+        status = "blocked" if retry_after > now else "probe"
+    elif fail_streak >= 2 or (len(recent) >= 3 and successes * 2 < len(recent)):
+        status = "degraded"
+    else:
+        status = "healthy"
+    return {
+        "status": status,
+        "attempts": len(recent),
+        "success_rate": round(successes / len(recent), 2),
+        "captcha": recent[-1]["o"] == "captcha",
+        "median_seconds": round(statistics.median(durations) / 1000, 1) if durations else None,
+        "last_outcome": recent[-1]["o"],
+        "retry_after": retry_after.isoformat() if retry_after else None,
+    }
+
+
+def route(health: Optional[Dict[str, Any]], now: Optional[datetime] = None) -> str:
+    """"apply" | "defer" | "skip" for one agency of a bulk run (see module docstring)."""
+    if not HEALTH_ROUTING:
+        return "apply"
+    status = summary(health, now)["status"]
+    if status == "blocked":
+        return "skip"
+    return "defer" if status == "degraded" else "apply"
+
+
+def skip_reason(health: Optional[Dict[str, Any]]) -> str:
+    info = summary(health)
+    problem = "a CAPTCHA" if info["captcha"] else "no application form"
+    return (f"Skipped: the last {HARD_FAIL_STREAK}+ attempts hit {problem}; "
+            f"retrying after {info['retry_after'][:16].replace('T', ' ')} UTC")
+
+
+def record(supabase, agency_id: str, outcome: str, duration_ms: Optional[int]):
+    """Appends one outcome to agencies.form_health; errors are logged, never raised."""
+    try:
+        resp = supabase.table('agencies').select('form_health').eq('id', agency_id).single().execute()
+        health = updated((resp.data or {}).get('form_health'), outcome, duration_ms)
+        supabase.table('agencies').update({'form_health': health}).eq('id', agency_id).execute()
+    except Exception as e:
+        print(f"[AGENCY HEALTH] Update for {agency_id} failed (non-fatal): {e}")
@@ -2,41 +2,190 @@
 AI Form Agent — Gemini-powered form filling for model agency applications.
 
 3-Phase Pipeline:
-  1. snapshot_form(page) → Clean HTML of the form
+  1. snapshot_form(page) → Clean HTML of the form, or (compact=True) one
+     line per field: selector | type | label | attributes
   2. gemini_map_fields(form_html, user_data) → JSON action plan
   3. execute_actions(page, actions, photo_urls) → Fill + upload + submit
 """
 
 import os
-import json
-import base64
+import re
+import io
+import asyncio
 import logging
-import tempfile
 import requests as http_requests
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from gemini_gateway import gemini_gateway, PRIORITY_BACKGROUND
+from gemini_http import gemini_http
+from gemini_schema import FORM_ACTIONS_SCHEMA, ResponseParseError
 
 logger = logging.getLogger(__name__)
 
+MAPPER_MODEL = "gemini-2.5-flash"
+SNAPSHOT_COMPACT = os.getenv("APPLY_COMPACT_SNAPSHOT", "true").lower() != "false"
+COMPACT_MAX_FIELDS = 150
+COMPACT_MAX_OPTIONS = 500  # options are listed in full (heights, sizes, countries); only pathological lists are cut
+
+# Photo URL → set_input_files payload {"name", "mimeType", "buffer"} (see prefetch_photos)
+PhotoFiles = Dict[str, Dict[str, Any]]
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Phase 1: Snapshot — Extract clean form HTML from the page
 # ──────────────────────────────────────────────────────────────────────────────
 
-async def snapshot_form(page) -> dict:
+_COMPACT_FIELDS_JS = """
+        // One line per field: selector | type | "label" | attributes.
+        // Radios collapse into one line per group; hidden text inputs
+        // (honeypots) are skipped; visually hidden file/checkbox inputs are
+        // kept because sites style them behind custom widgets. Fields whose
+        // selector is in `exclude` (handled on an earlier step) are left out;
+        // buttons never are, wizards reuse one "Next" button across steps.
+        // Returns {lines, fields: [{sel, line, visible, button, name, value}]}
+        // (value only for checkboxes / radios).
+        function compactFields(root, maxFields, maxOptions, exclude) {
+            const FIELDS = 'input, select, textarea, button';
+            const txt = s => (s || '').replace(/\\s+/g, ' ').trim();
+            const q = s => '"' + txt(s).slice(0, 80).replace(/"/g, "'") + '"';
+            const visible = el => !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+            const unique = sel => { try { return document.querySelectorAll(sel).length === 1; } catch (e) { return false; } };
+            const attr = v => v.replace(/\\\\/g, '\\\\\\\\').replace(/"/g, '\\\\"');
+
+            function selectorFor(el) {
+                if (el.id && unique('#' + CSS.escape(el.id))) return '#' + CSS.escape(el.id);
+                const tag = el.tagName.toLowerCase();
+                const name = el.getAttribute('name');
+                if (name) {
+                    const byName = `${tag}[name="${attr(name)}"]`;
+                    if (unique(byName)) return byName;
+                    const value = el.getAttribute('value');
+                    if (value !== null && unique(`${byName}[value="${attr(value)}"]`)) return `${byName}[value="${attr(value)}"]`;
+                }
+                const parts = [];
+                let node = el;
+                for (; node && node.nodeType === 1 && node !== document.body; node = node.parentElement) {
+                    if (node !== el && node.id && unique('#' + CSS.escape(node.id))) { parts.unshift('#' + CSS.escape(node.id)); break; }
+                    let idx = 1;
+                    for (let sib = node.previousElementSibling; sib; sib = sib.previousElementSibling)
+                        if (sib.tagName === node.tagName) idx++;
+                    parts.unshift(`${node.tagName.toLowerCase()}:nth-of-type(${idx})`);
+                }
+                if (node === document.body) parts.unshift('body');
+                return parts.join(' > ');
+            }
+
+            function labelFor(el) {
+                if (el.labels && el.labels.length) {
+                    const t = txt([...el.labels].map(l => l.innerText).join(' '));
+                    if (t) return t;
+                }
+                if (el.getAttribute('aria-label')) return txt(el.getAttribute('aria-label'));
+                const ids = el.getAttribute('aria-labelledby');
+                if (ids) return txt(ids.split(/\\s+/).map(id => (document.getElementById(id) || {}).innerText || '').join(' '));
+                // Nearest preceding text that is not itself a field (wrapper divs, <p>Label</p><input>)
+                for (let node = el, d = 0; node && d < 3; node = node.parentElement, d++) {
+                    for (let sib = node.previousElementSibling; sib; sib = sib.previousElementSibling) {
+                        if (sib.matches(FIELDS) || sib.querySelector(FIELDS)) break;
+                        const t = txt(sib.innerText);
+                        if (t) return t;
+                    }
+                }
+                return txt(el.getAttribute('title') || '');
+            }
+
+            function optionsOf(sel) {
+                const opts = [...sel.options].map(o => {
+                    const t = txt(o.text), v = o.value;
+                    return v === t ? q(t) : `${q(v)}=${q(t)}`;
+                });
+                if (opts.length <= maxOptions) return opts.join(', ');
+                return opts.slice(0, maxOptions).join(', ') + `, … ${opts.length - maxOptions} more`;
+            }
+
+            const lines = [];
+            const fields = [];
+            const radioGroups = {};
+            for (const el of root.querySelectorAll(FIELDS)) {
+                if (lines.length >= maxFields) { lines.push('… more fields truncated'); break; }
+                const tag = el.tagName.toLowerCase();
+                const type = tag === 'input' ? (el.getAttribute('type') || 'text').toLowerCase()
+                           : tag === 'button' ? (el.getAttribute('type') || 'submit').toLowerCase() : tag;
+                if (['hidden', 'reset', 'image'].includes(type)) continue;
+                if (tag === 'button' && !txt(el.innerText)) continue;  // icon-only buttons
+                const shown = visible(el);
+                if (!shown && !['file', 'checkbox', 'radio'].includes(type)) continue;
+                if (el.disabled) continue;
+                const button = tag === 'button' || ['submit', 'button'].includes(type);
+                const sel = selectorFor(el);
+                if (!button && exclude.has(sel)) continue;
+
+                if (type === 'radio') {
+                    const group = el.getAttribute('name') || sel;
+                    const entry = `${sel}=${q(labelFor(el) || el.value)}`;
+                    if (!radioGroups[group]) {
+                        radioGroups[group] = { line: lines.length, entries: [] };
+                        lines.push({ radio: group });
+                    }
+                    radioGroups[group].entries.push(entry);
+                    fields.push({ sel, line: radioGroups[group].line, visible: shown, button: false,
+                                  name: el.getAttribute('name'), value: el.value });
+                    continue;
+                }
+
+                fields.push({ sel, line: lines.length, visible: shown, button, name: el.getAttribute('name'),
+                              value: type === 'checkbox' ? el.value : null });
+                const parts = [sel, type];
+                const label = tag === 'button' || type === 'submit' ? (el.innerText || el.value) : labelFor(el);
+                if (label) parts.push(q(label));
+                const name = el.getAttribute('name');
+                if (name && !parts[0].includes(name)) parts.push(`name=${name}`);
+                if (el.getAttribute('placeholder')) parts.push(`placeholder=${q(el.getAttribute('placeholder'))}`);
+                if (el.required || el.getAttribute('aria-required') === 'true') parts.push('required');
+                if (type === 'file') {
+                    if (el.getAttribute('accept')) parts.push(`accept=${el.getAttribute('accept')}`);
+                    if (el.multiple) parts.push('multiple');
+                }
+                if (type === 'checkbox' && el.checked) parts.push('checked');
+                if (!shown) parts.push('visually-hidden');
+                if (tag === 'select') parts.push('options: ' + optionsOf(el));
+                lines.push(parts.join(' | '));
+            }
+            return {
+                lines: lines.map(l => typeof l === 'string' ? l
+                    : `radio group ${l.radio} | options: ` + radioGroups[l.radio].entries.join(', ')),
+                fields,
+            };
+        }
+"""
+
+
+async def snapshot_form(page, compact: bool = False, exclude: Optional[Iterable[str]] = None) -> dict:
     """
     Extracts all form elements from the current page and returns sanitized HTML.
     Also detects CAPTCHAs and iframes that embed external form providers.
     
+    compact=True describes the form as one line per field instead (see
+    _COMPACT_FIELDS_JS) — typically 10–20× smaller than the HTML, with
+    ready-made unique selectors. form_html is then only filled when no field
+    could be extracted. exclude (compact only) lists selectors handled on an
+    earlier step of a multi-step form; only the newly visible fields are
+    described, and an empty result then means the step added nothing.
+    
     Returns:
         {
             "form_html": str,          # Sanitized form HTML (≤30KB)
+            "form_fields": str,        # compact=True: field list ("" otherwise)
+            "field_count": int,        # compact=True: lines in form_fields
+            "fields": list,            # compact=True: [{"sel", "line", "visible", "button", "name", "value"}]
             "has_captcha": bool,       # Whether a CAPTCHA was detected
             "has_iframe_form": bool,   # Whether form is inside an iframe
             "iframe_src": str | None,  # Source URL of iframe if detected
             "page_title": str          # Title of the page
         }
     """
-    result = await page.evaluate("""() => {
+    result = await page.evaluate("""(opts) => {""" + _COMPACT_FIELDS_JS + """
         // Helper: strip attributes we don't need
         function cleanElement(el) {
             const clone = el.cloneNode(true);
@@ -66,15 +215,34 @@ async def snapshot_form(page) -> dict:
         // Extract forms
         const forms = document.querySelectorAll('form');
         let formHtml = '';
+        let largestForm = null;
         
-        if (forms.length > 0) {
-            // Get the largest form (most likely the application form)
-            let largestForm = forms[0];
-            for (const f of forms) {
-                if (f.innerHTML.length > largestForm.innerHTML.length) {
-                    largestForm = f;
-                }
+        // Get the largest form (most likely the application form)
+        for (const f of forms) {
+            if (!largestForm || f.innerHTML.length > largestForm.innerHTML.length) {
+                largestForm = f;
             }
+        }
+        
+        if (opts.compact) {
+            const compact = compactFields(largestForm || document.body, opts.maxFields, opts.maxOptions,
+                                          new Set(opts.exclude));
+            // On a later step an empty list means "nothing new" — not "fall back to HTML"
+            if (compact.lines.length || opts.exclude.length) {
+                return {
+                    form_html: '',
+                    form_fields: compact.lines.join('\\n'),
+                    field_count: compact.lines.length,
+                    fields: compact.fields,
+                    has_captcha: hasCaptcha,
+                    has_iframe_form: hasIframeForm,
+                    iframe_src: iframeSrc,
+                    page_title: document.title
+                };
+            }
+        }
+        
+        if (largestForm) {
             formHtml = cleanElement(largestForm);
         } else {
             // No <form> tag — some sites use divs with inputs
@@ -102,12 +270,16 @@ async def snapshot_form(page) -> dict:
         
         return {
             form_html: formHtml,
+            form_fields: '',
+            field_count: 0,
+            fields: [],
             has_captcha: hasCaptcha,
             has_iframe_form: hasIframeForm,
             iframe_src: iframeSrc,
             page_title: document.title
         };
-    }""")
+    }""", {"compact": compact, "maxFields": COMPACT_MAX_FIELDS, "maxOptions": COMPACT_MAX_OPTIONS,
+           "exclude": list(exclude or ())})
     
     # Truncate form HTML if too large (Gemini context limit)
     if len(result.get("form_html", "")) > 30000:
@@ -115,19 +287,210 @@ async def snapshot_form(page) -> dict:
     
     logger.info(f"Snapshot: title='{result['page_title']}', "
                 f"form_size={len(result.get('form_html', ''))}B, "
+                f"fields={result['field_count']} ({len(result['form_fields'])}B compact), "
                 f"captcha={result['has_captcha']}, "
                 f"iframe={result['has_iframe_form']}")
     
     return result
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Readiness — wait on the DOM, not the clock
+# ──────────────────────────────────────────────────────────────────────────────
+
+READY_QUIET_MS = 400          # no DOM insertions for this long = rendered
+READY_TIMEOUT_MS = 8000       # give up waiting for a quiet DOM
+NETWORK_IDLE_CAP_MS = 3000    # extra wait when no field has appeared yet
+SUBMIT_OUTCOME_TIMEOUT_MS = 6000
+SUBMIT_ERROR_GRACE_MS = 750   # let navigation / success text win over validation errors
+
+FORM_FRAME_SELECTOR = (
+    'iframe[src*="typeform"], iframe[src*="jotform"], iframe[src*="google.com/forms"], '
+    'iframe[src*="airtable"], iframe[src*="wufoo"]'
+)
+SUCCESS_PATTERN = (
+    r"thank\s*you|thanks for (applying|your)|application (has been |was )?(received|submitted|sent)"
+    r"|successfully (submitted|sent|received)|we('ll| will) be in touch"
+    r"|received your (application|submission|details)|submission (received|successful)"
+)
+# Submit outcomes that show the page accepted the step (see wait_for_submit_outcome)
+CONFIRMED_OUTCOMES = ("navigated", "success_text", "form_gone", "new_fields")
+VISIBLE_FIELD_SELECTOR = "input:not([type=hidden]), select, textarea"
+ERROR_SELECTOR = (
+    '[aria-invalid="true"], .error:not(:empty), .errors:not(:empty), .invalid-feedback, '
+    '.wpcf7-not-valid-tip, .field-error, .has-error, .form-error'
+)
+
+_READY_JS = """({quietMs, timeoutMs, frameSel}) => new Promise(resolve => {
+    const FIELDS = 'input:not([type=hidden]), select, textarea';
+    const start = performance.now();
+    let last = start;
+    const obs = new MutationObserver(() => { last = performance.now(); });
+    obs.observe(document.documentElement, { childList: true, subtree: true });
+    const tick = () => {
+        const now = performance.now();
+        const found = !!(document.querySelector(FIELDS) || document.querySelector(frameSel));
+        const quiet = now - last >= quietMs;
+        if (!found && quiet && document.readyState === 'complete' &&
+            !document.querySelector('form, [role="form"]')) {
+            // Loaded, settled and not even a form container: nothing is coming
+            obs.disconnect();
+            return resolve({ ready: false, reason: 'no-form', ms: Math.round(now - start) });
+        }
+        if ((found && quiet) || now - start >= timeoutMs) {
+            obs.disconnect();
+            const reason = found ? (now - last >= quietMs ? 'stable' : 'timeout') : 'no-fields';
+            return resolve({ ready: found, reason, ms: Math.round(now - start) });
+        }
+        setTimeout(tick, 50);
+    };
+    tick();
+})"""
+
+_SUBMIT_STATE_JS = """({probe, successRe, errorSel, fieldSel}) => {
+    const visible = el => !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length));
+    const text = document.body ? document.body.innerText : '';
+    let probeVisible = false;
+    try { probeVisible = !!probe && visible(document.querySelector(probe)); } catch (e) {}
+    return {
+        success: (text.match(new RegExp(successRe, 'gi')) || []).length,
+        errors: [...document.querySelectorAll(errorSel)].filter(visible).length,
+        fields: [...document.querySelectorAll(fieldSel)].filter(visible).length,
+        probeVisible,
+    };
+}"""
+
+_SUBMIT_OUTCOME_JS = """({probe, baseline, successRe, errorSel, fieldSel, timeoutMs, graceMs}) => new Promise(resolve => {
+    const visible = el => !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length));
+    const re = new RegExp(successRe, 'gi');
+    const start = performance.now();
+    let dirty = true;
+    const obs = new MutationObserver(() => { dirty = true; });
+    obs.observe(document.documentElement, { childList: true, subtree: true, characterData: true, attributes: true });
+    const done = outcome => { obs.disconnect(); resolve(outcome); };
+    const tick = () => {
+        const elapsed = performance.now() - start;
+        if (dirty) {
+            dirty = false;
+            const text = document.body ? document.body.innerText : '';
+            if ((text.match(re) || []).length > baseline.success) return done('success_text');
+            if (baseline.probeVisible && !visible(document.querySelector(probe))) return done('form_gone');
+            if (baseline.fields != null &&
+                [...document.querySelectorAll(fieldSel)].filter(visible).length > baseline.fields) return done('new_fields');
+            if (elapsed >= graceMs) {
+                const errors = [...document.querySelectorAll(errorSel)].filter(visible).length;
+                const invalid = document.querySelector('form :invalid:not(fieldset)');
+                if (errors > baseline.errors || invalid) return done('validation_error');
+            } else {
+                dirty = true;  // re-check errors once the grace period is over
+            }
+        }
+        if (elapsed >= timeoutMs) return done('timeout');
+        setTimeout(tick, 100);
+    };
+    tick();
+})"""
+
+
+def _context_destroyed(exc: Exception) -> bool:
+    msg = str(exc)
+    return "Execution context was destroyed" in msg or "navigation" in msg.lower()
+
+
+async def wait_for_form_ready(page, timeout_ms: int = READY_TIMEOUT_MS) -> dict:
+    """
+    Waits until a form field (or an embedded form iframe) is in the DOM and
+    the DOM has stopped growing for READY_QUIET_MS. Replaces the fixed 2 s
+    sleep after goto: most pages are ready well before that, slow SPAs get
+    up to timeout_ms plus a capped network-idle wait. A fully loaded page
+    that stays quiet without any field, form iframe or form container
+    returns "no-form" after READY_QUIET_MS instead of waiting all that out.
+
+    Returns {"ready": bool, "reason": "stable"|"timeout"|"no-fields"|"no-form", "ms": int}.
+    """
+    args = {"quietMs": READY_QUIET_MS, "timeoutMs": timeout_ms, "frameSel": FORM_FRAME_SELECTOR}
+    state = {"ready": False, "reason": "no-fields", "ms": 0}
+    for attempt in range(2):
+        try:
+            state = await page.evaluate(_READY_JS, args)
+            break
+        except Exception as e:
+            # A client-side redirect replaced the document mid-wait
+            if attempt or not _context_destroyed(e):
+                logger.warning(f"Readiness check failed: {e}")
+                return state
+            await page.wait_for_load_state("domcontentloaded")
+
+    if not state["ready"] and state["reason"] != "no-form":
+        # Nothing rendered yet: let in-flight requests land (capped), then look once more
+        try:
+            await page.wait_for_load_state("networkidle", timeout=NETWORK_IDLE_CAP_MS)
+        except Exception:
+            pass
+        try:
+            state = await page.evaluate(_READY_JS, {**args, "timeoutMs": READY_QUIET_MS * 2})
+        except Exception as e:
+            logger.warning(f"Readiness re-check failed: {e}")
+    logger.info(f"Form readiness: {state}")
+    return state
+
+
+async def submit_baseline(page, probe: Optional[str]) -> dict:
+    """Success-text matches, visible errors / fields and probe visibility before the submit click."""
+    try:
+        return await page.evaluate(_SUBMIT_STATE_JS, {
+            "probe": probe, "successRe": SUCCESS_PATTERN, "errorSel": ERROR_SELECTOR,
+            "fieldSel": VISIBLE_FIELD_SELECTOR})
+    except Exception:
+        return {"success": 0, "errors": 0, "fields": None, "probeVisible": False}
+
+
+async def wait_for_submit_outcome(page, probe: Optional[str], baseline: dict, url_before: str,
+                                  timeout_ms: int = SUBMIT_OUTCOME_TIMEOUT_MS) -> str:
+    """
+    Classifies what happened after the submit click, returning as soon as
+    one of these is seen (instead of a flat 3 s sleep):
+      "navigated"        the page changed URL / document
+      "success_text"     new "thank you" / "application received" text
+      "form_gone"        the probe field (a filled input) was removed or hidden
+      "new_fields"       more fields became visible (the next step of a wizard)
+      "validation_error" new visible error messages or :invalid fields
+      "timeout"          none of the above within timeout_ms
+    """
+    if page.url != url_before:
+        return await _settled("navigated", page)
+    args = {
+        "probe": probe, "baseline": baseline, "successRe": SUCCESS_PATTERN,
+        "errorSel": ERROR_SELECTOR, "fieldSel": VISIBLE_FIELD_SELECTOR,
+        "timeoutMs": timeout_ms, "graceMs": SUBMIT_ERROR_GRACE_MS,
+    }
+    try:
+        return await page.evaluate(_SUBMIT_OUTCOME_JS, args)
+    except Exception as e:
+        if _context_destroyed(e) or page.url != url_before:
+            return await _settled("navigated", page)
+        logger.warning(f"Submit outcome check failed: {e}")
+        return "timeout"
+
+
+async def _settled(outcome: str, page) -> str:
+    """Lets the post-submit page parse before the proof screenshot."""
+    try:
+        await page.wait_for_load_state("domcontentloaded", timeout=10000)
+    except Exception:
+        pass
+    return outcome
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Phase 2: Gemini Mapper — AI maps user data to form fields
 # ──────────────────────────────────────────────────────────────────────────────
 
-def gemini_map_fields(form_html: str, user_data: Dict[str, Any]) -> List[Dict]:
+def gemini_map_fields(form_html: str, user_data: Dict[str, Any], compact: bool = False) -> List[Dict]:
     """
     Uses Gemini to analyze the form HTML and map user profile data to form fields.
+    compact=True: form_html is snapshot_form's compact field list, whose
+    selectors are used verbatim.
     
     Returns a JSON action plan:
     [
@@ -145,12 +508,23 @@ def gemini_map_fields(form_html: str, user_data: Dict[str, Any]) -> List[Dict]:
     # Build user data summary for the prompt
     user_summary = _build_user_summary(user_data)
     
-    prompt = f"""ROLE: You are an expert web automation engineer. Your job is to analyze an HTML form and produce a precise action plan to fill it with the provided user data.
-
-FORM HTML:
+    if compact:
+        form_section = f"""FORM FIELDS (one per line: selector | type | "label" | attributes; select and radio options are listed as "value"="text"):
+```
+{form_html}
+```"""
+        selector_rule = ('Use the selectors EXACTLY as listed. For a radio group, "check" the selector '
+                         'of the chosen option.')
+    else:
+        form_section = f"""FORM HTML:
 ```html
 {form_html}
-```
+```"""
+        selector_rule = "Use the MOST SPECIFIC CSS selector possible (prefer #id, then name attribute, then class)."
+    
+    prompt = f"""ROLE: You are an expert web automation engineer. Your job is to analyze an HTML form and produce a precise action plan to fill it with the provided user data.
+
+{form_section}
 
 USER DATA:
 {user_summary}
@@ -159,91 +533,104 @@ INSTRUCTIONS:
 1. Analyze every input, select, textarea, and button in the form.
 2. For each field, determine which piece of user data best matches it.
 3. Produce a JSON array of actions to fill the form and submit it.
-4. Use the MOST SPECIFIC CSS selector possible (prefer #id, then name attribute, then class).
+4. {selector_rule}
 5. For date fields, use the format the form expects (check input type and any placeholder text).
 6. For dropdowns/selects, pick the option value that best matches the user data.
 7. For checkboxes (like terms/consent), include a "check" action.
 8. For file upload inputs, specify which photos to use: "headshot" (first photo), "fullbody" (second photo), or "both".
-9. The LAST action should always be the submit button click.
+9. The LAST action should always be the submit button click. If the form is one step of several (a "Next" / "Continue" button and no submit button), the LAST action is that button's click instead.
 10. If a field has no matching user data, SKIP it (do not include it in the plan).
 11. For fields asking about how the user heard about the agency, use "Online Search".
 12. For "message" or "about yourself" textareas, write a brief professional introduction using the user data.
+13. On every fill, select and check action set "source": the [key] of the user data the value comes from when it is used exactly as given, "constant" when it does not depend on the user (consent boxes, "Online Search"), or "generated" when you wrote, converted or chose it (introductions, cm → feet, picking a radio option).
 
 OUTPUT: Return ONLY a JSON array. No markdown, no explanation. Example:
 [
-  {{"action": "fill", "selector": "#first_name", "value": "Jane"}},
-  {{"action": "fill", "selector": "input[name='email']", "value": "jane@example.com"}},
-  {{"action": "select", "selector": "#gender", "value": "female"}},
+  {{"action": "fill", "selector": "#first_name", "value": "Jane", "source": "first_name"}},
+  {{"action": "fill", "selector": "input[name='email']", "value": "jane@example.com", "source": "email"}},
+  {{"action": "select", "selector": "#gender", "value": "female", "source": "generated"}},
   {{"action": "upload", "selector": "input[type='file']", "files": ["headshot", "fullbody"]}},
-  {{"action": "check", "selector": "#terms"}},
+  {{"action": "check", "selector": "#terms", "source": "constant"}},
   {{"action": "click", "selector": "button[type='submit']"}}
 ]"""
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{MAPPER_MODEL}:generateContent?key={api_key}"
     
     payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {
             "temperature": 0.1,
-            "response_mime_type": "application/json"
+            **FORM_ACTIONS_SCHEMA.generation_config()
         }
     }
     
     logger.info("Sending form HTML to Gemini for field mapping...")
-    response = http_requests.post(url, json=payload, timeout=30)
-    response.raise_for_status()
+
+    def _send():
+        r = gemini_http.post_json(url, payload, timeout=30)
+        r.raise_for_status()
+        return r
+
+    # Bulk applies must never starve interactive scans of quota
+    response = gemini_gateway.call(MAPPER_MODEL, _send, priority=PRIORITY_BACKGROUND)
     
     resp_json = response.json()
     
     try:
         text_content = resp_json['candidates'][0]['content']['parts'][0]['text']
-        actions = json.loads(text_content)
-        
-        if not isinstance(actions, list):
-            raise ValueError("Gemini returned non-list response")
+        # Repairs truncated/fenced JSON and drops malformed actions; raises
+        # ResponseParseError when nothing usable is left
+        actions = FORM_ACTIONS_SCHEMA.parse(text_content)
+        # A fill / select without a value (reply cut off before it) would type ""
+        actions = [a for a in actions if a["action"] not in ("fill", "select") or "value" in a]
+        if not actions:
+            raise ResponseParseError(f"{FORM_ACTIONS_SCHEMA.name}: no valid actions in reply")
         
         logger.info(f"Gemini returned {len(actions)} actions")
         return actions
         
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
+    except (KeyError, IndexError) as e:
         logger.error(f"Failed to parse Gemini response: {resp_json}")
         raise ValueError(f"Invalid Gemini response: {e}")
 
 
-def _build_user_summary(user_data: Dict[str, Any]) -> str:
-    """Formats user profile data into a readable summary for Gemini."""
-    lines = []
-    
-    field_map = {
-        'first_name': 'First Name',
-        'last_name': 'Last Name',
-        'email': 'Email',
-        'phone_number': 'Phone Number',
-        'gender': 'Gender',
-        'date_of_birth': 'Date of Birth',
-        'height': 'Height',
-        'bust_cm': 'Bust/Chest (cm)',
-        'waist_cm': 'Waist (cm)',
-        'hips_cm': 'Hips (cm)',
-        'shoe_size_uk': 'Shoe Size (UK)',
-        'eye_color': 'Eye Color',
-        'hair_color': 'Hair Color',
-    }
-    
-    for key, label in field_map.items():
-        value = user_data.get(key)
-        if value:
-            lines.append(f"- {label}: {value}")
+USER_FIELDS = {
+    'first_name': 'First Name',
+    'last_name': 'Last Name',
+    'email': 'Email',
+    'phone_number': 'Phone Number',
+    'gender': 'Gender',
+    'date_of_birth': 'Date of Birth',
+    'height': 'Height',
+    'bust_cm': 'Bust/Chest (cm)',
+    'waist_cm': 'Waist (cm)',
+    'hips_cm': 'Hips (cm)',
+    'shoe_size_uk': 'Shoe Size (UK)',
+    'eye_color': 'Eye Color',
+    'hair_color': 'Hair Color',
+    'instagram': 'Instagram',
+    'tiktok': 'TikTok',
+}
+
+
+def user_field_values(user_data: Dict[str, Any]) -> Dict[str, str]:
+    """{USER_FIELDS key: value as shown to Gemini} for the fields this user has."""
+    values = {key: user_data.get(key) for key in USER_FIELDS}
     
-    # Instagram from social_stats
+    # Instagram / TikTok from social_stats
     social = user_data.get('social_stats', {})
     if isinstance(social, dict):
-        ig = social.get('instagram') or social.get('instagram_handle')
-        if ig:
-            lines.append(f"- Instagram: {ig}")
-        tt = social.get('tiktok') or social.get('tiktok_handle')
-        if tt:
-            lines.append(f"- TikTok: {tt}")
+        values['instagram'] = social.get('instagram') or social.get('instagram_handle')
+        values['tiktok'] = social.get('tiktok') or social.get('tiktok_handle')
+    else:
+        values['instagram'] = values['tiktok'] = None
+    
+    return {key: str(value) for key, value in values.items() if value}
+
+
+def _build_user_summary(user_data: Dict[str, Any]) -> str:
+    """Formats user profile data into a readable summary for Gemini (keys are cited as "source")."""
+    lines = [f"- {USER_FIELDS[key]} [{key}]: {value}" for key, value in user_field_values(user_data).items()]
     
     # Photos
     photos = user_data.get('generated_photos', [])
@@ -257,11 +644,71 @@ def _build_user_summary(user_data: Dict[str, Any]) -> str:
 # Phase 3: Execute — Carry out the action plan via Playwright
 # ──────────────────────────────────────────────────────────────────────────────
 
+BATCH_FILLS = os.getenv("APPLY_BATCH_FILLS", "true").lower() != "false"
+ORDER_BARRIERS = ("upload", "click")  # never reordered; pending fills finish first
+# Buttons that only move a multi-step form along; clicked even in a dry run
+STEP_BUTTON_RE = re.compile(r"^\W*(next|continue|proceed|weiter|suivant|siguiente|avanti)\b", re.IGNORECASE)
+
+_BATCH_FILL_JS = """(items) => items.map(({sel, val}) => {
+    let el;
+    try { el = document.querySelector(sel); } catch (e) { return 'bad-selector'; }
+    if (!el) return 'missing';
+    const type = (el.getAttribute('type') || 'text').toLowerCase();
+    const isText = el.tagName === 'TEXTAREA' || (el.tagName === 'INPUT' &&
+        !['checkbox', 'radio', 'file', 'submit', 'button', 'hidden', 'image', 'reset', 'range', 'color'].includes(type));
+    if (!isText) return 'not-text';
+    if (el.disabled || el.readOnly) return 'disabled';
+    if (!(el.offsetWidth || el.offsetHeight || el.getClientRects().length)) return 'hidden';
+    // Native setter so React/Vue controlled inputs register the change
+    const proto = el.tagName === 'TEXTAREA' ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+    el.focus();
+    Object.getOwnPropertyDescriptor(proto, 'value').set.call(el, val);
+    el.dispatchEvent(new Event('input', { bubbles: true }));
+    el.dispatchEvent(new Event('change', { bubbles: true }));
+    el.blur();
+    return el.value === val ? 'ok' : 'rejected';
+})"""
+
+
+async def _batch_fill(page, actions: List[Dict], start: int) -> Dict[int, str]:
+    """
+    Fills every text "fill" from actions[start] up to the next order barrier
+    in one page.evaluate (one CDP round trip instead of ~3 per field).
+    Returns {action index: "ok" | failure reason}; failures are retried per field.
+    """
+    items, indices = [], []
+    for j in range(start, len(actions)):
+        action = actions[j]
+        if action.get("action") in ORDER_BARRIERS:
+            break
+        if action.get("action") == "fill" and action.get("selector"):
+            items.append({"sel": action["selector"], "val": str(action.get("value", ""))})
+            indices.append(j)
+    try:
+        results = await page.evaluate(_BATCH_FILL_JS, items)
+    except Exception as e:
+        logger.warning(f"Batch fill failed, falling back per field: {e}")
+        results = ["batch-error"] * len(items)
+    return dict(zip(indices, results))
+
+
+async def _is_step_button(page, selector: str) -> bool:
+    """True when selector is a "Next" / "Continue" button rather than the final submit."""
+    try:
+        el = page.locator(selector).first
+        label = await el.inner_text(timeout=2000) or await el.get_attribute("value", timeout=2000) or ""
+    except Exception:
+        return False
+    return bool(STEP_BUTTON_RE.match(label.strip()))
+
+
 async def execute_actions(
     page,
     actions: List[Dict],
     photo_urls: List[str],
-    dry_run: bool = False
+    dry_run: bool = False,
+    batch_fills: bool = BATCH_FILLS,
+    photo_files: Optional[PhotoFiles] = None
 ) -> Dict[str, Any]:
     """
     Executes the Gemini-generated action plan on the page.
@@ -270,13 +717,42 @@ async def execute_actions(
         page: Playwright page object
         actions: List of action dicts from gemini_map_fields
         photo_urls: List of photo URLs from user's generated_photos
-        dry_run: If True, fill but don't click submit
+        dry_run: If True, fill but don't click submit ("Next" / "Continue"
+            buttons of a multi-step form are still clicked)
+        batch_fills: Fill text fields between uploads/clicks in one evaluate
+            (see _batch_fill); fields it cannot fill go through _safe_fill
+            before the next upload/click
+        photo_files: Compressed photos shared across jobs (prefetch_photos);
+            without it each upload downloads its photos
     
     Returns:
-        {"status": "success"|"failed", "actions_completed": int, "errors": list}
+        {"status": "success"|"failed", "actions_completed": int, "errors": list,
+         "submit_outcome": str | None}   # see wait_for_submit_outcome
     """
     completed = 0
     errors = []
+    submit_outcome = None
+    probe = None  # a field we filled: if it vanishes after submit, the form went away
+    last_click = max((i for i, a in enumerate(actions) if a.get("action") == "click"), default=None)
+    batched = {}   # action index → _batch_fill result
+    deferred = []  # (index, selector, value) the batch could not fill
+    
+    async def fill_one(i, selector, value):
+        nonlocal completed, probe
+        await _safe_fill(page, selector, value)
+        completed += 1
+        probe = probe or selector
+        logger.info(f"✅ fill: {selector} = {value[:50]}")
+    
+    async def retry_deferred():
+        for i, selector, value in deferred:
+            try:
+                await fill_one(i, selector, value)
+            except Exception as e:
+                error_msg = f"Action {i} (fill on {selector}): {e}"
+                errors.append(error_msg)
+                logger.warning(f"⚠️ {error_msg}")
+        deferred.clear()
     
     for i, action in enumerate(actions):
         action_type = action.get("action")
@@ -286,12 +762,24 @@ async def execute_actions(
             errors.append(f"Action {i}: missing selector")
             continue
         
+        if action_type in ORDER_BARRIERS:
+            await retry_deferred()
+        
         try:
             if action_type == "fill":
-                value = action.get("value", "")
-                await _safe_fill(page, selector, str(value))
-                completed += 1
-                logger.info(f"✅ fill: {selector} = {value[:50]}")
+                value = str(action.get("value", ""))
+                if batch_fills and i not in batched:
+                    batched.update(await _batch_fill(page, actions, i))
+                outcome = batched.get(i) if batch_fills else None
+                if outcome == "ok":
+                    completed += 1
+                    probe = probe or selector
+                    logger.info(f"✅ fill (batched): {selector} = {value[:50]}")
+                elif outcome is not None:
+                    logger.info(f"↩️ fill deferred ({outcome}): {selector}")
+                    deferred.append((i, selector, value))
+                else:
+                    await fill_one(i, selector, value)
                 
             elif action_type == "select":
                 value = action.get("value", "")
@@ -306,13 +794,21 @@ async def execute_actions(
                 
             elif action_type == "upload":
                 file_types = action.get("files", [])
-                await _safe_upload(page, selector, file_types, photo_urls)
+                await _safe_upload(page, selector, file_types, photo_urls, photo_files)
                 completed += 1
                 logger.info(f"✅ upload: {selector} ({file_types})")
                 
             elif action_type == "click":
-                if dry_run:
+                if dry_run and not await _is_step_button(page, selector):
                     logger.info(f"🔸 DRY RUN — skipping click: {selector}")
+                elif i == last_click:
+                    # The submit: watch for its outcome instead of sleeping
+                    url_before = page.url
+                    baseline = await submit_baseline(page, probe)
+                    await _safe_click(page, selector)
+                    completed += 1
+                    submit_outcome = await wait_for_submit_outcome(page, probe, baseline, url_before)
+                    logger.info(f"✅ click: {selector} → {submit_outcome}")
                 else:
                     await _safe_click(page, selector)
                     completed += 1
@@ -325,20 +821,23 @@ async def execute_actions(
             errors.append(error_msg)
             logger.warning(f"⚠️ {error_msg}")
     
-    # Wait a moment after submit
-    if not dry_run:
-        try:
-            await page.wait_for_timeout(3000)
-        except:
-            pass
+    await retry_deferred()
     
-    status = "success" if completed > 0 and len(errors) < len(actions) / 2 else "failed"
+    if submit_outcome == "validation_error":
+        errors.append("Form reported validation errors after submit")
+        status = "failed"
+    elif submit_outcome in CONFIRMED_OUTCOMES:
+        status = "success" if completed > 0 else "failed"
+    else:
+        # No submit signal (dry run or timeout): fall back to the action tally
+        status = "success" if completed > 0 and len(errors) < len(actions) / 2 else "failed"
     
     return {
         "status": status,
         "actions_completed": completed,
         "actions_total": len(actions),
-        "errors": errors
+        "errors": errors,
+        "submit_outcome": submit_outcome
     }
 
 
@@ -439,18 +938,8 @@ async def _safe_click(page, selector: str, timeout: int = 10000):
             raise RuntimeError(f"Click failed for {selector}: {e}")
 
 
-async def _safe_upload(page, selector: str, file_types: List[str], photo_urls: List[str]):
-    """
-    Download photos from Supabase URLs, compress, and upload to file input.
-    
-    file_types: ["headshot"], ["fullbody"], or ["headshot", "fullbody"] / ["both"]
-    photo_urls: User's generated_photos array from profile
-    """
-    if not photo_urls:
-        logger.warning("No photos available for upload — skipping")
-        return
-    
-    # Map file types to photo URLs
+def photos_for(file_types: List[str], photo_urls: List[str]) -> List[str]:
+    """Maps a plan's file types ("headshot", "fullbody", "both") to photo URLs."""
     files_to_upload = []
     
     for ft in file_types:
@@ -465,18 +954,36 @@ async def _safe_upload(page, selector: str, file_types: List[str], photo_urls: L
             # Default: use first available photo
             files_to_upload.append(photo_urls[0])
     
+    return files_to_upload
+
+
+async def _safe_upload(page, selector: str, file_types: List[str], photo_urls: List[str],
+                       photo_files: Optional[PhotoFiles] = None):
+    """
+    Upload the user's photos (compressed, from memory) to a file input.
+    
+    file_types: ["headshot"], ["fullbody"], or ["headshot", "fullbody"] / ["both"]
+    photo_urls: User's generated_photos array from profile
+    photo_files: URL → payload cache (see prefetch_photos); photos missing
+        from it are fetched now and added to it
+    """
+    if not photo_urls:
+        logger.warning("No photos available for upload — skipping")
+        return
+    
+    files_to_upload = photos_for(file_types, photo_urls)
+    
     if not files_to_upload:
         logger.warning("Could not map file types to available photos")
         return
     
-    # Download and compress photos
-    local_paths = []
+    payloads = []
     for url in files_to_upload:
-        local_path = await _download_and_compress(url)
-        if local_path:
-            local_paths.append(local_path)
+        payload = await photo_payload(url, photo_files)
+        if payload:
+            payloads.append(payload)
     
-    if not local_paths:
+    if not payloads:
         logger.warning("No photos downloaded successfully — skipping upload")
         return
     
@@ -487,73 +994,87 @@ async def _safe_upload(page, selector: str, file_types: List[str], photo_urls: L
         # Check if it accepts multiple files
         accepts_multiple = await file_input.get_attribute("multiple")
         
-        if accepts_multiple and len(local_paths) > 1:
-            await file_input.set_input_files(local_paths)
+        if accepts_multiple and len(payloads) > 1:
+            await file_input.set_input_files(payloads)
         else:
             # Upload one at a time or just the first
-            await file_input.set_input_files(local_paths[0])
+            await file_input.set_input_files(payloads[0])
             
-        logger.info(f"Uploaded {len(local_paths)} photo(s) to {selector}")
+        logger.info(f"Uploaded {len(payloads)} photo(s) to {selector}")
         
     except Exception as e:
         # Fallback: find any visible file input
         try:
             fallback = page.locator("input[type='file']").first
-            await fallback.set_input_files(local_paths[0])
+            await fallback.set_input_files(payloads[0])
             logger.info(f"Uploaded via fallback file input")
         except Exception as e2:
             raise RuntimeError(f"Upload failed: {e2}")
-    finally:
-        # Clean up temp files
-        for p in local_paths:
-            try:
-                os.remove(p)
-            except:
-                pass
 
 
-async def _download_and_compress(url: str, max_size_kb: int = 300) -> Optional[str]:
-    """Downloads an image from URL and compresses it to ≤ max_size_kb."""
+async def prefetch_photos(photo_urls: List[str]) -> PhotoFiles:
+    """
+    Downloads and compresses the photos uploads can use (generated_photos[:2],
+    see photos_for) once, concurrently. A bulk run passes the result to every
+    agency job instead of each job fetching the same photos again.
+    """
+    urls = list(dict.fromkeys(photo_urls[:2]))
+    payloads = await asyncio.gather(*(_download_and_compress(url) for url in urls))
+    photo_files = {url: payload for url, payload in zip(urls, payloads) if payload}
+    logger.info(f"Prefetched {len(photo_files)}/{len(urls)} photo(s) "
+                f"({sum(len(p['buffer']) for p in photo_files.values()) / 1024:.0f}KB)")
+    return photo_files
+
+
+async def photo_payload(url: str, photo_files: Optional[PhotoFiles] = None) -> Optional[Dict[str, Any]]:
+    """set_input_files payload for one photo URL, from photo_files or fetched (and cached there)."""
+    if photo_files is not None and url in photo_files:
+        return photo_files[url]
+    payload = await _download_and_compress(url)
+    if payload and photo_files is not None:
+        photo_files[url] = payload
+    return payload
+
+
+async def _download_and_compress(url: str, max_size_kb: int = 300) -> Optional[Dict[str, Any]]:
+    """Downloads an image and compresses it to ≤ max_size_kb, as a {name, mimeType, buffer} payload."""
     try:
-        response = http_requests.get(url, timeout=20)
+        response = await asyncio.to_thread(http_requests.get, url, timeout=20)
         response.raise_for_status()
-        
-        # Save to temp file
-        suffix = ".jpg"
-        tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
-        tmp.write(response.content)
-        tmp.close()
-        
-        # Compress with Pillow if available
-        try:
-            from PIL import Image
-            img = Image.open(tmp.name)
-            img = img.convert("RGB")
-            
-            # Resize if very large
-            max_dim = 1200
-            if max(img.size) > max_dim:
-                ratio = max_dim / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, Image.LANCZOS)
-            
-            output_path = tmp.name.replace(suffix, "_compressed.jpg")
-            quality = 85
-            img.save(output_path, "JPEG", quality=quality)
-            
-            # Reduce quality until under limit
-            while os.path.getsize(output_path) > max_size_kb * 1024 and quality > 20:
-                quality -= 10
-                img.save(output_path, "JPEG", quality=quality)
-            
-            os.remove(tmp.name)  # Clean original
-            logger.info(f"Compressed image: {os.path.getsize(output_path)/1024:.0f}KB (q={quality})")
-            return output_path
-            
-        except ImportError:
-            logger.warning("Pillow not available — using uncompressed image")
-            return tmp.name
-            
+        name = os.path.basename(urlsplit(url).path) or "photo.jpg"
+        return await asyncio.to_thread(_compress_photo, response.content, name, max_size_kb)
     except Exception as e:
         logger.error(f"Failed to download image from {url}: {e}")
         return None
+
+
+def _compress_photo(data: bytes, name: str, max_size_kb: int) -> Dict[str, Any]:
+    stem = os.path.splitext(name)[0]
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.warning("Pillow not available — using uncompressed image")
+        return {"name": f"{stem}.jpg", "mimeType": "image/jpeg", "buffer": data}
+    
+    img = Image.open(io.BytesIO(data))
+    img = img.convert("RGB")
+    
+    # Resize if very large
+    max_dim = 1200
+    if max(img.size) > max_dim:
+        ratio = max_dim / max(img.size)
+        new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+        img = img.resize(new_size, Image.LANCZOS)
+    
+    quality = 85
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=quality)
+    
+    # Reduce quality until under limit
+    while out.tell() > max_size_kb * 1024 and quality > 20:
+        quality -= 10
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality)
+    
+    logger.info(f"Compressed image: {out.tell()/1024:.0f}KB (q={quality})")
+    return {"name": f"{stem}.jpg", "mimeType": "image/jpeg", "buffer": out.getvalue()}
@@ -6,121 +6,268 @@ It replaces the old heuristic approach in backend/app/services/apply_service.py.
 """
 
 import os
+import asyncio
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Callable, Awaitable
 from playwright.async_api import async_playwright
 
-from ai_form_agent import snapshot_form, gemini_map_fields, execute_actions
+from ai_form_agent import (
+    snapshot_form, gemini_map_fields, execute_actions, wait_for_form_ready, submit_baseline,
+    user_field_values, SNAPSHOT_COMPACT, PhotoFiles, CONFIRMED_OUTCOMES
+)
+from gemini_schema import FORM_ACTIONS_SCHEMA, ResponseParseError
+from tracing import span
+from nav_profile import NavProfile
+import step_plans
+from step_plans import agency_key, step_signature
+import http_form
+from proof import capture_proof
 
 logger = logging.getLogger(__name__)
 
+MAX_FORM_STEPS = int(os.getenv("APPLY_MAX_STEPS", "6"))  # Next → Next → ... cap per application
+BROWSER_USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/121.0.0.0 Safari/537.36"
+)
+
 
 async def apply_to_agency(
     agency_url: str,
     user_data: Dict[str, Any],
-    dry_run: bool = False
+    dry_run: bool = False,
+    nav_profile: Optional[str] = None,
+    http_spec: Optional[Dict[str, Any]] = None,
+    photo_files: Optional[PhotoFiles] = None,
+    context_hook: Optional[Callable[[Any], Awaitable[None]]] = None
 ) -> Dict[str, Any]:
     """
     Full application pipeline for a single agency.
     
+    0. Plain HTML forms classified on an earlier run (agencies.http_form →
+       http_spec) are posted directly over HTTP — see http_form.py; the
+       browser only runs if that falls back
     1. Connect to Browserless
-    2. Navigate to agency application URL
+    2. Navigate to agency application URL (images/fonts/trackers blocked
+       per nav_profile — see nav_profile.py; agencies.nav_profile overrides)
     3. Snapshot form HTML
-    4. Gemini maps user data → form fields
-    5. Execute plan (fill + upload + submit)
-    6. Return proof screenshot bytes
+    4. Gemini maps user data → form fields (or a cached plan for this step)
+    5. Execute plan (fill + upload + submit, or "Next")
+       — photos come from photo_files (the bulk run's prefetch, see
+       prefetch_photos) or are fetched once for this application
+    6. Multi-step forms: repeat 3–5 for the newly visible fields, up to
+       MAX_FORM_STEPS
+    7. Return proof screenshot bytes (form region / viewport JPEG per
+       APPLY_PROOF_CAPTURE — see proof.py)
+    
+    context_hook is awaited with the browser context before the nav profile
+    is installed; scripts/replay_harness.py records and serves pages there.
     
     Returns:
         {
             "status": "applied" | "failed" | "captcha_blocked" | "dry_run_complete",
             "screenshot": bytes | None,
             "actions_completed": int,
-            "actions_total": int,
-            "errors": list[str]
+            "actions_total": int,          # summed over all steps
+            "errors": list[str],
+            "steps": int,
+            "http_form": dict | None   # only present when agencies.http_form should change
         }
     """
     browser = None
     pw = None
+    context = None
     page = None
+    user_values = user_field_values(user_data)
+    spec_update = {}  # {"http_form": new value} when the stored classification changes
+    if photo_files is None:
+        photo_files = {}  # still shared by the fast path and every form step below
+    
+    if http_spec and http_spec.get("version") == http_form.SPEC_VERSION and not dry_run and http_form.HTTP_FAST_PATH:
+        logger.info(f"⚡ HTTP fast path: POST {http_spec.get('action')}")
+        fast = await http_form.submit(http_spec, user_data, user_values, BROWSER_USER_AGENT, photo_files)
+        if fast["status"] == "applied":
+            return _result("applied", None, len(http_spec["fields"]), len(http_spec["fields"]), fast["errors"])
+        logger.info(f"↩️ {fast['errors'][0]} — using the browser")
+        spec_update["http_form"] = None
     
     try:
         pw = await async_playwright().start()
-        browser = await _connect_browser(pw)
+        with span("playwright", "connect"):
+            browser = await _connect_browser(pw)
         
         # Stealth context
         context = await browser.new_context(
-            user_agent=(
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/121.0.0.0 Safari/537.36"
-            ),
+            user_agent=BROWSER_USER_AGENT,
             viewport={"width": 1920, "height": 1080},
             timezone_id="Europe/London",
-            locale="en-GB"
+            locale="en-GB",
+            # Service workers would fetch around the profile's routes
+            service_workers="block"
         )
+        if context_hook:
+            await context_hook(context)
+        nav = await NavProfile(nav_profile).install(context)
         
         page = await context.new_page()
         
         # ── Phase 0: Navigate ──
         logger.info(f"🌐 Navigating to {agency_url}")
-        await page.goto(agency_url, timeout=60000, wait_until="domcontentloaded")
-        await page.wait_for_timeout(2000)  # Let JS render
+        with span("playwright", "goto"):
+            await page.goto(agency_url, timeout=60000, wait_until="domcontentloaded")
+            await wait_for_form_ready(page)  # Let JS render the form
         
         # ── Phase 1: Snapshot ──
         logger.info("📸 Phase 1: Snapshotting form...")
-        snapshot = await snapshot_form(page)
+        with span("playwright", "snapshot"):
+            snapshot = await snapshot_form(page, compact=SNAPSHOT_COMPACT)
         
         # CAPTCHA check
         if snapshot.get("has_captcha"):
             logger.warning("🛑 CAPTCHA detected — aborting")
-            ss = await page.screenshot(full_page=True)
-            return _result("captcha_blocked", ss, errors=["CAPTCHA detected"])
+            ss = await capture_proof(page)
+            return {**_result("captcha_blocked", ss, errors=["CAPTCHA detected"]), **spec_update}
         
         # Iframe check — try navigating directly
         if snapshot.get("has_iframe_form") and snapshot.get("iframe_src"):
             logger.info(f"📎 Form in iframe → {snapshot['iframe_src']}")
-            await page.goto(snapshot["iframe_src"], timeout=60000, wait_until="domcontentloaded")
-            await page.wait_for_timeout(2000)
-            snapshot = await snapshot_form(page)
+            with span("playwright", "goto"):
+                await page.goto(snapshot["iframe_src"], timeout=60000, wait_until="domcontentloaded")
+                await wait_for_form_ready(page)
+            with span("playwright", "snapshot"):
+                snapshot = await snapshot_form(page, compact=SNAPSHOT_COMPACT)
+        
+        form_text, compact = _form_input(snapshot)
+        if not form_text and nav.profile != "full":
+            # Some forms only render once a blocked asset/script loads
+            logger.info(f"🔁 No form under nav profile '{nav.profile}' — reloading unblocked")
+            await nav.relax()
+            with span("playwright", "goto"):
+                await page.reload(timeout=60000, wait_until="domcontentloaded")
+                await wait_for_form_ready(page)
+            with span("playwright", "snapshot"):
+                snapshot = await snapshot_form(page, compact=SNAPSHOT_COMPACT)
+            form_text, compact = _form_input(snapshot)
+        logger.info(f"🧱 Navigation: {nav.summary()}")
         
-        form_html = snapshot.get("form_html", "")
-        if not form_html or len(form_html) < 50:
+        if not form_text:
             logger.warning("⚠️ No form found on page")
-            ss = await page.screenshot(full_page=True)
-            return _result("failed", ss, errors=["No form found on the application page"])
+            ss = await capture_proof(page)
+            return {**_result("failed", ss, errors=["No form found on the application page"]), **spec_update}
         
-        # ── Phase 2: Gemini Mapping ──
-        logger.info("🧠 Phase 2: Gemini field mapping...")
-        actions = None
-        last_error = None
+        # ── Phases 2–3, once per form step ──
+        # Multi-step forms: after each "Next" only the newly visible fields
+        # are snapshotted and mapped; steps seen before reuse a cached plan.
+        key = agency_key(agency_url)
+        photo_urls = user_data.get("generated_photos", [])
+        seen = set()  # selectors handled on earlier steps of this document
+        done_steps = set()  # signatures executed in this session
+        completed, total, errors = 0, 0, []
+        steps = 0
+        result = None
+        first_step = None  # (PostCapture, snapshot, actions, page url) for HTTP classification
         
-        for attempt in range(2):  # Retry once
+        for step in range(1, MAX_FORM_STEPS + 1):
+            if step > 1:
+                with span("playwright", "snapshot"):
+                    snapshot = await snapshot_form(page, compact=True, exclude=seen)
+                if snapshot.get("has_captcha"):
+                    logger.warning(f"🛑 CAPTCHA detected on step {step} — aborting")
+                    ss = await capture_proof(page)
+                    return {**_result("captcha_blocked", ss, completed, total,
+                                      errors + ["CAPTCHA detected"], steps), **spec_update}
+                form_text, compact = _form_input(snapshot)
+                if not any(not f["button"] for f in snapshot.get("fields", [])):
+                    if (await submit_baseline(page, None))["success"]:
+                        break  # the thank-you page: the previous step's outcome stands
+                    if not any(f["button"] and f["visible"] for f in snapshot.get("fields", [])):
+                        break  # nothing new and nothing to press
+                    # Buttons only (a review / confirm page): map and click its submit,
+                    # or "Next" alone would be reported as the application
+                    logger.info(f"🧾 Step {step} has buttons only — mapping its submit")
+                    if not form_text:
+                        errors.append(f"Step {step} has buttons only and could not be read")
+                        result = {**result, "status": "failed"}
+                        break
+            
+            fields = snapshot.get("fields", [])
+            signature = step_signature(fields) if compact and fields else None
+            if step > 1 and signature in done_steps:
+                break  # the same step again (a post-back re-render): never submit twice
+            done_steps.add(signature)
+            
+            # ── Phase 2: Gemini Mapping (or cached step plan) ──
+            logger.info(f"🧠 Phase 2: field mapping for step {step} ({snapshot.get('field_count', 0)} fields)...")
             try:
-                actions = gemini_map_fields(form_html, user_data)
-                break
+                actions, cached = await _plan_step(snapshot, form_text, compact, user_data, user_values, key, signature)
             except Exception as e:
-                last_error = e
-                logger.warning(f"Gemini attempt {attempt + 1} failed: {e}")
-        
-        if not actions:
-            ss = await page.screenshot(full_page=True)
-            return _result("failed", ss, errors=[f"AI field mapping failed: {last_error}"])
-        
-        # ── Phase 3: Execute ──
-        logger.info(f"⚡ Phase 3: Executing {len(actions)} actions (dry_run={dry_run})")
-        photo_urls = user_data.get("generated_photos", [])
-        result = await execute_actions(page, actions, photo_urls, dry_run=dry_run)
+                ss = await capture_proof(page)
+                return {**_result("failed", ss, completed, total,
+                                  errors + [f"AI field mapping failed: {e}"], steps), **spec_update}
+            
+            # ── Phase 3: Execute ──
+            logger.info(f"⚡ Phase 3: Executing {len(actions)} actions on step {step} (dry_run={dry_run})")
+            capture = http_form.PostCapture().attach(page) if step == 1 and compact and not dry_run else None
+            url_before = page.url
+            with span("playwright", "execute"):
+                result = await execute_actions(page, actions, photo_urls, dry_run=dry_run,
+                                              photo_files=photo_files)
+            if capture:
+                capture.detach()
+                first_step = (capture, snapshot, actions, url_before)
+            steps += 1
+            completed += result["actions_completed"]
+            total += result["actions_total"]
+            errors += result["errors"]
+            outcome = result["submit_outcome"]
+            
+            if signature:
+                if outcome == "validation_error" and cached:
+                    await asyncio.to_thread(step_plans.forget, key, signature)
+                elif result["status"] == "success" and outcome in CONFIRMED_OUTCOMES and not cached:
+                    await asyncio.to_thread(step_plans.store, key, signature,
+                                            step_plans.templatize(actions, user_values))
+            
+            if not compact or outcome not in ("navigated", "form_gone", "new_fields"):
+                break  # submitted, failed, dry-run end, or no way to find the next step
+            
+            if outcome == "navigated":
+                # Multi-page form: a new document, nothing on it has been handled yet
+                seen.clear()
+                await wait_for_form_ready(page)
+                if (await submit_baseline(page, None))["success"]:
+                    break  # landed on the thank-you page
+            else:
+                # Hidden inputs we acted on (styled file / checkbox widgets) count as handled too
+                seen.update(f["sel"] for f in fields if f["visible"] and not f["button"])
+                seen.update(a["selector"] for a in actions if a.get("action") != "click")
+                await wait_for_form_ready(page)
+            logger.info(f"🪜 Step {step} → {outcome}; looking for the next step")
+        else:
+            errors.append(f"Form still had more steps after {MAX_FORM_STEPS}")
+            result = {**result, "status": "failed"}
         
         # Proof screenshot
         logger.info("📷 Taking proof screenshot...")
-        ss = await page.screenshot(full_page=True)
+        with span("playwright", "screenshot"):
+            ss = await capture_proof(page)
         
         if result["status"] == "success":
             status = "dry_run_complete" if dry_run else "applied"
         else:
             status = "failed"
         
-        return _result(status, ss, result["actions_completed"], result["actions_total"], result["errors"])
+        if (status == "applied" and steps == 1 and first_step and http_form.HTTP_FAST_PATH
+                and result["submit_outcome"] == "navigated"):
+            capture, first_snapshot, first_actions, form_url = first_step
+            spec = http_form.classify(capture, first_snapshot, first_actions, user_values, form_url, page.url,
+                                      await capture.landing_html())
+            if spec:
+                logger.info(f"🏷️ Plain HTML form — HTTP fast path from now on ({len(spec['fields'])} fields)")
+                spec_update["http_form"] = spec
+        
+        return {**_result(status, ss, completed, total, errors, steps), **spec_update}
         
     except Exception as e:
         logger.error(f"❌ Application failed: {e}", exc_info=True)
@@ -128,27 +275,104 @@ async def apply_to_agency(
         ss = None
         try:
             if page:
-                ss = await page.screenshot(full_page=True)
+                ss = await capture_proof(page)
         except:
             pass
         
-        return _result("failed", ss, errors=[str(e)])
+        return {**_result("failed", ss, errors=[str(e)]), **spec_update}
         
     finally:
+        if context:
+            try:
+                await context.close()  # flushes a HAR being recorded by a context_hook
+            except Exception:
+                pass
         if browser:
             await browser.close()
         if pw:
             await pw.stop()
 
 
-def _result(status, screenshot=None, completed=0, total=0, errors=None):
+async def _plan_step(snapshot, form_text, compact, user_data, user_values, key, signature):
+    """
+    (actions, cached) for one form step: the cached plan for this step
+    (with user-specific fields re-mapped), else a full Gemini mapping.
+    """
+    template = await asyncio.to_thread(step_plans.lookup, key, signature) if signature else None
+    if template:
+        actions, remap = step_plans.instantiate(template, user_values)
+        if not remap:
+            logger.info(f"♻️ Cached step plan: {len(actions)} actions, no Gemini call")
+            return actions, True
+        try:
+            actions = await asyncio.to_thread(_remap_fields, snapshot, actions, remap, user_data)
+            logger.info(f"♻️ Cached step plan: {len(actions)} actions, {len(remap)} re-mapped")
+            return actions, True
+        except Exception as e:
+            logger.warning(f"Re-mapping cached plan failed, mapping the whole step: {e}")
+    return await _map_fields(form_text, user_data, compact), False
+
+
+async def _map_fields(form_text, user_data, compact):
+    """gemini_map_fields with one retry; raises the last error when both fail."""
+    last_error = None
+    for attempt in range(2):  # Retry once
+        try:
+            # Off the event loop: the gateway may queue this behind interactive calls
+            return await asyncio.to_thread(gemini_map_fields, form_text, user_data, compact)
+        except Exception as e:
+            last_error = e
+            if isinstance(e, ResponseParseError) and attempt == 0:
+                # Repair could not salvage the reply — this retry is a full re-request
+                FORM_ACTIONS_SCHEMA.note_rerequest()
+            logger.warning(f"Gemini attempt {attempt + 1} failed: {e}")
+    raise last_error
+
+
+def _remap_fields(snapshot, actions, remap, user_data):
+    """
+    Asks Gemini only about the fields of a cached plan whose values depend on
+    the user (remap indexes from step_plans.instantiate) and puts the answers
+    where the placeholders were.
+    """
+    line_of = {f["sel"]: f["line"] for f in snapshot["fields"]}
+    lines = snapshot["form_fields"].split("\n")
+    wanted = sorted({line_of[actions[i]["selector"]] for i in remap if actions[i]["selector"] in line_of})
+    fresh = gemini_map_fields("\n".join(lines[n] for n in wanted), user_data, True) if wanted else []
+    
+    by_line = {}
+    for action in fresh:
+        line = line_of.get(action.get("selector"))
+        if action.get("action") != "click" and line in wanted:
+            by_line.setdefault(line, []).append(action)
+    
+    merged = []
+    placeholders = set(remap)
+    for i, action in enumerate(actions):
+        if i in placeholders:
+            merged.extend(by_line.pop(line_of.get(action["selector"]), []))
+        else:
+            merged.append(action)
+    return merged
+
+
+def _form_input(snapshot):
+    """(text for gemini_map_fields, compact?) — empty text when no usable form was found."""
+    if snapshot.get("form_fields"):
+        return snapshot["form_fields"], True
+    form_html = snapshot.get("form_html", "")
+    return (form_html if len(form_html) >= 50 else ""), False
+
+
+def _result(status, screenshot=None, completed=0, total=0, errors=None, steps=1):
     """Construct a standard result dict."""
     return {
         "status": status,
         "screenshot": screenshot,
         "actions_completed": completed,
         "actions_total": total,
-        "errors": errors or []
+        "errors": errors or [],
+        "steps": steps
     }
 
 
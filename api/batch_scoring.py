@@ -0,0 +1,285 @@
+"""
+Batch Scoring — re-score many lead photos with the scan model.
+
+Operators submit a list of lead ids and/or storage URLs (e.g. after a scan
+prompt change). Each job runs as a three-stage asyncio pipeline with
+bounded queues between the stages, so at most a few images are held in
+memory at once:
+
+    download (requests, pooled) → analyze (optimize + Gemini) → write leads
+
+analyze_image runs at PRIORITY_BACKGROUND, so the Gemini gateway keeps live
+scans ahead of the batch no matter how many workers are configured.
+
+Progress is checkpointed to public.scoring_batches (see
+scripts/create_scoring_batches.sql) as a cursor: every item before it is
+done. A resumed job restarts at the cursor; items past it may be scored a
+second time, which is harmless because writes are idempotent updates.
+"""
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from vision_logic import analyze_image, SCAN_PROMPT_VERSION
+from gemini_gateway import PRIORITY_BACKGROUND
+
+BATCH_TABLE = "scoring_batches"
+DEFAULT_CONCURRENCY = 8
+MAX_CONCURRENCY = 32
+WRITE_WORKERS = 2
+CHECKPOINT_INTERVAL_S = 10
+MAX_RECORDED_ERRORS = 50
+LOOKUP_CHUNK = 200
+
+_http = requests.Session()  # keep-alive for storage downloads
+
+# Jobs running in this process, by id
+_jobs: Dict[str, "BatchScoringJob"] = {}
+
+
+def lead_score_fields(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """The leads columns written for a server-side scan (same mapping as /api/lead)."""
+    market_data = analysis.get('market_categorization', {})
+    category = market_data.get('primary', 'Unknown') if isinstance(market_data, dict) else str(market_data)
+    return {
+        'score': analysis.get('suitability_score', 0),
+        'category': category,
+        'analysis_json': analysis,
+        'score_prompt_version': SCAN_PROMPT_VERSION,
+        'scored_at': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def download(url: str) -> bytes:
+    r = _http.get(url, timeout=20)
+    r.raise_for_status()
+    return r.content
+
+
+class BatchScoringJob:
+    def __init__(self, supabase, job_id: str, items: List[Dict[str, Any]],
+                 concurrency: int = DEFAULT_CONCURRENCY, cursor: int = 0,
+                 succeeded: int = 0, failed: int = 0):
+        self.supabase = supabase
+        self.job_id = job_id
+        self.items = items  # [{"lead_id": str|None, "url": str|None}]
+        self.concurrency = max(1, min(MAX_CONCURRENCY, int(concurrency)))
+        self.cursor = cursor
+        self.succeeded = succeeded
+        self.failed = failed
+        self.status = "pending"
+        self.errors: List[Dict[str, Any]] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.processed_this_run = 0
+        self.stage_s = {"download": 0.0, "analyze": 0.0, "write": 0.0}
+        self._done = set()
+        self._last_checkpoint = 0.0
+
+    # ── Pipeline ─────────────────────────────────────────────────────
+
+    async def run(self):
+        self.status = "running"
+        self.started_at = time.time()
+        _jobs[self.job_id] = self
+        try:
+            await asyncio.to_thread(self._resolve_lead_urls)
+
+            todo: asyncio.Queue = asyncio.Queue()
+            for idx in range(self.cursor, len(self.items)):
+                todo.put_nowait(idx)
+            to_analyze: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+            to_write: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+
+            downloaders = [asyncio.create_task(self._download_worker(todo, to_analyze)) for _ in range(self.concurrency)]
+            analyzers = [asyncio.create_task(self._analyze_worker(to_analyze, to_write)) for _ in range(self.concurrency)]
+            writers = [asyncio.create_task(self._write_worker(to_write)) for _ in range(WRITE_WORKERS)]
+
+            # Drain stage by stage; a None tells the next stage's worker to stop
+            await asyncio.gather(*downloaders)
+            for _ in analyzers:
+                await to_analyze.put(None)
+            await asyncio.gather(*analyzers)
+            for _ in writers:
+                await to_write.put(None)
+            await asyncio.gather(*writers)
+
+            self.status = "completed"
+        except Exception as e:
+            print(f"[BATCH] Job {self.job_id} crashed: {e}")
+            self.status = "failed"
+            self._record_error(None, f"job: {e}")
+        finally:
+            self.finished_at = time.time()
+            await asyncio.to_thread(self._checkpoint)
+            _jobs.pop(self.job_id, None)
+            print(f"[BATCH] Job {self.job_id} {self.status}: {self.status_dict()}")
+
+    async def _download_worker(self, todo: asyncio.Queue, out: asyncio.Queue):
+        while True:
+            try:
+                idx = todo.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            url = self.items[idx].get("url")
+            if not url:
+                self._finish(idx, error="no image_url")
+                continue
+            t0 = time.perf_counter()
+            try:
+                image_bytes = await asyncio.to_thread(download, url)
+            except Exception as e:
+                self._finish(idx, error=f"download: {e}")
+                continue
+            self.stage_s["download"] += time.perf_counter() - t0
+            await out.put((idx, image_bytes))
+
+    async def _analyze_worker(self, inbox: asyncio.Queue, out: asyncio.Queue):
+        while True:
+            job = await inbox.get()
+            if job is None:
+                return
+            idx, image_bytes = job
+            t0 = time.perf_counter()
+            analysis = await asyncio.to_thread(analyze_image, image_bytes, "image/jpeg", PRIORITY_BACKGROUND)
+            self.stage_s["analyze"] += time.perf_counter() - t0
+            # analyze_image reports failures in-band; never overwrite a real score with them
+            if analysis.get("error"):
+                self._finish(idx, error=f"analyze: {analysis['error']}")
+                continue
+            await out.put((idx, analysis))
+
+    async def _write_worker(self, inbox: asyncio.Queue):
+        while True:
+            job = await inbox.get()
+            if job is None:
+                return
+            idx, analysis = job
+            t0 = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write, self.items[idx], analysis)
+            except Exception as e:
+                self._finish(idx, error=f"write: {e}")
+                continue
+            self.stage_s["write"] += time.perf_counter() - t0
+            self._finish(idx)
+
+    def _write(self, item: Dict[str, Any], analysis: Dict[str, Any]):
+        fields = lead_score_fields(analysis)
+        query = self.supabase.table('leads').update(fields)
+        if item.get("lead_id"):
+            query.eq('id', item["lead_id"]).execute()
+        else:
+            query.eq('image_url', item["url"]).execute()
+
+    def _resolve_lead_urls(self):
+        """Fills in image_url for lead-id items that still need scoring."""
+        pending = [it for it in self.items[self.cursor:] if it.get("lead_id") and not it.get("url")]
+        for start in range(0, len(pending), LOOKUP_CHUNK):
+            chunk = pending[start:start + LOOKUP_CHUNK]
+            resp = self.supabase.table('leads').select('id, image_url') \
+                .in_('id', [it["lead_id"] for it in chunk]).execute()
+            urls = {row['id']: row.get('image_url') for row in (resp.data or [])}
+            for it in chunk:
+                it["url"] = urls.get(it["lead_id"])
+
+    # ── Progress ─────────────────────────────────────────────────────
+
+    def _finish(self, idx: int, error: Optional[str] = None):
+        self.processed_this_run += 1
+        if error:
+            self.failed += 1
+            self._record_error(idx, error)
+        else:
+            self.succeeded += 1
+        self._done.add(idx)
+        while self.cursor in self._done:
+            self._done.discard(self.cursor)
+            self.cursor += 1
+        if time.time() - self._last_checkpoint >= CHECKPOINT_INTERVAL_S:
+            self._last_checkpoint = time.time()
+            # Fire-and-forget; the final checkpoint in run() is awaited
+            asyncio.get_running_loop().run_in_executor(None, self._checkpoint)
+
+    def _record_error(self, idx: Optional[int], error: str):
+        item = self.items[idx] if idx is not None else {}
+        self.errors.append({"index": idx, "lead_id": item.get("lead_id"), "url": item.get("url"), "error": error[:300]})
+        del self.errors[:-MAX_RECORDED_ERRORS]
+
+    def images_per_minute(self) -> float:
+        if not self.started_at:
+            return 0.0
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return round(self.processed_this_run / elapsed * 60, 1) if elapsed > 0 else 0.0
+
+    def status_dict(self) -> Dict[str, Any]:
+        done = max(1, self.processed_this_run)
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": len(self.items),
+            "cursor": self.cursor,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "concurrency": self.concurrency,
+            "images_per_minute": self.images_per_minute(),
+            "elapsed_s": round((self.finished_at or time.time()) - self.started_at, 1) if self.started_at else 0,
+            "avg_stage_ms": {k: round(v / done * 1000) for k, v in self.stage_s.items()},
+            "errors": self.errors[-10:],
+        }
+
+    def _checkpoint(self):
+        try:
+            self.supabase.table(BATCH_TABLE).update({
+                "status": self.status,
+                "cursor": self.cursor,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "images_per_minute": self.images_per_minute(),
+                "errors": self.errors,
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }).eq("id", self.job_id).execute()
+        except Exception as e:
+            print(f"[BATCH] Checkpoint failed for {self.job_id}: {e}")
+
+
+# ── Job management ──────────────────────────────────────────────────────
+
+def create_job(supabase, lead_ids: List[str], urls: List[str],
+               concurrency: int = DEFAULT_CONCURRENCY, requested_by: Optional[str] = None) -> BatchScoringJob:
+    """Persists a new batch and returns its (not yet started) job."""
+    items = [{"lead_id": lid, "url": None} for lid in lead_ids] + [{"lead_id": None, "url": u} for u in urls]
+    resp = supabase.table(BATCH_TABLE).insert({
+        "status": "pending",
+        "items": items,
+        "total": len(items),
+        "cursor": 0,
+        "concurrency": concurrency,
+        "requested_by": requested_by,
+    }).execute()
+    job_id = resp.data[0]["id"]
+    return BatchScoringJob(supabase, job_id, items, concurrency=concurrency)
+
+
+def load_job(supabase, job_id: str, concurrency: Optional[int] = None) -> Optional[BatchScoringJob]:
+    """Rebuilds a job from its checkpoint so run() continues at the cursor."""
+    resp = supabase.table(BATCH_TABLE).select('*').eq('id', job_id).limit(1).execute()
+    if not resp.data:
+        return None
+    row = resp.data[0]
+    job = BatchScoringJob(
+        supabase, job_id, row.get("items") or [],
+        concurrency=concurrency or row.get("concurrency") or DEFAULT_CONCURRENCY,
+        cursor=row.get("cursor") or 0,
+        succeeded=row.get("succeeded") or 0,
+        failed=row.get("failed") or 0,
+    )
+    job.status = row.get("status") or "pending"
+    job.errors = row.get("errors") or []
+    return job
+
+
+def running_job(job_id: str) -> Optional[BatchScoringJob]:
+    return _jobs.get(job_id)
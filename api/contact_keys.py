@@ -0,0 +1,48 @@
+"""
+Contact Keys — normalized email / phone used to deduplicate leads.
+
+Leads arrive with free-typed contact details ("Jane@Mail.com ", "07700 900123",
+"+44 7700-900123"). create_lead stores email_norm / phone_e164 next to the raw
+values; both are unique-indexed and the upsert_lead() RPC matches on them
+(see scripts/add_lead_contact_keys.sql, whose SQL normalizers mirror these
+for the one-off backfill).
+
+Phone numbers go through a UK-first heuristic covering the formats the lead
+form actually receives. It is kept dependency-free on purpose: the SQL twin
+must produce byte-identical keys, or backfilled rows stop matching new ones.
+"""
+import os
+import re
+from typing import Optional
+
+DEFAULT_REGION = os.getenv("LEAD_PHONE_REGION", "GB")
+_DEFAULT_COUNTRY_CODE = {"GB": "44", "IE": "353", "US": "1"}.get(DEFAULT_REGION, "44")
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    if not email:
+        return None
+    email = email.strip().lower()
+    return email if "@" in email else None
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """E.164 (+447700900123) or None if it does not look like a phone number."""
+    if not phone or not phone.strip():
+        return None
+    raw = phone.strip()
+    digits = re.sub(r"\D", "", raw)
+    if raw.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith(_DEFAULT_COUNTRY_CODE) and len(digits) > 10:
+        pass  # country code typed without the +
+    elif digits.startswith("0"):
+        digits = _DEFAULT_COUNTRY_CODE + digits[1:]
+    else:
+        digits = _DEFAULT_COUNTRY_CODE + digits
+    # UK numbers written as +44 (0)7700 ...
+    if digits.startswith("440"):
+        digits = "44" + digits[3:]
+    return f"+{digits}" if 8 <= len(digits) <= 15 else None
@@ -0,0 +1,320 @@
+"""
+Gemini Gateway — one scheduler for every Gemini call in the API.
+
+Callers (scan, stats, audit, generation, form mapping) hand the gateway a
+zero-argument function that performs the request; the gateway decides when
+it runs:
+  - per-model token buckets (requests/second + burst) and concurrency caps
+  - priority classes: interactive scans jump ahead of generations, which
+    jump ahead of background form mapping; background work may only use
+    part of a model's concurrency so it can never starve users
+  - retry with full jitter on 429 / 5xx (honouring Retry-After)
+  - optional hedging for cheap calls: if the first attempt is slower than
+    the model's recent p90, a second identical request races it
+  - per-model metrics (snapshot())
+
+call() is synchronous (the existing callers are); acall() runs it in a
+worker thread for async code so queueing never blocks the event loop.
+"""
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Any, Optional
+
+from tracing import span
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_GENERATION = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_GENERATION: "generation",
+    PRIORITY_BACKGROUND: "background",
+}
+
+# Share of a model's concurrency each priority may occupy
+PRIORITY_MAX_SHARE = {
+    PRIORITY_INTERACTIVE: 1.0,
+    PRIORITY_GENERATION: 1.0,
+    PRIORITY_BACKGROUND: 0.5,
+}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_BASE_S = 1.0
+BACKOFF_CAP_S = 20.0
+HEDGE_MIN_DELAY_S = 0.75
+HEDGE_DEFAULT_DELAY_S = 3.0
+
+# rate: requests/second, burst: bucket size, concurrency: in-flight cap.
+# Override with GEMINI_LIMITS='{"gemini-2.5-flash": {"rate": 10, "burst": 20, "concurrency": 32}}'
+DEFAULT_LIMITS = {
+    "gemini-3-pro-image-preview": {"rate": 0.5, "burst": 2, "concurrency": 4},
+    "gemini-3-pro-preview": {"rate": 1.0, "burst": 3, "concurrency": 4},
+    "gemini-3-flash-preview": {"rate": 5.0, "burst": 10, "concurrency": 16},
+    "gemini-2.5-flash": {"rate": 5.0, "burst": 10, "concurrency": 16},
+}
+FALLBACK_LIMITS = {"rate": 2.0, "burst": 4, "concurrency": 8}
+
+
+class GatewayTimeout(Exception):
+    """Raised when a call waits longer than its queue timeout."""
+
+
+def _status_of(exc: Exception) -> Optional[int]:
+    """HTTP status from a requests HTTPError or a google-genai APIError."""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") if hasattr(headers, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class _ModelLane:
+    """Token bucket + concurrency slots + priority wait queue for one model."""
+
+    def __init__(self, model: str, rate: float, burst: int, concurrency: int):
+        self.model = model
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.inflight = {p: 0 for p in PRIORITY_NAMES}
+        self.waiters = []  # heap of (priority, seq)
+        self.cond = threading.Condition()
+        self.metrics = {
+            "requests": 0, "successes": 0, "failures": 0, "retries": 0,
+            "hedges": 0, "hedge_wins": 0, "queue_timeouts": 0,
+            "queue_wait_s": 0.0,
+            "by_priority": {name: 0 for name in PRIORITY_NAMES.values()},
+        }
+        self.latencies = deque(maxlen=200)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _slot_free(self, priority: int) -> bool:
+        total = sum(self.inflight.values())
+        if total >= self.concurrency:
+            return False
+        cap = max(1, int(self.concurrency * PRIORITY_MAX_SHARE[priority]))
+        return self.inflight[priority] < cap
+
+    def acquire(self, priority: int, timeout: Optional[float]) -> float:
+        """Blocks until this caller is first in line and a token + slot are free."""
+        entry = (priority, next(_seq))
+        start = time.monotonic()
+        deadline = start + timeout if timeout else None
+        with self.cond:
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    if self.waiters[0] == entry and self.tokens >= 1 and self._slot_free(priority):
+                        heapq.heappop(self.waiters)
+                        self.tokens -= 1
+                        self.inflight[priority] += 1
+                        waited = time.monotonic() - start
+                        self.metrics["queue_wait_s"] += waited
+                        self.cond.notify_all()
+                        return waited
+                    if deadline and time.monotonic() >= deadline:
+                        self.metrics["queue_timeouts"] += 1
+                        raise GatewayTimeout(f"{self.model}: queued longer than {timeout}s")
+                    # Sleep until a token should exist (or a slot is released)
+                    wait_s = max(0.01, (1 - self.tokens) / self.rate) if self.tokens < 1 else 0.25
+                    if deadline:
+                        wait_s = min(wait_s, max(0.01, deadline - time.monotonic()))
+                    self.cond.wait(wait_s)
+            except BaseException:
+                if entry in self.waiters:
+                    self.waiters.remove(entry)
+                    heapq.heapify(self.waiters)
+                    self.cond.notify_all()
+                raise
+
+    def try_acquire(self, priority: int) -> bool:
+        """Non-blocking acquire, used for hedges (never queue behind real work)."""
+        with self.cond:
+            self._refill()
+            if not self.waiters and self.tokens >= 1 and self._slot_free(priority):
+                self.tokens -= 1
+                self.inflight[priority] += 1
+                return True
+            return False
+
+    def release(self, priority: int):
+        with self.cond:
+            self.inflight[priority] -= 1
+            self.cond.notify_all()
+
+    def p90_latency(self) -> Optional[float]:
+        if len(self.latencies) < 10:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.9 * (len(ordered) - 1))]
+
+
+_seq = itertools.count()
+
+
+class GeminiGateway:
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self._lanes: Dict[str, _ModelLane] = {}
+        self._lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gemini-hedge")
+
+    def _lane(self, model: str) -> _ModelLane:
+        with self._lock:
+            lane = self._lanes.get(model)
+            if lane is None:
+                cfg = self.limits.get(model, FALLBACK_LIMITS)
+                lane = _ModelLane(model, cfg["rate"], int(cfg["burst"]), int(cfg["concurrency"]))
+                self._lanes[model] = lane
+            return lane
+
+    def call(
+        self,
+        model: str,
+        fn: Callable[[], Any],
+        priority: int = PRIORITY_GENERATION,
+        hedge: bool = False,
+        max_retries: int = MAX_RETRIES,
+        queue_timeout: Optional[float] = 120.0
+    ) -> Any:
+        """
+        Runs fn() under the model's rate limit at the given priority.
+        fn must raise on HTTP errors (e.g. response.raise_for_status()) so
+        429/5xx can be retried; its return value is passed through.
+        The whole call, queueing and retries included, is one "gemini" span.
+        """
+        lane = self._lane(model)
+        lane.metrics["by_priority"][PRIORITY_NAMES[priority]] += 1
+        with span("gemini", model):
+            attempt = 0
+            while True:
+                lane.acquire(priority, queue_timeout)
+                lane.metrics["requests"] += 1
+                t0 = time.perf_counter()
+                try:
+                    if hedge:
+                        result = self._run_hedged(lane, fn, priority)
+                    else:
+                        try:
+                            result = fn()
+                        finally:
+                            lane.release(priority)
+                    lane.latencies.append(time.perf_counter() - t0)
+                    lane.metrics["successes"] += 1
+                    return result
+                except GatewayTimeout:
+                    raise
+                except Exception as e:
+                    status = _status_of(e)
+                    if status not in RETRYABLE_STATUS or attempt >= max_retries:
+                        lane.metrics["failures"] += 1
+                        raise
+                    delay = _retry_after(e)
+                    if delay is None:
+                        delay = random.uniform(0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * 2 ** attempt))
+                    attempt += 1
+                    lane.metrics["retries"] += 1
+                    print(f"[GEMINI] {model} returned {status}; retry {attempt}/{max_retries} in {delay:.1f}s")
+                    time.sleep(delay)
+
+    def _run_hedged(self, lane: _ModelLane, fn: Callable[[], Any], priority: int) -> Any:
+        """Primary attempt, plus one hedge if it is slower than the recent p90."""
+        def run_primary():
+            try:
+                return fn()
+            finally:
+                lane.release(priority)
+
+        primary = self._hedge_pool.submit(run_primary)
+        delay = max(HEDGE_MIN_DELAY_S, lane.p90_latency() or HEDGE_DEFAULT_DELAY_S)
+        done, _ = wait([primary], timeout=delay)
+        if done or not lane.try_acquire(priority):
+            return primary.result()
+
+        lane.metrics["hedges"] += 1
+
+        def run_hedge():
+            try:
+                return fn()
+            finally:
+                lane.release(priority)
+
+        backup = self._hedge_pool.submit(run_hedge)
+        pending = {primary, backup}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    if fut is backup:
+                        lane.metrics["hedge_wins"] += 1
+                    return fut.result()
+                first_error = first_error or fut.exception()
+        raise first_error
+
+    async def acall(self, model: str, fn: Callable[[], Any], **kwargs) -> Any:
+        """Async wrapper: queueing and the blocking request run off the event loop."""
+        return await asyncio.to_thread(self.call, model, fn, **kwargs)
+
+    def snapshot(self) -> Dict[str, Any]:
+        out = {}
+        with self._lock:
+            lanes = list(self._lanes.values())
+        for lane in lanes:
+            lat = sorted(lane.latencies)
+            pct = lambda q: round(lat[int(q * (len(lat) - 1))], 3) if lat else None
+            out[lane.model] = {
+                **lane.metrics,
+                "queue_wait_s": round(lane.metrics["queue_wait_s"], 3),
+                "inflight": sum(lane.inflight.values()),
+                "queued": len(lane.waiters),
+                "tokens": round(lane.tokens, 2),
+                "latency_s": {"p50": pct(0.5), "p90": pct(0.9), "p99": pct(0.99)},
+            }
+        return out
+
+
+def _limits_from_env() -> Optional[Dict[str, Dict[str, float]]]:
+    raw = os.getenv("GEMINI_LIMITS")
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except Exception as e:
+        print(f"[GEMINI] Ignoring invalid GEMINI_LIMITS: {e}")
+        return None
+
+
+gemini_gateway = GeminiGateway(_limits_from_env())
@@ -0,0 +1,115 @@
+"""
+Gemini HTTP — one pooled, keep-alive client for the REST Gemini callers.
+
+analyze_image, analyze_model_stats and gemini_map_fields used to open a new
+TCP + TLS connection per request via bare requests.post(). They now share
+this client instead:
+  - httpx with HTTP/2 when httpx + h2 are installed (one multiplexed
+    connection to generativelanguage.googleapis.com)
+  - otherwise a requests.Session with a sized urllib3 pool (HTTP/1.1
+    keep-alive)
+
+stats() reports requests vs. connections opened, i.e. how often a call
+reused a warm connection instead of paying a fresh handshake.
+"""
+import threading
+from typing import Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+try:
+    import h2  # noqa: F401 — presence enables httpx HTTP/2
+    HAS_H2 = True
+except ImportError:
+    HAS_H2 = False
+
+POOL_CONNECTIONS = 20
+POOL_MAXSIZE = 50
+
+
+class GeminiHttpClient:
+    def __init__(self, verify=True, prefer_httpx: bool = True):
+        self.verify = verify
+        self.backend = "httpx" if (prefer_httpx and HAS_HTTPX) else "requests"
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "http_versions": {}}
+        self._streams = set()  # httpx: ids of network streams seen
+
+        if self.backend == "httpx":
+            self._client = httpx.Client(
+                http2=HAS_H2,
+                verify=verify,
+                limits=httpx.Limits(max_keepalive_connections=POOL_CONNECTIONS, max_connections=POOL_MAXSIZE),
+            )
+        else:
+            self._client = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            self._client.mount("https://", adapter)
+            self._client.mount("http://", adapter)
+
+    def post_json(self, url: str, payload: Dict[str, Any], timeout: float = 30):
+        """
+        POSTs JSON and returns the response (requests.Response or
+        httpx.Response — both expose .json(), .text, .status_code and
+        .raise_for_status()).
+        """
+        if self.backend == "httpx":
+            resp = self._client.post(url, json=payload, timeout=timeout)
+        else:
+            # Per-request verify: requests would otherwise let REQUESTS_CA_BUNDLE override the session's
+            resp = self._client.post(url, json=payload, timeout=timeout, verify=self.verify)
+        self._record(resp)
+        return resp
+
+    def _record(self, resp):
+        with self._lock:
+            self._stats["requests"] += 1
+            version = getattr(resp, "http_version", None)
+            if version is None:
+                raw = getattr(resp, "raw", None)
+                version = {10: "HTTP/1.0", 11: "HTTP/1.1", 20: "HTTP/2"}.get(getattr(raw, "version", None), "unknown")
+            versions = self._stats["http_versions"]
+            versions[version] = versions.get(version, 0) + 1
+            if self.backend == "httpx":
+                stream = (getattr(resp, "extensions", None) or {}).get("network_stream")
+                if stream is not None:
+                    self._streams.add(id(stream))
+
+    def _connections_opened(self) -> Optional[int]:
+        if self.backend == "httpx":
+            return len(self._streams)
+        total = 0
+        for adapter in self._client.adapters.values():
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                total += getattr(pool, "num_connections", 0) if pool else 0
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests_made = self._stats["requests"]
+            versions = dict(self._stats["http_versions"])
+        opened = self._connections_opened()
+        reused = max(0, requests_made - opened) if opened is not None else None
+        return {
+            "backend": self.backend,
+            "http2": self.backend == "httpx" and HAS_H2,
+            "requests": requests_made,
+            "connections_opened": opened,
+            "reused_requests": reused,
+            "reuse_ratio": round(reused / requests_made, 3) if requests_made and reused is not None else None,
+            "http_versions": versions,
+        }
+
+    def close(self):
+        self._client.close()
+
+
+gemini_http = GeminiHttpClient()
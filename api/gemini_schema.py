@@ -0,0 +1,401 @@
+"""
+Gemini Schema — response schemas, fast parsing and JSON repair for the
+JSON-returning Gemini calls (scan, audit, form mapping).
+
+Each ResponseSchema holds a schema in Gemini's OpenAPI subset. The same
+dict is sent as response_schema so the model is constrained at generation
+time, and is compiled once into a tree of small validator closures used
+locally after every reply:
+  1. fast load (orjson when installed, else json)
+  2. on a parse error, repair near-valid JSON: strip fences / prose,
+     drop trailing commas, close a truncated string and open brackets
+     (cutting back to the last complete element if needed)
+  3. validate + coerce: "7" → 7, "true" → True, 7 → "7" for strings,
+     case-insensitive enums; array items that still fail are dropped
+
+Only a reply that survives none of this raises ResponseParseError, which
+is what callers treat as "ask the model again". Per-schema counters
+(ok / repaired / coerced / rejected / rerequests) show how many round trips
+repair saved; see schema_stats.snapshot().
+"""
+import re
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+class ResponseParseError(ValueError):
+    """Reply could not be parsed/repaired into something the schema accepts."""
+
+
+def fast_loads(text: str) -> Any:
+    if HAS_ORJSON:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError as e:
+            raise json.JSONDecodeError(str(e), text, 0)
+    return json.loads(text)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Repair
+# ──────────────────────────────────────────────────────────────────────────────
+
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```\s*$")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _close(prefix: str, stack: List[str], in_string: bool) -> str:
+    out = prefix + ('"' if in_string else "")
+    out = out.rstrip().rstrip(",").rstrip()
+    if out.endswith(":"):
+        out += " null"
+    return out + "".join(_CLOSERS[c] for c in reversed(stack))
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    Best-effort fix-up of near-valid JSON. Returns a candidate string (which
+    the caller still has to load) or None if there is no JSON to salvage.
+    """
+    text = _FENCE_RE.sub("", text.strip())
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    text = text[min(starts):]
+
+    out = []
+    stack: List[str] = []
+    opened: List[int] = []  # len(out) where each stack entry was opened
+    in_string = escaped = False
+    cut_points: List[Tuple[int, Tuple[str, ...]]] = []  # (len(out) before a comma, stack)
+
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+            opened.append(len(out))
+        elif ch in "}]":
+            # Trailing comma before a closer
+            while out and out[-1] in " \t\r\n,":
+                out.pop()
+            if not stack:
+                break
+            stack.pop()
+            opened.pop()
+            out.append(ch)
+            if not stack:
+                break  # drop trailing prose after the top-level value
+            continue
+        elif ch == ",":
+            cut_points.append((len(out), tuple(stack)))
+        out.append(ch)
+
+    candidate = "".join(out)
+    if not stack and not in_string:
+        return candidate
+
+    # Truncated reply. The element being written when the reply stopped is
+    # probably incomplete (half a selector, or an action whose "value" never
+    # arrived), so first drop back to the last complete array element; then
+    # try the old order: a value cut mid-string is probably wrong, so prefer
+    # the last complete member to closing it as is.
+    closed = _close(candidate, stack, in_string)
+    element_cuts = []
+    if "[" in stack:
+        depth = len(stack) - stack[::-1].index("[")  # innermost open array, as a stack prefix
+        element_cuts = [_close(candidate[:pos], list(cut_stack), False)
+                        for pos, cut_stack in reversed(cut_points)
+                        if cut_stack == tuple(stack[:depth]) and pos > opened[depth - 1]][:1]
+    attempts = [_close(candidate[:pos], list(cut_stack), False) for pos, cut_stack in reversed(cut_points)]
+    attempts = element_cuts + (attempts + [closed] if in_string else [closed] + attempts)
+    for attempt in attempts:
+        try:
+            fast_loads(attempt)
+            return attempt
+        except (json.JSONDecodeError, ValueError):
+            continue
+    return closed
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Compiled validators
+# ──────────────────────────────────────────────────────────────────────────────
+
+# A validator takes (value, path, notes) and returns the coerced value or
+# raises _Invalid. notes collects coercions so they can be counted.
+Validator = Callable[[Any, str, "_Notes"], Any]
+
+
+class _Invalid(Exception):
+    pass
+
+
+class _Notes(list):
+    """Coercion notes for one parse; strict=False lets missing fields through."""
+
+    def __init__(self, strict: bool):
+        super().__init__()
+        self.strict = strict
+
+
+def _compile(schema: Dict[str, Any]) -> Validator:
+    kind = schema.get("type", "").upper()
+    nullable = schema.get("nullable", False)
+
+    if kind == "OBJECT":
+        props = {k: _compile(v) for k, v in schema.get("properties", {}).items()}
+        required = list(schema.get("required", []))
+
+        def check(value, path, notes):
+            if not isinstance(value, dict):
+                raise _Invalid(f"{path}: expected object")
+            for key in required:
+                if key not in value:
+                    if notes.strict:
+                        raise _Invalid(f"{path}.{key}: missing")
+                    notes.append(f"{path}.{key}: missing")
+            out = dict(value)
+            for key, sub in props.items():
+                if key in out:
+                    out[key] = sub(out[key], f"{path}.{key}", notes)
+            return out
+
+    elif kind == "ARRAY":
+        item = _compile(schema.get("items", {}))
+
+        def check(value, path, notes):
+            if not isinstance(value, list):
+                raise _Invalid(f"{path}: expected array")
+            out = []
+            for i, v in enumerate(value):
+                try:
+                    out.append(item(v, f"{path}[{i}]", notes))
+                except _Invalid as e:
+                    notes.append(f"dropped {e}")
+            return out
+
+    elif kind == "STRING":
+        enum = {str(e).lower(): e for e in schema.get("enum", [])}
+
+        def check(value, path, notes):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                notes.append(f"{path}: number→string")
+                value = str(value)
+            if not isinstance(value, str):
+                raise _Invalid(f"{path}: expected string")
+            if enum:
+                canonical = enum.get(value.strip().lower())
+                if canonical is None:
+                    raise _Invalid(f"{path}: {value!r} not in enum")
+                if canonical != value:
+                    notes.append(f"{path}: enum case")
+                value = canonical
+            return value
+
+    elif kind in ("INTEGER", "NUMBER"):
+        want_int = kind == "INTEGER"
+
+        def check(value, path, notes):
+            if isinstance(value, bool):
+                raise _Invalid(f"{path}: expected number")
+            if isinstance(value, str):
+                try:
+                    value = float(value.strip())
+                except ValueError:
+                    raise _Invalid(f"{path}: expected number")
+                notes.append(f"{path}: string→number")
+            if not isinstance(value, (int, float)):
+                raise _Invalid(f"{path}: expected number")
+            if want_int and not isinstance(value, int):
+                if value != int(value):
+                    notes.append(f"{path}: rounded")
+                value = int(round(value))
+            return value
+
+    elif kind == "BOOLEAN":
+        def check(value, path, notes):
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+                notes.append(f"{path}: string→bool")
+                return value.strip().lower() == "true"
+            raise _Invalid(f"{path}: expected boolean")
+
+    else:
+        def check(value, path, notes):
+            return value
+
+    if not nullable:
+        return check
+
+    def check_nullable(value, path, notes):
+        return None if value is None else check(value, path, notes)
+    return check_nullable
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Counters
+# ──────────────────────────────────────────────────────────────────────────────
+
+class SchemaStats:
+    FIELDS = ("ok", "repaired", "coerced", "rejected", "rerequests")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def incr(self, name: str, field: str):
+        with self._lock:
+            counts = self._counts.setdefault(name, {f: 0 for f in self.FIELDS})
+            counts[field] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {name: dict(c) for name, c in self._counts.items()}
+        for c in out.values():
+            # Every repaired reply is a Gemini round trip we did not repeat
+            c["rerequests_avoided"] = c["repaired"]
+        return out
+
+
+schema_stats = SchemaStats()
+
+
+class ResponseSchema:
+    def __init__(self, name: str, schema: Dict[str, Any]):
+        self.name = name
+        self.schema = schema
+        self._validate = _compile(schema)
+
+    def generation_config(self) -> Dict[str, Any]:
+        """REST generationConfig fields constraining the reply to this schema."""
+        return {"response_mime_type": "application/json", "response_schema": self.schema}
+
+    def parse(self, text: str, strict: bool = True) -> Any:
+        """
+        Loads, repairs and validates a model reply. With strict=False missing
+        required fields are only noted (the caller fills defaults); wrong
+        types still raise.
+        """
+        repaired = False
+        try:
+            value = fast_loads(text)
+        except (json.JSONDecodeError, ValueError):
+            fixed = repair_json(text or "")
+            try:
+                value = fast_loads(fixed) if fixed else None
+            except (json.JSONDecodeError, ValueError):
+                value = None
+            if value is None:
+                schema_stats.incr(self.name, "rejected")
+                raise ResponseParseError(f"{self.name}: unparseable reply: {(text or '')[:200]!r}")
+            repaired = True
+
+        notes = _Notes(strict)
+        try:
+            value = self._validate(value, "$", notes)
+        except _Invalid as e:
+            schema_stats.incr(self.name, "rejected")
+            raise ResponseParseError(f"{self.name}: {e}")
+
+        if repaired:
+            schema_stats.incr(self.name, "repaired")
+        elif notes:
+            schema_stats.incr(self.name, "coerced")
+        else:
+            schema_stats.incr(self.name, "ok")
+        if repaired or notes:
+            print(f"[SCHEMA] {self.name}: repaired={repaired} notes={notes[:5]}")
+        return value
+
+    def note_rerequest(self):
+        schema_stats.incr(self.name, "rerequests")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Schemas
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Free-form strings on purpose: "N/A" / "Unknown" face geometry is how the
+# scan signals "no face", so these cannot be enums.
+SCAN_SCHEMA = ResponseSchema("scan", {
+    "type": "OBJECT",
+    "properties": {
+        "face_geometry": {
+            "type": "OBJECT",
+            "properties": {
+                "primary_shape": {"type": "STRING"},
+                "jawline_definition": {"type": "STRING"},
+                "structural_note": {"type": "STRING"},
+            },
+            "required": ["primary_shape", "jawline_definition", "structural_note"],
+        },
+        "market_categorization": {
+            "type": "OBJECT",
+            "properties": {
+                "primary": {"type": "STRING"},
+                "rationale": {"type": "STRING"},
+            },
+            "required": ["primary", "rationale"],
+        },
+        "aesthetic_audit": {
+            "type": "OBJECT",
+            "properties": {
+                "lighting_quality": {"type": "STRING"},
+                "professional_readiness": {"type": "STRING"},
+                "technical_flaw": {"type": "STRING"},
+            },
+            "required": ["lighting_quality", "professional_readiness", "technical_flaw"],
+        },
+        "suitability_score": {"type": "INTEGER"},
+        "scout_feedback": {"type": "STRING"},
+    },
+    "required": ["face_geometry", "market_categorization", "aesthetic_audit",
+                 "suitability_score", "scout_feedback"],
+})
+
+AUDIT_SCHEMA = ResponseSchema("audit", {
+    "type": "OBJECT",
+    "properties": {
+        "score": {"type": "INTEGER"},
+        "issues": {
+            "type": "ARRAY",
+            "items": {"type": "STRING", "enum": ["no_face", "too_dark", "blurry", "obstructed"]},
+        },
+        "can_proceed": {"type": "BOOLEAN"},
+    },
+    "required": ["score", "issues", "can_proceed"],
+})
+
+FORM_ACTIONS_SCHEMA = ResponseSchema("form_actions", {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "action": {"type": "STRING", "enum": ["fill", "select", "check", "upload", "click"]},
+            "selector": {"type": "STRING"},
+            "value": {"type": "STRING"},
+            "files": {"type": "ARRAY", "items": {"type": "STRING"}},
+            # user-data key, "constant" or "generated" — decides what a cached step plan may reuse
+            "source": {"type": "STRING"},
+        },
+        "required": ["action", "selector"],
+    },
+})
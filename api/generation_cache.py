@@ -0,0 +1,99 @@
+"""
+Generation Cache — reuse Photo Lab outputs for identical requests.
+
+A generation is identified by the sorted content hashes of its reference
+images plus the model, system instruction, user prompt and thinking budget.
+Outputs are stored in the 'generated' bucket under cache/<key> and indexed in
+the public.generation_cache table (see scripts/create_generation_cache.sql).
+
+Opt-in: set GENERATION_CACHE=true (or pass use_cache=True to
+process_digitals). Callers pass regenerate=True to skip the lookup; the fresh
+result then replaces the cached one.
+"""
+import os
+import json
+import hashlib
+from typing import Optional, Dict, Any, List
+
+from service_client import get_service_client
+from tracing import log_event
+
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE", "false").lower() == "true"
+CACHE_BUCKET = "generated"
+CACHE_TABLE = "generation_cache"
+CACHE_PREFIX = "cache"
+
+_MIME_EXT = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+
+
+def generation_cache_key(
+    reference_hashes: List[str],
+    system_instruction: str,
+    user_prompt: str,
+    thinking_budget: int,
+    model: str
+) -> str:
+    """Deterministic key: reference order does not matter, prompt text does."""
+    material = json.dumps({
+        "model": model,
+        "refs": sorted(reference_hashes),
+        "system": system_instruction,
+        "prompt": user_prompt,
+        "thinking_budget": int(thinking_budget),
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def lookup(cache_key: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns {"image_bytes": bytes, "mime_type": str, "public_url": str} for a
+    cached generation, or None on miss / any storage error.
+    """
+    try:
+        supabase = get_service_client()
+        resp = supabase.table(CACHE_TABLE).select('storage_path, mime_type, public_url') \
+            .eq('cache_key', cache_key).limit(1).execute()
+        if not resp.data:
+            return None
+        row = resp.data[0]
+        image_bytes = supabase.storage.from_(CACHE_BUCKET).download(row['storage_path'])
+        if not image_bytes:
+            return None
+        log_event("generation_cache.hit", key=cache_key[:12], bytes=len(image_bytes))
+        return {
+            "image_bytes": image_bytes,
+            "mime_type": row.get('mime_type') or "image/jpeg",
+            "public_url": row.get('public_url'),
+        }
+    except Exception as e:
+        log_event("generation_cache.lookup_failed", key=cache_key[:12], error=str(e))
+        return None
+
+
+def store(cache_key: str, image_bytes: bytes, mime_type: str, meta: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Uploads the output and upserts its index row. Returns the public URL, or None on failure."""
+    try:
+        supabase = get_service_client()
+        ext = _MIME_EXT.get(mime_type, "jpg")
+        path = f"{CACHE_PREFIX}/{cache_key}.{ext}"
+        supabase.storage.from_(CACHE_BUCKET).upload(
+            path=path,
+            file=image_bytes,
+            file_options={"content-type": mime_type, "upsert": "true"}
+        )
+        public_url = supabase.storage.from_(CACHE_BUCKET).get_public_url(path)
+
+        row = {
+            'cache_key': cache_key,
+            'storage_path': path,
+            'public_url': public_url,
+            'mime_type': mime_type,
+        }
+        if meta:
+            row.update(meta)
+        supabase.table(CACHE_TABLE).upsert(row).execute()
+        log_event("generation_cache.stored", key=cache_key[:12], path=path)
+        return public_url
+    except Exception as e:
+        log_event("generation_cache.store_failed", key=cache_key[:12], error=str(e))
+        return None
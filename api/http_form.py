@@ -0,0 +1,392 @@
+"""
+HTTP Form — submit plain HTML application forms without a browser.
+
+Many agency pages are a static <form method="post"> that the browser
+submits natively, yet each application still cost a Browserless session.
+After a successful browser run the apply engine looks at how the form went
+out: when the submit was a document POST (not fetch/XHR), the posted body
+is classified field by field and stored in agencies.http_form:
+
+  - "user"       a user field's value (first_name, email, ...)
+  - "constant"   the same for every applicant: the submit button's name,
+                 consent boxes, untouched checkbox / radio defaults (values
+                 from the markup, never from what a user typed)
+  - "fresh"      hidden inputs (CSRF tokens, nonces), re-read from a fresh GET;
+                 nothing of their first-run value is stored
+  - "file"       photo uploads ("headshot" / "fullbody" / "both")
+  - "generated"  written or converted by Gemini (introductions, cm → feet);
+                 re-mapped from the stored compact field line
+
+Later applications to that agency skip the browser: one GET for cookies and
+fresh tokens, then one POST with the (compressed, in-memory) photos. Anything
+that does not line up (form changed, option missing, Gemini failure, or a
+POST without a confirmation: thank-you text, or the success URL seen in the
+browser run) returns "fallback" so the browser runs instead and the
+classification is cleared. A form whose untouched visible fields were
+posted with values (JS-computed names, prefilled text) is not classified:
+those values belong to the first applicant.
+
+APPLY_HTTP_FAST_PATH=false turns classification and use off.
+"""
+import os
+import re
+import asyncio
+import logging
+from datetime import datetime, timezone
+from email import policy
+from email.parser import BytesParser
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urljoin, urldefrag, urlsplit
+
+import httpx
+
+from ai_form_agent import gemini_map_fields, photos_for, photo_payload, PhotoFiles, SUCCESS_PATTERN
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+HTTP_FAST_PATH = os.getenv("APPLY_HTTP_FAST_PATH", "true").lower() != "false"
+HTTP_TIMEOUT_S = 30
+SPEC_VERSION = 2  # 1 stored first-run values for unseen / untouched fields
+
+_SUCCESS_RE = re.compile(SUCCESS_PATTERN, re.IGNORECASE)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Classification — after a browser run
+# ──────────────────────────────────────────────────────────────────────────────
+
+class PostCapture:
+    """Records the document POSTs (native form submits) a page makes, and where they landed."""
+
+    def __init__(self):
+        self.posts: List[Dict[str, Any]] = []
+        self.landing = None  # last main-frame document response (not a redirect)
+        self._page = None
+
+    def attach(self, page):
+        self._page = page
+        page.on("request", self._on_request)
+        page.on("response", self._on_response)
+        return self
+
+    def detach(self):
+        if self._page is not None:
+            self._page.remove_listener("request", self._on_request)
+            self._page.remove_listener("response", self._on_response)
+            self._page = None
+
+    def _on_response(self, response):
+        try:
+            request = response.request
+            if (request.resource_type == "document" and request.frame == request.frame.page.main_frame
+                    and not 300 <= response.status < 400):
+                self.landing = response
+        except Exception as e:
+            logger.debug(f"POST capture skipped a response: {e}")
+
+    async def landing_html(self) -> str:
+        """Server HTML of the page the submit landed on — what a replay POST gets back."""
+        if self.landing is None:
+            return ""
+        try:
+            return await self.landing.text()
+        except Exception:
+            return ""
+
+    def _on_request(self, request):
+        try:
+            if request.method == "POST" and request.resource_type == "document" and request.is_navigation_request():
+                self.posts.append({
+                    "url": request.url,
+                    "content_type": request.headers.get("content-type", ""),
+                    "body": request.post_data_buffer or b"",
+                })
+        except Exception as e:
+            logger.debug(f"POST capture skipped a request: {e}")
+
+
+def _parse_body(content_type: str, body: bytes) -> List[Tuple[str, str, bool]]:
+    """[(name, value or filename, is_file)] from a captured form body."""
+    if content_type.startswith("multipart/form-data"):
+        msg = BytesParser(policy=policy.HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+        fields = []
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name is None:
+                continue
+            filename = part.get_filename()
+            if filename is not None:
+                fields.append((name, filename, True))
+            else:
+                payload = part.get_payload(decode=True) or b""
+                fields.append((name, payload.decode(part.get_content_charset() or "utf-8", "replace"), False))
+        return fields
+    return [(k, v, False) for k, v in parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True)]
+
+
+def classify(capture: PostCapture, snapshot: Dict[str, Any], actions: List[Dict[str, Any]],
+             user_values: Dict[str, str], page_url: str, success_url: str,
+             landing_html: str = "") -> Optional[Dict[str, Any]]:
+    """
+    The agencies.http_form spec for a form that was just submitted
+    successfully by the browser, or None when it cannot be replayed over
+    HTTP (no native POST, e.g. fetch/XHR submits, or an unreadable body) or
+    a replay could not confirm it: the submit must land on a different path
+    or on server HTML (landing_html) with thank-you text.
+    """
+    if len(capture.posts) != 1 or not snapshot.get("fields"):
+        return None
+    success_path = urlsplit(success_url).path
+    if success_path == urlsplit(page_url).path:
+        success_path = None
+    if success_path is None and not _SUCCESS_RE.search(landing_html):
+        logger.info("HTTP form: no success URL or thank-you text to confirm a replay by — not classified")
+        return None
+    post = capture.posts[0]
+    content_type = post["content_type"].lower()
+    if not post["body"] or not content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+        return None
+    try:
+        posted = _parse_body(post["content_type"], post["body"])
+    except Exception as e:
+        logger.info(f"HTTP form: unreadable POST body ({e})")
+        return None
+
+    by_name: Dict[str, List[Dict[str, Any]]] = {}
+    for field in snapshot["fields"]:
+        if field.get("name"):
+            by_name.setdefault(field["name"], []).append(field)
+    action_for = {a["selector"]: a for a in actions if a.get("selector")}
+    lines = snapshot.get("form_fields", "").split("\n")
+
+    spec_fields, generated = [], set()
+    for name, value, is_file in posted:
+        entries = by_name.get(name, [])
+        acted = [e for e in entries if e["sel"] in action_for]
+        # Radios / checkbox groups: the entry whose value was posted
+        entry = next((e for e in acted if e.get("value") == value), acted[0] if acted else None)
+        action = action_for[entry["sel"]] if entry else None
+        source = (action or {}).get("source")
+
+        if is_file:
+            if value:
+                spec_fields.append({"name": name, "kind": "file", "files": (action or {}).get("files") or ["headshot"]})
+        elif not entries:
+            # Not in the snapshot, which skips hidden inputs: must still be hidden at replay
+            spec_fields.append({"name": name, "kind": "fresh"})
+        elif any(e["button"] for e in entries):
+            spec_fields.append({"name": name, "kind": "constant", "value": value})
+        elif source in user_values and (value == user_values[source] or action.get("action") == "select"):
+            spec_fields.append({"name": name, "kind": "user", "key": source})
+        elif action is None:
+            if value and not any(e.get("value") == value for e in entries):
+                logger.info(f"HTTP form: untouched field '{name}' was posted with a value — not classified")
+                return None
+            spec_fields.append({"name": name, "kind": "constant", "value": value})  # "" or a markup value
+        elif source == "constant":
+            spec_fields.append({"name": name, "kind": "constant", "value": value})
+        elif name not in generated:
+            generated.add(name)
+            spec_fields.append({
+                "name": name, "kind": "generated",
+                "line": lines[entries[0]["line"]] if entries[0]["line"] < len(lines) else "",
+                "choices": {e["sel"]: e.get("value") for e in entries},
+            })
+
+    # Chromium may leave file parts out of the captured body: take them from the plan
+    posted_names = {name for name, _, _ in posted}
+    for action in actions:
+        if action.get("action") != "upload":
+            continue
+        field = next((f for f in snapshot["fields"] if f["sel"] == action.get("selector")), None)
+        if field and field.get("name") and field["name"] not in posted_names:
+            spec_fields.append({"name": field["name"], "kind": "file", "files": action.get("files") or ["headshot"]})
+
+    return {
+        "version": SPEC_VERSION,
+        "page_url": page_url,
+        "action": urldefrag(post["url"])[0],
+        "enctype": "multipart/form-data" if content_type.startswith("multipart/") else "application/x-www-form-urlencoded",
+        "fields": spec_fields,
+        "success_path": success_path,
+        "classified_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Replay — one GET + one POST
+# ──────────────────────────────────────────────────────────────────────────────
+
+class _FormParser(HTMLParser):
+    """Forms on a page: action, method and fields (type, first value, select options)."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms: List[Dict[str, Any]] = []
+        self._form = None
+        self._select = None
+        self._option = None
+
+    def handle_starttag(self, tag, attrs):
+        a = dict(attrs)
+        if tag == "form":
+            self._form = {"action": a.get("action") or "", "method": (a.get("method") or "get").lower(), "fields": {}}
+            self.forms.append(self._form)
+        elif self._form is None:
+            return
+        elif tag in ("input", "textarea", "button") and a.get("name"):
+            kind = (a.get("type") or ("text" if tag != "button" else "submit")).lower()
+            self._form["fields"].setdefault(a["name"], {"type": kind, "value": a.get("value") or "", "options": []})
+        elif tag == "select" and a.get("name"):
+            self._select = self._form["fields"].setdefault(a["name"], {"type": "select", "value": "", "options": []})
+        elif tag == "option" and self._select is not None:
+            self._option = [a.get("value"), ""]
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == "option" and self._option is not None:
+            value, text = self._option
+            text = " ".join(text.split())
+            self._select["options"].append((text if value is None else value, text))
+            self._option = None
+        elif tag == "select":
+            self._select = None
+        elif tag == "form":
+            self._form = None
+
+
+class Fallback(Exception):
+    """The stored spec no longer fits the page; use the browser."""
+
+
+def _match_option(options: List[Tuple[str, str]], wanted: str) -> str:
+    """Option value for wanted: exact value, exact text, then substring (like _safe_select)."""
+    target = wanted.strip().lower()
+    for value, text in options:
+        if value.lower() == target or text.lower() == target:
+            return value
+    for value, text in options:
+        if target and (target in text.lower() or target in value.lower()):
+            return value
+    raise Fallback(f"no option matching '{wanted}'")
+
+
+def _generated_values(spec_fields, user_data) -> Dict[str, List[str]]:
+    """Re-maps the "generated" fields with Gemini from their stored compact lines."""
+    wanted = [f for f in spec_fields if f["kind"] == "generated"]
+    if not wanted:
+        return {}
+    name_of = {sel: f["name"] for f in wanted for sel in f["choices"]}
+    text = "\n".join(dict.fromkeys(f["line"] for f in wanted if f["line"]))
+    try:
+        actions = gemini_map_fields(text, user_data, True)
+    except Exception as e:
+        raise Fallback(f"Gemini re-mapping failed: {e}")
+    values: Dict[str, List[str]] = {}
+    for action in actions:
+        name = name_of.get(action.get("selector"))
+        if name is None or action.get("action") == "click":
+            continue
+        if action.get("action") == "check":
+            values.setdefault(name, []).append(
+                next(f for f in wanted if f["name"] == name)["choices"].get(action["selector"]) or "on")
+        else:
+            values.setdefault(name, []).append(str(action.get("value", "")))
+    return values
+
+
+async def submit(spec: Dict[str, Any], user_data: Dict[str, Any], user_values: Dict[str, str],
+                 user_agent: str, photo_files: Optional[PhotoFiles] = None) -> Dict[str, Any]:
+    """
+    Replays a classified form. Returns {"status": "applied" | "fallback",
+    "errors": [...], "http_status": int | None}; "fallback" (nothing posted,
+    or a POST that could not be confirmed) hands over to the browser.
+    photo_files: see ai_form_agent.prefetch_photos.
+    """
+    page_url, action_url = spec["page_url"], spec["action"]
+    origin = "{0.scheme}://{0.netloc}".format(urlsplit(page_url))
+    async with httpx.AsyncClient(follow_redirects=True, timeout=HTTP_TIMEOUT_S,
+                                 headers={"User-Agent": user_agent, "Accept-Language": "en-GB,en;q=0.9"}) as client:
+        try:
+            with span("http_form", "get"):
+                page = await client.get(page_url)
+            page.raise_for_status()
+            parser = _FormParser()
+            parser.feed(page.text)
+            form = next((f for f in parser.forms if f["method"] == "post"
+                         and urldefrag(urljoin(str(page.url), f["action"]))[0] == action_url), None)
+            if form is None:
+                raise Fallback("form not found on the page")
+
+            data: Dict[str, List[str]] = {}
+            generated = await asyncio.to_thread(_generated_values, spec["fields"], user_data)
+            file_fields = []
+            for field in spec["fields"]:
+                name, kind = field["name"], field["kind"]
+                live = form["fields"].get(name)
+                if kind == "file":
+                    file_fields.append(field)
+                    continue
+                if live is None:
+                    raise Fallback(f"field '{name}' is gone")
+                if kind == "fresh":
+                    if live["type"] != "hidden":
+                        raise Fallback(f"field '{name}' is no longer hidden")
+                    value = live["value"]
+                elif kind == "constant":
+                    value = field["value"]
+                elif kind == "user":
+                    if field["key"] not in user_values:
+                        continue  # as Gemini would: no data, field skipped
+                    value = user_values[field["key"]]
+                else:
+                    for value in generated.get(name, []):
+                        data.setdefault(name, []).append(
+                            _match_option(live["options"], value) if live["type"] == "select" else value)
+                    continue
+                if live["type"] == "select" and kind != "fresh":
+                    value = _match_option(live["options"], value)
+                data.setdefault(name, []).append(value)
+
+            files = []
+            photo_urls = user_data.get("generated_photos", [])
+            for field in file_fields:
+                for url in photos_for(field["files"], photo_urls):
+                    payload = await photo_payload(url, photo_files)
+                    if payload:
+                        files.append((field["name"], (payload["name"], payload["buffer"], payload["mimeType"])))
+            if file_fields and not files:
+                raise Fallback("photos could not be downloaded")
+        except Fallback as e:
+            return {"status": "fallback", "errors": [f"HTTP fast path: {e}"], "http_status": None}
+        except httpx.HTTPError as e:
+            return {"status": "fallback", "errors": [f"HTTP fast path: GET failed: {e}"], "http_status": None}
+
+        try:
+            headers = {"Referer": str(page.url), "Origin": origin}
+            with span("http_form", "post"):
+                if spec["enctype"] == "multipart/form-data":
+                    # Values as (filename-less) parts: with no photo httpx would
+                    # otherwise fall back to a urlencoded body
+                    parts = [(name, (None, value)) for name, values in data.items() for value in values]
+                    resp = await client.post(action_url, files=parts + files, headers=headers)
+                else:
+                    resp = await client.post(action_url, data=data, headers=headers)
+        except httpx.HTTPError as e:
+            return {"status": "fallback", "errors": [f"HTTP fast path: POST failed: {e}"], "http_status": None}
+
+    confirmed = resp.status_code < 400 and (
+        bool(_SUCCESS_RE.search(resp.text)) or
+        (spec.get("success_path") is not None and urlsplit(str(resp.url)).path == spec["success_path"]))
+    logger.info(f"HTTP form: POST {action_url} → {resp.status_code}, confirmed={confirmed}, "
+                f"{sum(len(v) for v in data.values())} values, {len(files)} files")
+    if confirmed:
+        return {"status": "applied", "errors": [], "http_status": resp.status_code}
+    return {"status": "fallback", "http_status": resp.status_code,
+            "errors": [f"HTTP fast path: no confirmation after POST (HTTP {resp.status_code})"]}
@@ -0,0 +1,284 @@
+"""
+Image Quality — cached audit verdicts + local pre-filter for Photo Lab.
+
+The Gemini auditor (photo_lab.audit_image_quality) stays the source of truth,
+but most uploads are either clearly fine or clearly unusable:
+  1. Verdicts are keyed on the SHA-256 of the image bytes, so a re-download
+     of the same URL (audit → generation) reuses the earlier answer.
+  2. Verdicts live in an in-process TTL cache.
+  3. A local scorer (luminance histogram, clipping ratio, variance of the
+     Laplacian, resolution) settles obvious cases without calling Gemini.
+     The scorer is vectorized with NumPy (~ms per photo); without NumPy it
+     falls back to Pillow's histogram + convolution.
+
+make_rendition() is the shared downscale-before-upload step for the Gemini
+calls that do not need camera resolution (scan, stats).
+"""
+import os
+import io
+import math
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+try:
+    from PIL import Image, ImageFilter, ImageOps, ImageStat
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+    print("WARNING: Pillow not installed. Local image pre-filter disabled.")
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+AUDIT_CACHE_TTL = int(os.getenv("AUDIT_CACHE_TTL", "3600"))  # seconds
+AUDIT_CACHE_MAX_ENTRIES = 1024
+
+# Set AUDIT_LOCAL_PASS=false to always ask Gemini for photos that look fine
+# locally (the face/obstruction check cannot be done with a histogram).
+AUDIT_LOCAL_PASS = os.getenv("AUDIT_LOCAL_PASS", "true").lower() != "false"
+
+# Issues that make a generation pointless — process_digitals skips these refs.
+DOOMED_ISSUES = {"no_face", "too_dark"}
+
+# Heuristic thresholds (luminance, 0-255, measured on a ≤384px rendition)
+_ANALYSIS_SIZE = 384
+_PITCH_BLACK_MEAN = 12
+_PITCH_BLACK_RATIO = 0.95     # share of pixels below _DARK_LEVEL
+_DARK_LEVEL = 20
+_EXTREME_BLUR_VAR = 4.0       # Laplacian variance below this = smeared beyond use
+_GOOD_MEAN_RANGE = (60, 200)
+_GOOD_CLIP_RATIO = 0.05       # share of pixels crushed to black or blown to white
+_GOOD_SHARPNESS_VAR = 60.0
+_GOOD_MIN_SIDE = 512          # original resolution, short side
+_DIM_MEAN = 50                # below this the face is likely underexposed
+_SOFT_SHARPNESS_VAR = 20.0    # below this report "blurry" but still proceed
+
+# Rec. 601 luma weights, same as Pillow's convert("L")
+_LUMA = (0.299, 0.587, 0.114)
+
+
+def image_hash(image_bytes: bytes) -> str:
+    """Content hash used as the cache key for audit verdicts."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class VerdictCache:
+    """Thread-safe LRU of audit verdicts with a per-entry TTL."""
+
+    def __init__(self, ttl: int = AUDIT_CACHE_TTL, max_entries: int = AUDIT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            expires_at, verdict = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(verdict)
+
+    def put(self, key: str, verdict: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, dict(verdict))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+audit_cache = VerdictCache()
+
+
+def measure_image(image_bytes: bytes) -> Optional[Dict[str, float]]:
+    """
+    Computes brightness / sharpness stats on a downscaled luminance copy.
+    Returns None if Pillow is unavailable or the bytes are not an image.
+    """
+    if not HAS_PIL or not image_bytes:
+        return None
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        width, height = img.size
+        # draft() lets the JPEG decoder skip straight to a reduced scale
+        img.draft("RGB", (_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+        if HAS_NUMPY:
+            stats = _measure_numpy(img)
+        else:
+            stats = _measure_pillow(img)
+        # Laplacian variance scales with brightness²; normalize to mid-grey so a
+        # dim-but-sharp photo is not mistaken for a blurry one.
+        stats["sharpness"] *= (128.0 / max(stats["mean"], 16.0)) ** 2
+        stats["width"] = width
+        stats["height"] = height
+        return stats
+    except Exception as e:
+        print(f"[AUDIT] Local measure failed: {e}")
+        return None
+
+
+def _measure_numpy(img) -> Dict[str, float]:
+    rgb = img.convert("RGB")
+    rgb.thumbnail((_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+    lum = np.asarray(rgb, dtype=np.float32) @ np.asarray(_LUMA, dtype=np.float32)
+
+    hist = np.bincount(np.clip(lum, 0, 255).astype(np.uint8).ravel(), minlength=256)
+    total = float(hist.sum()) or 1.0
+    mean = float(lum.mean())
+    dark_ratio = float(hist[:_DARK_LEVEL].sum()) / total
+    clip_ratio = float(hist[:3].sum() + hist[253:].sum()) / total
+
+    # 4-neighbour Laplacian via shifted views — no per-pixel Python loop
+    lap = (lum[1:-1, :-2] + lum[1:-1, 2:] + lum[:-2, 1:-1] + lum[2:, 1:-1]
+           - 4.0 * lum[1:-1, 1:-1])
+    sharpness = float(lap.var()) if lap.size else 0.0
+
+    return {"mean": mean, "dark_ratio": dark_ratio, "clip_ratio": clip_ratio, "sharpness": sharpness}
+
+
+def _measure_pillow(img) -> Dict[str, float]:
+    gray = img.convert("L")
+    gray.thumbnail((_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+
+    hist = gray.histogram()
+    total = float(sum(hist)) or 1.0
+    mean = sum(i * c for i, c in enumerate(hist)) / total
+    dark_ratio = sum(hist[:_DARK_LEVEL]) / total
+    clip_ratio = (sum(hist[:3]) + sum(hist[253:])) / total
+
+    laplacian = gray.filter(ImageFilter.Kernel(
+        (3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128
+    ))
+    sharpness = ImageStat.Stat(laplacian).var[0]
+
+    return {"mean": mean, "dark_ratio": dark_ratio, "clip_ratio": clip_ratio, "sharpness": sharpness}
+
+
+def score_image(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Local stand-in for the Gemini auditor's technical checks.
+
+    Returns the auditor's shape — { "score": 0-10, "issues": [...],
+    "can_proceed": bool } — plus the raw "metrics". Face presence and
+    obstructions cannot be judged locally, so "no_face" / "obstructed"
+    are never reported here.
+    """
+    stats = measure_image(image_bytes)
+    if not stats:
+        return None
+
+    if stats["mean"] < _PITCH_BLACK_MEAN or stats["dark_ratio"] > _PITCH_BLACK_RATIO:
+        return {"score": 0, "issues": ["too_dark"], "can_proceed": False, "metrics": stats}
+
+    exposure = 1.0 - min(abs(stats["mean"] - 128.0) / 128.0, 1.0)
+    sharp = min(math.log1p(stats["sharpness"]) / math.log1p(_GOOD_SHARPNESS_VAR * 2), 1.0)
+    res = min(min(stats["width"], stats["height"]) / _GOOD_MIN_SIDE, 1.0)
+    clip_penalty = min(stats["clip_ratio"] / 0.25, 1.0)
+    raw = 10.0 * (0.35 * exposure + 0.40 * sharp + 0.25 * res) * (1.0 - 0.5 * clip_penalty)
+    score = max(1, min(10, int(round(raw))))
+
+    issues = []
+    if stats["mean"] < _DIM_MEAN:
+        issues.append("too_dark")
+    if stats["sharpness"] < _SOFT_SHARPNESS_VAR:
+        issues.append("blurry")
+
+    can_proceed = stats["sharpness"] >= _EXTREME_BLUR_VAR
+    if not can_proceed:
+        score = 1
+
+    return {"score": score, "issues": issues, "can_proceed": can_proceed, "metrics": stats}
+
+
+def local_prefilter(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Settles the audit locally when the answer is obvious.
+
+    Returns a verdict in the auditor's shape ({score, issues, can_proceed},
+    plus "source": "local") for clearly bad or clearly good photos, or None
+    when the photo is borderline and Gemini should decide.
+    """
+    scored = score_image(image_bytes)
+    if not scored:
+        return None
+    stats = scored["metrics"]
+    verdict = {k: scored[k] for k in ("score", "issues", "can_proceed")}
+    verdict["source"] = "local"
+
+    # Clearly bad: pitch black or a smear with no edges at all
+    if not scored["can_proceed"]:
+        return verdict
+
+    # Clearly good: well exposed, sharp and large enough
+    if AUDIT_LOCAL_PASS:
+        lo, hi = _GOOD_MEAN_RANGE
+        if (lo <= stats["mean"] <= hi
+                and stats["clip_ratio"] < _GOOD_CLIP_RATIO
+                and stats["sharpness"] >= _GOOD_SHARPNESS_VAR
+                and min(stats["width"], stats["height"]) >= _GOOD_MIN_SIDE):
+            return verdict
+
+    return None
+
+
+def quick_verdict(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Cached verdict if this exact image was audited recently, otherwise the
+    local pre-filter result (cached as well). Never calls Gemini.
+    """
+    key = image_hash(image_bytes)
+    cached = audit_cache.get(key)
+    if cached:
+        return cached
+    verdict = local_prefilter(image_bytes)
+    if verdict:
+        audit_cache.put(key, verdict)
+    return verdict
+
+
+def is_doomed(verdict: Optional[Dict[str, Any]]) -> bool:
+    """True when a verdict means generation from this photo cannot succeed."""
+    if not verdict or verdict.get("can_proceed", True):
+        return False
+    return bool(DOOMED_ISSUES.intersection(verdict.get("issues") or []))
+
+
+def make_rendition(image_bytes: bytes, max_side: int, quality: int = 85) -> bytes:
+    """
+    Downscaled JPEG for sending to a model. EXIF rotation is baked in (the
+    re-encode drops the tag). Small JPEGs are returned untouched; on any
+    decode error the original bytes are returned.
+    """
+    if not HAS_PIL or not image_bytes:
+        return image_bytes
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if img.format == "JPEG" and max(img.size) <= max_side:
+            return image_bytes
+        # draft() needs the target box, not a square, to pick the biggest JPEG scale-down
+        scale = max_side / max(img.size)
+        img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+    except Exception as e:
+        print(f"[RENDITION] Keeping original ({len(image_bytes)} bytes): {e}")
+        return image_bytes
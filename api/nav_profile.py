@@ -0,0 +1,130 @@
+"""
+Navigation Profile — what an agency application page may download.
+
+Only the form DOM matters to the apply engine, yet each page used to pull
+hero images, web fonts, background video and a handful of trackers through
+Browserless. A profile routes the browser context so those are aborted:
+
+  - "lean"     (default) blocks images, fonts and media by file extension and
+               everything from known analytics / ads / chat-widget hosts
+  - "trackers" blocks only the analytics / ads / chat-widget hosts
+  - "full"     blocks nothing; use it for sites that break under "lean"
+
+Hosts of embedded form providers (Typeform, JotForm, HubSpot, ...) and
+CAPTCHA vendors are never blocked, so iframe-form detection and CAPTCHA
+detection see the same page as before.
+
+Routes are registered with URL regexes rather than a catch-all "**/*":
+Playwright only intercepts matching requests, so documents, scripts and XHR
+never pay an extra Browserless ↔ server round trip. Allowed requests fall
+back to any route registered before the profile (the replay harness's),
+else go to the network.
+
+The profile for an agency comes from agencies.nav_profile (NULL → default,
+APPLY_NAV_PROFILE env, "lean").
+"""
+import os
+import re
+import logging
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+NAV_PROFILES = ("lean", "trackers", "full")
+DEFAULT_NAV_PROFILE = os.getenv("APPLY_NAV_PROFILE", "lean")
+
+# Never blocked: form providers and CAPTCHA vendors (suffix match on host)
+ALLOW_HOSTS = (
+    "typeform.com", "jotform.com", "jotfor.ms", "docs.google.com", "forms.gle",
+    "airtable.com", "wufoo.com", "hsforms.net", "hsforms.com", "hubspot.com",
+    "formstack.com", "cognitoforms.com", "paperform.co", "tally.so",
+    "recaptcha.net", "hcaptcha.com", "challenges.cloudflare.com",
+)
+# google.com / gstatic.com serve both reCAPTCHA and trackers: allow by path
+ALLOW_URL_RE = re.compile(r"//(www\.)?(google\.com|gstatic\.com)/recaptcha/")
+
+TRACKER_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "googlesyndication.com", "googleadservices.com", "facebook.net",
+    "connect.facebook.com", "hotjar.com", "clarity.ms", "segment.io",
+    "segment.com", "mixpanel.com", "fullstory.com", "heap.io", "heapanalytics.com",
+    "analytics.tiktok.com", "snap.licdn.com", "px.ads.linkedin.com", "ct.pinterest.com",
+    "bat.bing.com", "static.ads-twitter.com", "quantserve.com", "scorecardresearch.com",
+    "widget.intercom.io", "js.intercomcdn.com", "js.driftt.com", "embed.tawk.to",
+    "client.crisp.chat", "cookiebot.com", "onetrust.com", "cookielaw.org",
+)
+TRACKER_URL_RE = re.compile(
+    r"^https?://([^/]+\.)?(" + "|".join(re.escape(h) for h in TRACKER_HOSTS) + r")(:\d+)?/")
+
+STATIC_ASSET_RE = re.compile(
+    r"\.(png|jpe?g|gif|webp|avif|svg|ico|bmp|tiff?|woff2?|ttf|otf|eot|"
+    r"mp4|webm|mov|m4v|m3u8|mp3|wav|ogg)(\?|#|$)", re.IGNORECASE)
+_ASSET_KIND = {"woff": "font", "woff2": "font", "ttf": "font", "otf": "font", "eot": "font",
+               "mp4": "media", "webm": "media", "mov": "media", "m4v": "media", "m3u8": "media",
+               "mp3": "media", "wav": "media", "ogg": "media"}
+_ASSET_RESOURCE_TYPES = ("image", "font", "media")
+
+
+def resolve_profile(profile: Optional[str]) -> str:
+    profile = (profile or DEFAULT_NAV_PROFILE or "lean").strip().lower()
+    if profile not in NAV_PROFILES:
+        logger.warning(f"Unknown nav profile '{profile}' — using 'full'")
+        return "full"
+    return profile
+
+
+def _allowed(url: str) -> bool:
+    host = (urlsplit(url).hostname or "").lower()
+    if any(host == h or host.endswith("." + h) for h in ALLOW_HOSTS):
+        return True
+    return bool(ALLOW_URL_RE.search(url))
+
+
+class NavProfile:
+    """Installs a profile's routes on a browser context and counts what it blocked."""
+
+    def __init__(self, profile: Optional[str] = None):
+        self.profile = resolve_profile(profile)
+        self.blocked: Dict[str, int] = {}
+        self._context = None
+
+    def _count(self, kind: str):
+        self.blocked[kind] = self.blocked.get(kind, 0) + 1
+
+    async def _block_tracker(self, route):
+        if _allowed(route.request.url):
+            return await route.fallback()
+        self._count("tracker")
+        await route.abort("blockedbyclient")
+
+    async def _block_asset(self, route):
+        # The route regex also matches inside query strings (/apply?return=/logo.png,
+        # upload.php?file=a.jpg): only asset requests whose path is the asset are aborted
+        request = route.request
+        match = STATIC_ASSET_RE.search(urlsplit(request.url).path)
+        if not match or request.resource_type not in _ASSET_RESOURCE_TYPES or _allowed(request.url):
+            return await route.fallback()
+        self._count(_ASSET_KIND.get(match.group(1).lower(), "image"))
+        await route.abort("blockedbyclient")
+
+    async def install(self, context):
+        self._context = context
+        if self.profile in ("lean", "trackers"):
+            await context.route(TRACKER_URL_RE, self._block_tracker)
+        if self.profile == "lean":
+            await context.route(STATIC_ASSET_RE, self._block_asset)
+        return self
+
+    async def relax(self):
+        """Drops every route, i.e. switches this context to "full"."""
+        if self._context is not None and self.profile != "full":
+            await self._context.unroute(TRACKER_URL_RE, self._block_tracker)
+            if self.profile == "lean":
+                await self._context.unroute(STATIC_ASSET_RE, self._block_asset)
+        self.profile = "full"
+
+    def summary(self) -> str:
+        total = sum(self.blocked.values())
+        parts = ", ".join(f"{k}={v}" for k, v in sorted(self.blocked.items()))
+        return f"profile={self.profile}, blocked {total}" + (f" ({parts})" if parts else "")
@@ -4,12 +4,21 @@ Step 1: Identity lock + clothing/accessory changes (Clean Slate)
 Step 2: 4K DSLR studio rendering refinement pass
 """
 import os
+import json
+import time
 import base64
 import requests
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+from image_quality import audit_cache, image_hash, local_prefilter, quick_verdict, is_doomed
+import generation_cache
+from thinking_budget import budget_controller
+from gemini_gateway import gemini_gateway, PRIORITY_INTERACTIVE, PRIORITY_GENERATION
+from gemini_schema import AUDIT_SCHEMA
+from tracing import span, log_event
+
 load_dotenv()
 
 GEMINI_MODEL = "gemini-3-pro-image-preview"
@@ -21,15 +30,17 @@ def audit_image_quality(image_url: str) -> dict:
     Image Quality Auditor for Model Digital suitability.
 
     Analyzes brightness, clarity, and facial obstructions.
+    Verdicts are cached by image content hash; obvious cases are settled by
+    the local pre-filter without a Gemini call.
     Returns: { "score": 1-10, "issues": [...], "can_proceed": bool }
     """
-    client = get_client()
     print(f"[AUDIT] Auditing image: {image_url}")
 
     # ── Fetch image ──────────────────────────────────────────────────
     try:
-        resp = requests.get(image_url, timeout=15)
-        resp.raise_for_status()
+        with span("download", "audit"):
+            resp = requests.get(image_url, timeout=15)
+            resp.raise_for_status()
         image_bytes = resp.content
         mime = resp.headers.get("content-type", "image/jpeg").split(";")[0]
         print(f"[AUDIT] Downloaded: {len(image_bytes):,} bytes, {mime}")
@@ -37,7 +48,36 @@ def audit_image_quality(image_url: str) -> dict:
         print(f"[AUDIT] Fetch failed: {e}")
         return {"score": 0, "issues": ["fetch_failed"], "can_proceed": False}
 
+    # ── Cached / local verdict ───────────────────────────────────────
+    cache_key = image_hash(image_bytes)
+    cached = audit_cache.get(cache_key)
+    if cached:
+        print(f"[AUDIT] Cache hit: score={cached.get('score')}, issues={cached.get('issues')}")
+        return cached
+
+    local = local_prefilter(image_bytes)
+    if local:
+        print(f"[AUDIT] Local verdict: score={local['score']}, issues={local['issues']}")
+        audit_cache.put(cache_key, local)
+        return local
+
     # ── Ask Gemini to audit ──────────────────────────────────────────
+    try:
+        result = gemini_audit(image_bytes, mime)
+        print(f"[AUDIT] Result: score={result.get('score')}, "
+              f"issues={result.get('issues')}, "
+              f"can_proceed={result.get('can_proceed')}")
+        audit_cache.put(cache_key, result)
+        return result
+
+    except Exception as e:
+        print(f"[AUDIT] Gemini audit failed: {e}")
+        # Fail open — let the user proceed
+        return {"score": 5, "issues": [], "can_proceed": True}
+
+
+def gemini_audit(image_bytes: bytes, mime: str = "image/jpeg") -> dict:
+    """Remote audit via Gemini. Raises on API or parse failure (no caching)."""
     system = (
         "You are an Image Quality Auditor for a model digitals platform. "
         "Analyze the uploaded photo for suitability as a reference image "
@@ -66,40 +106,27 @@ def audit_image_quality(image_url: str) -> dict:
         '"no_face", "too_dark", "blurry", "obstructed">], "can_proceed": <true/false> }'
     )
 
-    try:
-        response = client.models.generate_content(
-            model=AUDIT_MODEL,
-            contents=[
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_bytes(data=image_bytes, mime_type=mime),
-                        types.Part.from_text(text=prompt),
-                    ],
-                )
-            ],
-            config=types.GenerateContentConfig(
-                system_instruction=system,
-                response_modalities=["TEXT"],
-            ),
-        )
-
-        raw = response.text.strip()
-        # Strip markdown code fences if present
-        if raw.startswith("```"):
-            raw = raw.split("\n", 1)[-1].rsplit("```", 1)[0].strip()
-
-        import json as _json
-        result = _json.loads(raw)
-        print(f"[AUDIT] Result: score={result.get('score')}, "
-              f"issues={result.get('issues')}, "
-              f"can_proceed={result.get('can_proceed')}")
-        return result
-
-    except Exception as e:
-        print(f"[AUDIT] Gemini audit failed: {e}")
-        # Fail open — let the user proceed
-        return {"score": 5, "issues": [], "can_proceed": True}
+    client = get_client()
+    response = gemini_gateway.call(AUDIT_MODEL, lambda: client.models.generate_content(
+        model=AUDIT_MODEL,
+        contents=[
+            types.Content(
+                role="user",
+                parts=[
+                    types.Part.from_bytes(data=image_bytes, mime_type=mime),
+                    types.Part.from_text(text=prompt),
+                ],
+            )
+        ],
+        config=types.GenerateContentConfig(
+            system_instruction=system,
+            response_modalities=["TEXT"],
+            response_mime_type="application/json",
+            response_schema=AUDIT_SCHEMA.schema,
+        ),
+    ), priority=PRIORITY_INTERACTIVE, hedge=True)
+
+    return AUDIT_SCHEMA.parse(response.text or "")
 
 
 def get_client():
@@ -189,7 +216,9 @@ def process_digitals(
     reference_urls: List[str] = None,
     custom_system: str = None,
     custom_prompt: str = None,
-    thinking_budget: Optional[int] = None
+    thinking_budget: Optional[int] = None,
+    use_cache: Optional[bool] = None,
+    regenerate: bool = False
 ):
     """
     Two-tiered professional headshot pipeline using Gemini 3 Pro with multi-image reference feeding.
@@ -197,6 +226,11 @@ def process_digitals(
     Accepts 1, 2, 3, or more reference URLs (frontal, profile, 3/4 view).
     All provided reference images are fed directly to Gemini 3 Pro
     to build an accurate 3D identity anchor. Supports custom system instructions, prompts, and thinking budget.
+
+    use_cache (default: GENERATION_CACHE env) returns a stored output for an
+    identical reference set + prompt config; regenerate=True skips the lookup.
+    An explicit thinking_budget is used as-is; otherwise the configured budget
+    is adapted per request by thinking_budget.budget_controller.
     """
     client = get_client()
 
@@ -215,11 +249,13 @@ def process_digitals(
     if not urls:
         return {"error": "No reference image URLs provided"}
 
-    print(f"[PHOTO LAB] Processing Digitals using {len(urls)} reference image(s)...")
+    log_event("photo_lab.start", references=len(urls))
 
     # ── Fetch All Source Images ───────────────────────────────────────────
     source_parts = []
+    source_hashes = []
     first_bytes = None
+    doomed_issues = []
     for idx, u in enumerate(urls):
         try:
             if u.startswith("data:"):
@@ -227,20 +263,33 @@ def process_digitals(
                 mime = header.split(";")[0].replace("data:", "") if ";" in header else "image/jpeg"
                 img_bytes = base64.b64decode(b64data)
             else:
-                resp = requests.get(u, timeout=15)
-                resp.raise_for_status()
+                with span("download", "reference"):
+                    resp = requests.get(u, timeout=15)
+                    resp.raise_for_status()
                 img_bytes = resp.content
                 mime = resp.headers.get("content-type", "image/jpeg").split(";")[0]
 
+            verdict = quick_verdict(img_bytes)
+            if is_doomed(verdict):
+                log_event("photo_lab.reference_skipped", index=idx + 1, issues=verdict.get("issues"))
+                doomed_issues.extend(verdict.get("issues") or [])
+                continue
+
             if first_bytes is None:
                 first_bytes = img_bytes
             mime_type = mime if mime.startswith("image/") else "image/jpeg"
             source_parts.append(types.Part.from_bytes(data=img_bytes, mime_type=mime_type))
-            print(f"Loaded reference image #{idx + 1}: {len(img_bytes):,} bytes ({mime_type})")
+            source_hashes.append(image_hash(img_bytes))
+            log_event("photo_lab.reference_loaded", index=idx + 1, bytes=len(img_bytes), mime_type=mime_type)
         except Exception as e:
-            print(f"Failed to load reference image #{idx + 1}: {e}")
+            log_event("photo_lab.reference_failed", index=idx + 1, error=str(e))
 
     if not source_parts:
+        if doomed_issues:
+            return {
+                "error": "Reference photo unusable for generation",
+                "issues": sorted(set(doomed_issues)),
+            }
         return {"error": "Failed to download any reference images"}
 
     # ══════════════════════════════════════════════════════════════════════
@@ -250,52 +299,86 @@ def process_digitals(
     cleanup_system = custom_system.strip() if custom_system and custom_system.strip() else active_cfg["system_instruction"]
     cleanup_prompt = custom_prompt.strip() if custom_prompt and custom_prompt.strip() else active_cfg["user_prompt"]
     effective_budget = thinking_budget if thinking_budget is not None else active_cfg["thinking_budget"]
-
-    budget = int(effective_budget) if effective_budget is not None else 2048
+    configured_budget = int(effective_budget) if effective_budget is not None else 2048
+
+    # ── Generation cache (opt-in) ─────────────────────────────────────────
+    # Keyed on the configured budget: load-based degradation must not split
+    # otherwise identical requests into different cache entries.
+    cache_enabled = generation_cache.GENERATION_CACHE_ENABLED if use_cache is None else use_cache
+    cache_key = None
+    budget = configured_budget
+    if cache_enabled:
+        cache_key = generation_cache.generation_cache_key(
+            source_hashes, cleanup_system, cleanup_prompt, configured_budget, GEMINI_MODEL
+        )
+        cached = None if regenerate else generation_cache.lookup(cache_key)
+        if cached:
+            return {
+                "status": "success",
+                "identity_constraints": f"Gemini 3 Pro natural cleanup ({len(source_parts)} refs, thinkingBudget={budget}, cached)",
+                "image_bytes": base64.b64encode(cached["image_bytes"]).decode("utf-8"),
+                "mime_type": cached["mime_type"],
+                "cache_hit": True,
+                "cached_url": cached["public_url"],
+            }
+
+    # ── Thinking budget ───────────────────────────────────────────────────
+    if thinking_budget is None:
+        budget, budget_reason = budget_controller.choose(configured_budget, len(source_parts))
+        log_event("photo_lab.budget", thinking_budget=budget, reason=budget_reason)
     thinking_cfg = types.ThinkingConfig(thinkingBudget=budget) if budget > 0 else None
 
-    try:
-        print(f"Cleanup: {GEMINI_MODEL} — Identity-locked studio transform with {len(source_parts)} reference image(s) (ThinkingBudget={budget})...")
-        content_parts = source_parts + [types.Part.from_text(text=cleanup_prompt)]
-
-        gen_config = types.GenerateContentConfig(
-            system_instruction=cleanup_system,
-            response_modalities=["IMAGE"],
-        )
-        if thinking_cfg:
-            gen_config.thinking_config = thinking_cfg
-
-        cleanup_response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[
-                types.Content(
-                    role="user",
-                    parts=content_parts,
-                )
-            ],
-            config=gen_config,
-        )
+    with budget_controller.track(budget) as outcome:
+        try:
+            log_event("photo_lab.generate", model=GEMINI_MODEL, references=len(source_parts), thinking_budget=budget)
+            content_parts = source_parts + [types.Part.from_text(text=cleanup_prompt)]
 
-        if cleanup_response.candidates and cleanup_response.candidates[0].content.parts:
-            for part in cleanup_response.candidates[0].content.parts:
-                if part.inline_data and part.inline_data.mime_type.startswith("image/"):
-                    final_bytes = part.inline_data.data
-                    final_mime = part.inline_data.mime_type
-                    print(f"Cleanup complete — {len(final_bytes):,} bytes")
-                    return {
-                        "status": "success",
-                        "identity_constraints": f"Gemini 3 Pro natural cleanup ({len(source_parts)} refs, thinkingBudget=2048)",
-                        "image_bytes": base64.b64encode(final_bytes).decode("utf-8"),
-                        "mime_type": final_mime,
-                    }
-
-        text_out = cleanup_response.text if cleanup_response.text else "No content"
-        print(f"Cleanup returned text instead of image: {text_out[:200]}")
-        return {"error": f"AI model returned text instead of image: {text_out[:200]}"}
+            gen_config = types.GenerateContentConfig(
+                system_instruction=cleanup_system,
+                response_modalities=["IMAGE"],
+            )
+            if thinking_cfg:
+                gen_config.thinking_config = thinking_cfg
+
+            cleanup_response = gemini_gateway.call(GEMINI_MODEL, lambda: client.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=[
+                    types.Content(
+                        role="user",
+                        parts=content_parts,
+                    )
+                ],
+                config=gen_config,
+            ), priority=PRIORITY_GENERATION)
+
+            if cleanup_response.candidates and cleanup_response.candidates[0].content.parts:
+                for part in cleanup_response.candidates[0].content.parts:
+                    if part.inline_data and part.inline_data.mime_type.startswith("image/"):
+                        final_bytes = part.inline_data.data
+                        final_mime = part.inline_data.mime_type
+                        log_event("photo_lab.generated", bytes=len(final_bytes), mime_type=final_mime)
+                        outcome["success"] = True
+                        if cache_key:
+                            generation_cache.store(cache_key, final_bytes, final_mime, {
+                                "model": GEMINI_MODEL,
+                                "reference_count": len(source_parts),
+                                "thinking_budget": configured_budget,
+                            })
+                        return {
+                            "status": "success",
+                            "identity_constraints": f"Gemini 3 Pro natural cleanup ({len(source_parts)} refs, thinkingBudget={budget})",
+                            "image_bytes": base64.b64encode(final_bytes).decode("utf-8"),
+                            "mime_type": final_mime,
+                            "thinking_budget": budget,
+                        }
+
+            text_out = cleanup_response.text if cleanup_response.text else "No content"
+            log_event("photo_lab.text_instead_of_image", text=text_out[:200])
+            return {"error": f"AI model returned text instead of image: {text_out[:200]}"}
 
-    except Exception as e:
-        print(f"Cleanup failed: {e}")
-        return {"error": f"AI generation error: {str(e)}"}
+        except Exception as e:
+            log_event("photo_lab.failed", error=str(e))
+            return {"error": f"AI generation error: {str(e)}"}
 
     # Fallback: return the original photo as-is
     return {
@@ -312,7 +395,8 @@ def process_digitals_dual(
     fullbody_url: str = None,
     reference_urls: List[str] = None,
     custom_system: str = None,
-    custom_prompt: str = None
+    custom_prompt: str = None,
+    regenerate: bool = False
 ):
     """
     Parallel Generation Pipeline:
@@ -332,15 +416,17 @@ def process_digitals_dual(
         reference_urls=all_refs,
         secondary_url=fullbody_url,
         custom_system=custom_system,
-        custom_prompt=custom_prompt
+        custom_prompt=custom_prompt,
+        regenerate=regenerate
     )
 
     # Full Body Passthrough
     fullbody_result = {"status": "success", "identity_constraints": "Passthrough"}
     if fullbody_url:
         try:
-            resp = requests.get(fullbody_url, timeout=15)
-            resp.raise_for_status()
+            with span("download", "fullbody"):
+                resp = requests.get(fullbody_url, timeout=15)
+                resp.raise_for_status()
             raw_body_bytes = resp.content
             fullbody_result["image_bytes"] = base64.b64encode(raw_body_bytes).decode("utf-8")
             fullbody_result["mime_type"] = "image/jpeg"
@@ -364,21 +450,26 @@ def _generate_fullbody_dual(portrait_url: str, fullbody_url: str):
 
     # ── Fetch Both Source Images ──────────────────────────────────────────
     try:
-        resp_p = requests.get(portrait_url)
-        resp_p.raise_for_status()
+        with span("download", "portrait"):
+            resp_p = requests.get(portrait_url)
+            resp_p.raise_for_status()
         portrait_bytes = resp_p.content
     except Exception as e:
         print(f"[DUAL-BODY] Failed to fetch portrait: {e}")
         return {"error": "Failed to download portrait image"}
 
     try:
-        resp_b = requests.get(fullbody_url)
-        resp_b.raise_for_status()
+        with span("download", "fullbody"):
+            resp_b = requests.get(fullbody_url)
+            resp_b.raise_for_status()
         body_bytes = resp_b.content
     except Exception as e:
         print(f"[DUAL-BODY] Failed to fetch full body: {e}")
         return {"error": "Failed to download full body image"}
 
+    budget, budget_reason = budget_controller.choose(8192, reference_count=2)
+    print(f"[DUAL-BODY] thinkingBudget={budget} ({budget_reason})")
+
     # ══════════════════════════════════════════════════════════════════════
     # STEP 1: Multi-Reference Identity Lock
     # ══════════════════════════════════════════════════════════════════════
@@ -407,51 +498,53 @@ def _generate_fullbody_dual(portrait_url: str, fullbody_url: str):
         "Output ONLY the transformed image, no text."
     )
 
-    try:
-        print(f"[DUAL-BODY] Step 1: {GEMINI_MODEL} — Multi-reference identity lock...")
-        step1_response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[
-                types.Content(
-                    role="user",
-                    parts=[
-                        # Reference_1: Portrait (Face)
-                        types.Part.from_text(text="Reference_1 (Face):"),
-                        types.Part.from_bytes(data=portrait_bytes, mime_type="image/jpeg"),
-                        # Reference_2: Full Body (Proportions)
-                        types.Part.from_text(text="Reference_2 (Body):"),
-                        types.Part.from_bytes(data=body_bytes, mime_type="image/jpeg"),
-                        # Instruction
-                        types.Part.from_text(text=step1_prompt),
-                    ],
-                )
-            ],
-            config=types.GenerateContentConfig(
-                system_instruction=step1_system,
-                response_modalities=["IMAGE"],
-                thinking_config=types.ThinkingConfig(thinkingBudget=8192),
-            ),
-        )
-
-        intermediate_bytes = None
-        intermediate_mime = "image/jpeg"
-        if step1_response.candidates and step1_response.candidates[0].content.parts:
-            for part in step1_response.candidates[0].content.parts:
-                if part.inline_data and part.inline_data.mime_type.startswith("image/"):
-                    intermediate_bytes = part.inline_data.data
-                    intermediate_mime = part.inline_data.mime_type
-                    break
-
-        if not intermediate_bytes:
-            text_out = step1_response.text if step1_response.text else "No content"
-            print(f"[DUAL-BODY] Step 1 failed — text: {text_out[:200]}")
-            return {"error": f"Step 1 returned text: {text_out[:100]}"}
-
-        print(f"[DUAL-BODY] Step 1 complete — {len(intermediate_bytes):,} bytes")
+    with budget_controller.track(budget) as outcome:
+        try:
+            print(f"[DUAL-BODY] Step 1: {GEMINI_MODEL} — Multi-reference identity lock...")
+            step1_response = gemini_gateway.call(GEMINI_MODEL, lambda: client.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=[
+                    types.Content(
+                        role="user",
+                        parts=[
+                            # Reference_1: Portrait (Face)
+                            types.Part.from_text(text="Reference_1 (Face):"),
+                            types.Part.from_bytes(data=portrait_bytes, mime_type="image/jpeg"),
+                            # Reference_2: Full Body (Proportions)
+                            types.Part.from_text(text="Reference_2 (Body):"),
+                            types.Part.from_bytes(data=body_bytes, mime_type="image/jpeg"),
+                            # Instruction
+                            types.Part.from_text(text=step1_prompt),
+                        ],
+                    )
+                ],
+                config=types.GenerateContentConfig(
+                    system_instruction=step1_system,
+                    response_modalities=["IMAGE"],
+                    thinking_config=types.ThinkingConfig(thinkingBudget=budget) if budget > 0 else None,
+                ),
+            ), priority=PRIORITY_GENERATION)
+
+            intermediate_bytes = None
+            intermediate_mime = "image/jpeg"
+            if step1_response.candidates and step1_response.candidates[0].content.parts:
+                for part in step1_response.candidates[0].content.parts:
+                    if part.inline_data and part.inline_data.mime_type.startswith("image/"):
+                        intermediate_bytes = part.inline_data.data
+                        intermediate_mime = part.inline_data.mime_type
+                        break
+
+            if not intermediate_bytes:
+                text_out = step1_response.text if step1_response.text else "No content"
+                print(f"[DUAL-BODY] Step 1 failed — text: {text_out[:200]}")
+                return {"error": f"Step 1 returned text: {text_out[:100]}"}
+
+            outcome["success"] = True
+            print(f"[DUAL-BODY] Step 1 complete — {len(intermediate_bytes):,} bytes")
 
-    except Exception as e:
-        print(f"[DUAL-BODY] Step 1 failed: {e}")
-        return {"error": f"Step 1 (Multi-Ref) failed: {str(e)}"}
+        except Exception as e:
+            print(f"[DUAL-BODY] Step 1 failed: {e}")
+            return {"error": f"Step 1 (Multi-Ref) failed: {str(e)}"}
 
     # ══════════════════════════════════════════════════════════════════════
     # STEP 2: Texture Refinement — DSLR 4K Quality
@@ -475,44 +568,46 @@ def _generate_fullbody_dual(portrait_url: str, fullbody_url: str):
         "Output ONLY the refined image, no text."
     )
 
-    try:
-        print(f"[DUAL-BODY] Step 2: {GEMINI_MODEL} — 4K texture refinement...")
-        step2_response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_bytes(data=intermediate_bytes, mime_type=intermediate_mime),
-                        types.Part.from_text(text=step2_prompt),
-                    ],
-                )
-            ],
-            config=types.GenerateContentConfig(
-                system_instruction=step2_system,
-                response_modalities=["IMAGE"],
-                thinking_config=types.ThinkingConfig(thinkingBudget=8192),
-            ),
-        )
-
-        if step2_response.candidates and step2_response.candidates[0].content.parts:
-            for part in step2_response.candidates[0].content.parts:
-                if part.inline_data and part.inline_data.mime_type.startswith("image/"):
-                    final_bytes = part.inline_data.data
-                    final_mime = part.inline_data.mime_type
-                    print(f"[DUAL-BODY] Step 2 complete — {len(final_bytes):,} bytes")
-                    return {
-                        "status": "success",
-                        "identity_constraints": "Multi-Ref: face lock (Ref_1) + body (Ref_2) → DSLR refinement",
-                        "image_bytes": base64.b64encode(final_bytes).decode("utf-8"),
-                        "mime_type": final_mime,
-                    }
-
-        text_out = step2_response.text if step2_response.text else "No content"
-        print(f"[DUAL-BODY] Step 2 returned text — fallback: {text_out[:200]}")
+    with budget_controller.track(budget) as outcome:
+        try:
+            print(f"[DUAL-BODY] Step 2: {GEMINI_MODEL} — 4K texture refinement...")
+            step2_response = gemini_gateway.call(GEMINI_MODEL, lambda: client.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=[
+                    types.Content(
+                        role="user",
+                        parts=[
+                            types.Part.from_bytes(data=intermediate_bytes, mime_type=intermediate_mime),
+                            types.Part.from_text(text=step2_prompt),
+                        ],
+                    )
+                ],
+                config=types.GenerateContentConfig(
+                    system_instruction=step2_system,
+                    response_modalities=["IMAGE"],
+                    thinking_config=types.ThinkingConfig(thinkingBudget=budget) if budget > 0 else None,
+                ),
+            ), priority=PRIORITY_GENERATION)
+
+            if step2_response.candidates and step2_response.candidates[0].content.parts:
+                for part in step2_response.candidates[0].content.parts:
+                    if part.inline_data and part.inline_data.mime_type.startswith("image/"):
+                        final_bytes = part.inline_data.data
+                        final_mime = part.inline_data.mime_type
+                        outcome["success"] = True
+                        print(f"[DUAL-BODY] Step 2 complete — {len(final_bytes):,} bytes")
+                        return {
+                            "status": "success",
+                            "identity_constraints": "Multi-Ref: face lock (Ref_1) + body (Ref_2) → DSLR refinement",
+                            "image_bytes": base64.b64encode(final_bytes).decode("utf-8"),
+                            "mime_type": final_mime,
+                        }
+
+            text_out = step2_response.text if step2_response.text else "No content"
+            print(f"[DUAL-BODY] Step 2 returned text — fallback: {text_out[:200]}")
 
-    except Exception as e:
-        print(f"[DUAL-BODY] Step 2 failed — fallback: {e}")
+        except Exception as e:
+            print(f"[DUAL-BODY] Step 2 failed — fallback: {e}")
 
     # Fallback: return Step 1 output
     return {
@@ -0,0 +1,209 @@
+"""
+Proof — application screenshots: capture, thumbnail and background upload.
+
+Proofs used to be full-page PNGs (often several MB for long agency pages)
+uploaded inline by _apply_worker before the submission row was updated.
+Now:
+
+  - capture_proof(page) takes what APPLY_PROOF_CAPTURE asks for:
+      "form"      (default) the largest visible form, or the success
+                  message after submit, clipped with a margin; falls back
+                  to the viewport when neither is on the page
+      "viewport"  the visible viewport only
+      "full"      the whole scrollable page (the old behaviour)
+    encoded as APPLY_PROOF_FORMAT (jpeg | webp | png) at
+    APPLY_PROOF_QUALITY. Clips are capped at PROOF_MAX_HEIGHT px.
+  - make_thumbnail() renders a small square JPEG for the dashboard list,
+    which used to download the full proof for a 48 px preview.
+  - proof_uploader.enqueue() uploads proof + thumbnail on a small thread
+    pool with retry/backoff and then fills in
+    agency_submissions.proof_screenshot_url / proof_thumbnail_url; the
+    submission status no longer waits on Storage.
+"""
+import io
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from service_client import get_service_client
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+PROOF_CAPTURE = os.getenv("APPLY_PROOF_CAPTURE", "form").lower()
+PROOF_FORMAT = os.getenv("APPLY_PROOF_FORMAT", "jpeg").lower()
+PROOF_QUALITY = int(os.getenv("APPLY_PROOF_QUALITY", "70"))
+PROOF_MAX_HEIGHT = 3000
+PROOF_MARGIN = 24
+THUMB_SIZE = 192  # px square; the dashboard shows it at 48 css px
+PROOF_BUCKET = "photos"
+UPLOAD_ATTEMPTS = 3
+
+if PROOF_FORMAT == "webp" and not HAS_PIL:
+    PROOF_FORMAT = "jpeg"  # Playwright encodes PNG / JPEG only; WebP goes through Pillow
+_CONTENT_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+PROOF_CONTENT_TYPE = _CONTENT_TYPES.get(PROOF_FORMAT, "image/jpeg")
+_EXTENSIONS = {"image/jpeg": "jpg", "image/webp": "webp", "image/png": "png"}
+PROOF_EXT = _EXTENSIONS[PROOF_CONTENT_TYPE]
+
+# Document-coordinate box of the form (or success message) worth keeping
+_PROOF_REGION_JS = """({successRe}) => {
+    const visible = el => el.offsetWidth > 0 && el.offsetHeight > 0;
+    let best = null;
+    for (const f of document.querySelectorAll('form')) {
+        if (visible(f) && (!best || f.offsetWidth * f.offsetHeight > best.offsetWidth * best.offsetHeight)) best = f;
+    }
+    if (!best) {
+        // After submit: the smallest visible block that carries the thank-you text
+        const re = new RegExp(successRe, 'i');
+        for (const el of document.querySelectorAll('main, section, article, div, p, h1, h2, h3')) {
+            if (visible(el) && re.test(el.innerText || '') &&
+                (!best || el.offsetWidth * el.offsetHeight < best.offsetWidth * best.offsetHeight)) best = el;
+        }
+    }
+    if (!best) return null;
+    const r = best.getBoundingClientRect();
+    return { x: r.left + window.scrollX, y: r.top + window.scrollY, width: r.width, height: r.height,
+             pageWidth: document.documentElement.scrollWidth };
+}"""
+
+
+def _screenshot_options() -> Dict[str, Any]:
+    if PROOF_FORMAT == "jpeg":
+        return {"type": "jpeg", "quality": PROOF_QUALITY}
+    return {"type": "png"}  # png as is; webp is re-encoded from it
+
+
+def _encode(raw: bytes) -> bytes:
+    if PROOF_FORMAT != "webp":
+        return raw
+    img = Image.open(io.BytesIO(raw)).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, "WEBP", quality=PROOF_QUALITY, method=4)
+    return out.getvalue()
+
+
+async def capture_proof(page, mode: Optional[str] = None) -> bytes:
+    """Proof screenshot per APPLY_PROOF_CAPTURE / _FORMAT / _QUALITY (see module docstring)."""
+    from ai_form_agent import SUCCESS_PATTERN
+
+    mode = (mode or PROOF_CAPTURE)
+    options = _screenshot_options()
+    if mode == "full":
+        return _encode(await page.screenshot(full_page=True, **options))
+    if mode == "form":
+        try:
+            box = await page.evaluate(_PROOF_REGION_JS, {"successRe": SUCCESS_PATTERN})
+        except Exception:
+            box = None
+        if box and box["width"] > 0 and box["height"] > 0:
+            x = max(0, box["x"] - PROOF_MARGIN)
+            y = max(0, box["y"] - PROOF_MARGIN)
+            clip = {
+                "x": x,
+                "y": y,
+                "width": min(box["width"] + 2 * PROOF_MARGIN, box["pageWidth"] - x),
+                "height": min(box["height"] + 2 * PROOF_MARGIN, PROOF_MAX_HEIGHT),
+            }
+            try:
+                return _encode(await page.screenshot(full_page=True, clip=clip, **options))
+            except Exception:
+                pass  # element moved / page navigated mid-shot: take the viewport
+    return _encode(await page.screenshot(**options))
+
+
+def make_thumbnail(image_bytes: Optional[bytes]) -> Optional[bytes]:
+    """Square JPEG of the top of the proof (what object-cover shows), or None without Pillow."""
+    if not HAS_PIL or not image_bytes:
+        return None
+    try:
+        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        side = min(img.width, img.height)
+        left = (img.width - side) // 2
+        img = img.crop((left, 0, left + side, side))
+        img.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=70, optimize=True)
+        return out.getvalue()
+    except Exception as e:
+        print(f"[PROOF] Thumbnail failed: {e}")
+        return None
+
+
+class ProofUploader:
+    """Uploads proofs off the request path, retrying transient Storage errors."""
+
+    def __init__(self, workers: int = 2):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="proof-upload")
+        self._lock = threading.Lock()
+        self.outcomes: Dict[str, int] = {}
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def _put(self, path: str, data: bytes, content_type: str) -> str:
+        delay = 1.0
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                storage = get_service_client().storage.from_(PROOF_BUCKET)
+                storage.upload(path=path, file=data, file_options={"content-type": content_type, "upsert": "true"})
+                return storage.get_public_url(path)
+            except Exception as e:
+                if attempt == UPLOAD_ATTEMPTS:
+                    raise
+                self._count("retry")
+                print(f"[PROOF] Upload of {path} failed (attempt {attempt}): {e} — retrying in {delay:.0f}s")
+                time.sleep(delay)
+                delay *= 2
+
+    def upload(self, name: str, image_bytes: bytes, content_type: str = PROOF_CONTENT_TYPE) -> Tuple[Optional[str], Optional[str]]:
+        """Blocking: (proof URL, thumbnail URL); either is None when its upload failed."""
+        try:
+            proof_url = self._put(f"{name}.{_EXTENSIONS.get(content_type, 'jpg')}", image_bytes, content_type)
+        except Exception as e:
+            self._count("failed")
+            print(f"[PROOF] Upload of {name} failed: {e}")
+            return None, None
+        thumb_url = None
+        thumb = make_thumbnail(image_bytes)
+        if thumb:
+            try:
+                thumb_url = self._put(f"thumbs/{name}.jpg", thumb, "image/jpeg")
+            except Exception as e:
+                print(f"[PROOF] Thumbnail upload of {name} failed: {e}")
+        self._count("uploaded")
+        return proof_url, thumb_url
+
+    def _upload_for_submission(self, submission_id: int, name: str, image_bytes: bytes, content_type: str):
+        proof_url, thumb_url = self.upload(name, image_bytes, content_type)
+        if not proof_url:
+            return
+        row = {'proof_screenshot_url': proof_url}
+        if thumb_url:
+            row['proof_thumbnail_url'] = thumb_url
+        try:
+            get_service_client().table('agency_submissions').update(row).eq('id', submission_id).execute()
+        except Exception as e:
+            if len(row) == 1:
+                print(f"[PROOF] Submission {submission_id} update failed: {e}")
+                return
+            # proof_thumbnail_url column missing (migration not run): keep the proof link
+            print(f"[PROOF] Submission {submission_id} update with thumbnail failed ({e}) — proof only")
+            try:
+                get_service_client().table('agency_submissions').update(
+                    {'proof_screenshot_url': proof_url}).eq('id', submission_id).execute()
+            except Exception as e2:
+                print(f"[PROOF] Submission {submission_id} update failed: {e2}")
+
+    def enqueue(self, submission_id: int, name: str, image_bytes: bytes, content_type: str = PROOF_CONTENT_TYPE):
+        """Fire-and-forget: upload, then set the submission's proof / thumbnail URLs."""
+        self._pool.submit(self._upload_for_submission, submission_id, name, image_bytes, content_type)
+
+
+proof_uploader = ProofUploader()
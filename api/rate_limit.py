@@ -0,0 +1,232 @@
+"""
+Rate Limit — sliding-window limits for the public, unauthenticated endpoints.
+
+/api/analyze, /api/lead and /api/audit-image each cost a Gemini call or a
+storage write, so they are limited per client IP (and /api/lead also per
+normalized email / phone).
+
+  - RateLimitMiddleware is a plain ASGI middleware: it rejects on the IP rule
+    from the request line + headers alone, before FastAPI reads the
+    multipart body
+  - rejections are 429 with a Retry-After header
+  - windows are approximated sliding windows (previous + current fixed
+    window, weighted by overlap) — O(1) per hit, a few µs in-process
+  - the counter store is pluggable: InMemoryBackend per process, or
+    RedisBackend when RATE_LIMIT_REDIS_URL is set and redis is installed,
+    so several workers/instances share counts
+
+The client IP is the X-Forwarded-For entry appended by the trusted edge:
+RATE_LIMIT_TRUSTED_HOPS (default 1, the Vercel/Railway edge) proxies sit in
+front of the app, each appending the address it saw, so the client is that
+many entries from the right. Anything further left was sent by the client
+and is ignored. With no X-Forwarded-For, X-Real-IP (which the edge
+overwrites) is used; with RATE_LIMIT_TRUSTED_HOPS=0 (no proxy) only the
+socket peer counts.
+
+Limits can be overridden with RATE_LIMITS, e.g.
+    RATE_LIMITS='{"/api/analyze": {"limit": 40, "window": 60}}'
+and disabled entirely with RATE_LIMIT_ENABLED=false.
+"""
+import os
+import json
+import math
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+try:
+    import redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "false"
+TRUSTED_HOPS = max(0, int(os.getenv("RATE_LIMIT_TRUSTED_HOPS", "1")))
+
+# path → per-IP limit per window (seconds); POST only
+DEFAULT_IP_RULES = {
+    "/api/analyze": {"limit": 20, "window": 60},
+    "/api/lead": {"limit": 10, "window": 60},
+    "/api/audit-image": {"limit": 30, "window": 60},
+}
+# Repeat submissions for one contact (email or phone) on /api/lead
+CONTACT_RULE = {"limit": 5, "window": 3600}
+
+_SWEEP_EVERY = 10_000  # hits between pruning idle keys (in-memory backend)
+
+
+class InMemoryBackend:
+    """Per-process counters: key → (window index, current count, previous count)."""
+
+    def __init__(self):
+        self._counters: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+
+    def hit(self, key: str, limit: int, window: int, now: float) -> Tuple[bool, float]:
+        """Counts the request if allowed. Returns (allowed, retry_after_s)."""
+        idx = int(now // window)
+        elapsed = now - idx * window
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                entry = self._counters[key] = [idx, 0, 0]
+            elif entry[0] != idx:
+                # Roll forward: the old current window becomes previous (or zero if older)
+                entry[2] = entry[1] if entry[0] == idx - 1 else 0
+                entry[1] = 0
+                entry[0] = idx
+            estimate = entry[2] * (1 - elapsed / window) + entry[1]
+            if estimate >= limit:
+                return False, _retry_after(entry[1], entry[2], limit, window, elapsed)
+            entry[1] += 1
+            self._hits += 1
+            if self._hits % _SWEEP_EVERY == 0:
+                self._sweep(idx)
+            return True, 0.0
+
+    def _sweep(self, idx: int):
+        stale = [k for k, e in self._counters.items() if e[0] < idx - 1]
+        for k in stale:
+            del self._counters[k]
+
+
+class RedisBackend:
+    """Shared counters: INCR on <key>:<window index>, expiring after two windows."""
+
+    def __init__(self, url: str):
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.05)
+
+    def hit(self, key: str, limit: int, window: int, now: float) -> Tuple[bool, float]:
+        idx = int(now // window)
+        elapsed = now - idx * window
+        current_key, previous_key = f"rl:{key}:{idx}", f"rl:{key}:{idx - 1}"
+        try:
+            current, previous = self._redis.mget(current_key, previous_key)
+        except redis.RedisError:
+            return True, 0.0  # fail open: a Redis blip must not take the site down
+        current, previous = int(current or 0), int(previous or 0)
+        if previous * (1 - elapsed / window) + current >= limit:
+            return False, _retry_after(current, previous, limit, window, elapsed)
+        try:
+            pipe = self._redis.pipeline()
+            pipe.incr(current_key)
+            pipe.expire(current_key, window * 2)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+        return True, 0.0
+
+
+def _retry_after(current: int, previous: int, limit: int, window: int, elapsed: float) -> float:
+    """Seconds until the weighted estimate drops below the limit."""
+    if current >= limit or previous == 0:
+        return window - elapsed  # only the next window helps
+    # previous * (1 - t/window) + current < limit  →  t > window * (1 - (limit - current) / previous)
+    t = window * (1 - (limit - current) / previous)
+    return max(0.0, t - elapsed) if t < window else window - elapsed
+
+
+class RateLimiter:
+    def __init__(self, backend=None, ip_rules: Optional[Dict[str, dict]] = None,
+                 contact_rule: Optional[dict] = None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend or InMemoryBackend()
+        self.ip_rules = ip_rules if ip_rules is not None else dict(DEFAULT_IP_RULES)
+        self.contact_rule = contact_rule or CONTACT_RULE
+        self.enabled = enabled
+        self.rejections: Dict[str, int] = {}
+
+    def _check(self, scope: str, key: str, rule: dict) -> Optional[int]:
+        allowed, retry_after = self.backend.hit(f"{scope}:{key}", rule["limit"], rule["window"], time.time())
+        if allowed:
+            return None
+        self.rejections[scope] = self.rejections.get(scope, 0) + 1
+        return max(1, math.ceil(retry_after))
+
+    def check_ip(self, path: str, ip: str) -> Optional[int]:
+        """None if allowed, else Retry-After seconds."""
+        rule = self.ip_rules.get(path)
+        if not self.enabled or rule is None:
+            return None
+        return self._check(path, ip, rule)
+
+    def check_contact(self, *keys: Optional[str]) -> Optional[int]:
+        """Applies the contact rule to each non-empty key (normalized email, phone)."""
+        if not self.enabled:
+            return None
+        for key in keys:
+            if key:
+                retry = self._check("contact", key, self.contact_rule)
+                if retry:
+                    return retry
+        return None
+
+
+def client_ip(headers: Dict[str, str], fallback: Optional[str], trusted_hops: int = TRUSTED_HOPS) -> str:
+    """
+    The address the outermost trusted proxy saw (see module docstring); the
+    client-controlled left end of X-Forwarded-For is never used on its own.
+    """
+    if trusted_hops <= 0:
+        return fallback or "unknown"
+    hops = [h.strip() for h in headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    if hops:
+        return hops[-min(trusted_hops, len(hops))]
+    return headers.get("x-real-ip") or fallback or "unknown"
+
+
+def too_many_requests_payload(retry_after: int) -> dict:
+    return {"error": "Too many requests. Please try again later.", "retry_after": retry_after}
+
+
+class RateLimitMiddleware:
+    """ASGI middleware: per-IP limits on the configured POST paths."""
+
+    def __init__(self, app, limiter: "RateLimiter"):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.limiter.ip_rules:
+            return await self.app(scope, receive, send)
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]
+                   if k in (b"x-forwarded-for", b"x-real-ip")}
+        peer = scope.get("client")
+        retry_after = self.limiter.check_ip(scope["path"], client_ip(headers, peer[0] if peer else None))
+        if retry_after is None:
+            return await self.app(scope, receive, send)
+
+        # Rejected without touching the request body
+        body = json.dumps(too_many_requests_payload(retry_after)).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _build_limiter() -> RateLimiter:
+    rules = dict(DEFAULT_IP_RULES)
+    raw = os.getenv("RATE_LIMITS")
+    if raw:
+        try:
+            rules.update(json.loads(raw))
+        except Exception as e:
+            print(f"[RATE LIMIT] Ignoring invalid RATE_LIMITS: {e}")
+    backend = None
+    redis_url = os.getenv("RATE_LIMIT_REDIS_URL")
+    if redis_url:
+        if HAS_REDIS:
+            backend = RedisBackend(redis_url)
+        else:
+            print("[RATE LIMIT] RATE_LIMIT_REDIS_URL set but redis is not installed; using in-memory counters")
+    return RateLimiter(backend=backend, ip_rules=rules)
+
+
+rate_limiter = _build_limiter()
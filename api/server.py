@@ -1,9 +1,10 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import json
 import os
 import time
+import asyncio
 import stripe
 from typing import Optional, List, Union, Dict, Any
 from pydantic import BaseModel
@@ -29,10 +30,22 @@ except Exception as e:
 
 from webhook_utils import send_webhook
 from email_utils import send_lead_email
+from gemini_gateway import gemini_gateway
+from gemini_http import gemini_http
+from gemini_schema import schema_stats
+from contact_keys import normalize_email, normalize_phone
+from rate_limit import rate_limiter, RateLimitMiddleware, too_many_requests_payload
+from tracing import TracingMiddleware, instrument_supabase, render_metrics, counter_lines, log_event
+from proof import proof_uploader
+import agency_health
 
 
 app = FastAPI()
 
+# Per-IP limits on the public scan / lead / audit endpoints. Added before CORS
+# so CORS wraps it and 429s still carry CORS headers.
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -42,6 +55,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost: request ids, latency histograms and JSON access logs cover
+# everything below, including rate-limited 429s and CORS preflights.
+app.add_middleware(TracingMiddleware)
+
 # Helper to get Supabase client
 def get_supabase() -> Client:
     url = os.getenv('SUPABASE_URL') or os.getenv('VITE_SUPABASE_URL')
@@ -56,7 +73,7 @@ def get_supabase() -> Client:
     )
     if not url or not key:
         raise HTTPException(status_code=500, detail="Supabase credentials missing")
-    return create_client(url, key)
+    return instrument_supabase(create_client(url, key))
 
 # Background task for webhook and email processing
 async def process_lead_background(lead_id: str, lead_record: dict, webhook_url: str, analysis_data: str):
@@ -144,6 +161,30 @@ async def process_lead_background(lead_id: str, lead_record: dict, webhook_url:
             'webhook_response': 'CRM_WEBHOOK_URL not set'
         }).eq('id', lead_id).execute()
 
+def _upsert_lead_direct(supabase: Client, lead_record: dict):
+    """
+    Select-then-write upsert for deployments running on the anon key, which
+    may not execute upsert_lead (service_role only). Matches on the same
+    normalized keys; returns (lead_id, created).
+    """
+    keys = []
+    if lead_record.get('email_norm'):
+        keys.append(f"email_norm.eq.{lead_record['email_norm']}")
+    if lead_record.get('phone_e164'):
+        keys.append(f"phone_e164.eq.{lead_record['phone_e164']}")
+    existing = supabase.table('leads').select('id').or_(','.join(keys)).limit(1).execute() if keys else None
+    if existing and existing.data:
+        lead_id = existing.data[0]['id']
+        record = dict(lead_record)
+        if not record.get('image_url'):
+            record.pop('image_url', None)  # keep the stored photo
+        supabase.table('leads').update(record).eq('id', lead_id).execute()
+        return lead_id, False
+    result = supabase.table('leads').insert(lead_record).execute()
+    if not result.data:
+        raise Exception("Insert/Update failed")
+    return result.data[0]['id'], True
+
 @app.post("/api/lead")
 async def create_lead(
     background_tasks: BackgroundTasks,
@@ -163,16 +204,17 @@ async def create_lead(
     try:
         supabase = get_supabase()
         
-        # 1. Duplicate/Update Check
-        existing = supabase.table('leads').select('id').or_(f"email.eq.{email},phone.eq.{phone}").execute()
-        existing_id = None
-        if existing.data and len(existing.data) > 0:
-            existing_id = existing.data[0]['id']
-            print(f"Lead exists ({existing_id}), will update instead of create.")
-            # return JSONResponse(
-            #     status_code=400,
-            #     content={"status": "error", "message": "This email or phone number has already been submitted."}
-            # )
+        # 1. Normalized contact keys (dedupe happens in the upsert_lead RPC below)
+        email_norm = normalize_email(email)
+        phone_e164 = normalize_phone(phone)
+
+        retry_after = rate_limiter.check_contact(email_norm, phone_e164)
+        if retry_after:
+            return JSONResponse(
+                status_code=429,
+                content=too_many_requests_payload(retry_after),
+                headers={"Retry-After": str(retry_after)}
+            )
 
         # 2. Image Upload
         image_url = None
@@ -251,29 +293,26 @@ async def create_lead(
             'analysis_json': analysis_json,
             'webhook_sent': False,
             'webhook_status': 'pending',
-            'webhook_response': None
+            'webhook_response': None,
+            'email_norm': email_norm,
+            'phone_e164': phone_e164,
+            # The RPC keeps the existing image_url when this is None
+            'image_url': image_url
         }
 
-        # Only update image_url if a new one was uploaded
-        if image_url:
-            lead_record['image_url'] = image_url
-        
-        if existing_id:
-            # UPDATE existing
-            result = supabase.table('leads').update(lead_record).eq('id', existing_id).execute()
-            lead_id = existing_id
-        else:
-            # INSERT new
-            # Ensure image_url is set (might be None)
-            lead_record['image_url'] = image_url 
-            result = supabase.table('leads').insert(lead_record).execute()
-        
-        if not result.data:
-            # Fallback if update returned no data (unlikely)
-            if existing_id: lead_id = existing_id
-            else: raise Exception("Insert/Update failed")
-        elif len(result.data) > 0:
-            lead_id = result.data[0]['id']
+        # Insert, or update the lead with the same email/phone — one round trip
+        try:
+            result = supabase.rpc('upsert_lead', {'p_lead': lead_record}).execute()
+            if not result.data:
+                raise Exception("Insert/Update failed")
+            lead_id, created = result.data[0]['lead_id'], result.data[0]['created']
+        except Exception as e:
+            if getattr(e, 'code', None) != '42501':  # insufficient_privilege: not the service key
+                raise
+            print("upsert_lead not permitted for this key — falling back to select + insert/update")
+            lead_id, created = _upsert_lead_direct(supabase, lead_record)
+        if not created:
+            print(f"Lead exists ({lead_id}), updated instead of created.")
         
         # 4. Offload webhook and email processing to background
         webhook_url = os.getenv('CRM_WEBHOOK_URL')
@@ -359,7 +398,7 @@ async def analyze_endpoint(file: UploadFile = File(...)):
         content = await file.read()
         mime_type = file.content_type or "image/jpeg"
         
-        result = analyze_image(content, mime_type=mime_type)
+        result = await asyncio.to_thread(analyze_image, content, mime_type=mime_type)
         
         # DOUBLE CHECK: Enforce strict minimum score of 70 at the API level
         # EXCEPTION: If the vision logic explicitly returned 0 (Invalid Face), allow it.
@@ -386,24 +425,28 @@ class StatsAnalysisRequest(BaseModel):
     fullbody_url: str
     height_cm: str
 
+def _download_to_bytes(url: str) -> bytes:
+    import requests
+    r = requests.get(url, timeout=20)
+    r.raise_for_status()
+    return r.content
+
 @app.post("/api/analyze-stats")
 async def analyze_stats_endpoint(req: StatsAnalysisRequest):
     try:
-        # Download images to memory
-        # In production, use async http client (httpx), but requests is fine for low volume
-        import requests
-        
-        # Helper to download
-        def download_to_bytes(url):
-            r = requests.get(url, timeout=20)
-            r.raise_for_status()
-            return r.content
-            
-        portrait_bytes = download_to_bytes(req.portrait_url)
-        fullbody_bytes = download_to_bytes(req.fullbody_url)
-        
-        # Analyze
-        result = analyze_model_stats(portrait_bytes, fullbody_bytes, req.height_cm)
+        started = time.perf_counter()
+
+        # Download both images to memory concurrently
+        portrait_bytes, fullbody_bytes = await asyncio.gather(
+            asyncio.to_thread(_download_to_bytes, req.portrait_url),
+            asyncio.to_thread(_download_to_bytes, req.fullbody_url),
+        )
+        timings = {"download_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+        # Analyze (rendition → encode → Gemini, or a cache hit)
+        result = await asyncio.to_thread(analyze_model_stats, portrait_bytes, fullbody_bytes, req.height_cm, timings)
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"[STATS] {' '.join(f'{k}={v}' for k, v in timings.items())}")
         return result
         
     except Exception as e:
@@ -420,6 +463,7 @@ from api.photo_lab import (
     load_lab_config,
     save_lab_config
 )
+from thinking_budget import budget_controller
 
 class AuditImageRequest(BaseModel):
     image_url: str
@@ -427,7 +471,7 @@ class AuditImageRequest(BaseModel):
 @app.post("/api/audit-image")
 async def audit_image_endpoint(req: AuditImageRequest):
     try:
-        result = audit_image_quality(req.image_url)
+        result = await asyncio.to_thread(audit_image_quality, req.image_url)
         return result
     except Exception as e:
         print(f"Audit Error: {e}")
@@ -464,23 +508,52 @@ async def get_test_prompts():
         "thinking_budget": cfg["thinking_budget"]
     }
 
+@app.get("/api/gemini-metrics")
+async def get_gemini_metrics():
+    """Per-model gateway counters, HTTP connection reuse and response-parsing outcomes."""
+    return {"models": gemini_gateway.snapshot(), "http": gemini_http.stats(), "parsing": schema_stats.snapshot()}
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    """Prometheus scrape: request / dependency latency histograms, rate-limit rejections, proof uploads."""
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+    extra = counter_lines(
+        "rate_limit_rejections_total", "Requests rejected by the public endpoint rate limiter.",
+        "scope", rate_limiter.rejections)
+    extra += counter_lines(
+        "proof_uploads_total", "Background proof screenshot uploads by outcome.",
+        "outcome", dict(proof_uploader.outcomes))
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/test-headshot-budget-stats")
+async def get_budget_stats():
+    """Dev-only: per-budget latency / success EWMAs from the adaptive thinking-budget controller."""
+    return budget_controller.snapshot()
+
 class TestHeadshotRequest(BaseModel):
     photo_url: Optional[str] = None
     reference_urls: Optional[List[str]] = None
     custom_system_instruction: Optional[str] = None
     custom_user_prompt: Optional[str] = None
     thinking_budget: Optional[int] = 2048
+    use_cache: Optional[bool] = None
+    regenerate: bool = False
 
 @app.post("/api/test-headshot")
 async def test_headshot_endpoint(req: TestHeadshotRequest):
     """Dev-only: runs the headshot pipeline on photo URL(s) and returns the result as base64."""
     try:
         urls = req.reference_urls or ([req.photo_url] if req.photo_url else [])
-        result = process_digitals(
+        result = await asyncio.to_thread(
+            process_digitals,
             reference_urls=urls,
             custom_system=req.custom_system_instruction,
             custom_prompt=req.custom_user_prompt,
-            thinking_budget=req.thinking_budget
+            thinking_budget=req.thinking_budget,
+            use_cache=req.use_cache,
+            regenerate=req.regenerate
         )
         return result
     except Exception as e:
@@ -491,6 +564,7 @@ async def test_headshot_endpoint(req: TestHeadshotRequest):
 class DigitalGenRequest(BaseModel):
     photo_url: str
     user_id: str
+    regenerate: bool = False
 
 @app.post("/api/generate-digitals")
 async def generate_digitals_endpoint(req: DigitalGenRequest):
@@ -502,7 +576,7 @@ async def generate_digitals_endpoint(req: DigitalGenRequest):
         if current_credits < 1:
             return JSONResponse(status_code=402, content={"error": "Insufficient credits"})
 
-        result = process_digitals(req.photo_url)
+        result = await asyncio.to_thread(process_digitals, req.photo_url, regenerate=req.regenerate)
         
         if "error" in result:
              return JSONResponse(status_code=500, content=result)
@@ -524,7 +598,7 @@ async def generate_digitals_endpoint(req: DigitalGenRequest):
             
             # Get public URL
             public_url = supabase.storage.from_("generated").get_public_url(filename)
-            print(f"Saved to storage: {public_url}")
+            log_event("generate_digitals.saved", user_id=req.user_id, url=public_url)
             
             # Append to profiles.generated_photos array + deduct 1 credit
             profile_resp = supabase.table("profiles").select("generated_photos, credits").eq("id", req.user_id).single().execute()
@@ -544,19 +618,20 @@ async def generate_digitals_endpoint(req: DigitalGenRequest):
                 'description': 'Professional Headshot Generation'
             }).execute()
 
-            print(f"Updated profile: {len(current_photos)} photos, {new_credits} credits remaining")
+            log_event("generate_digitals.profile_updated", user_id=req.user_id,
+                      photos=len(current_photos), credits=new_credits)
             
             result["public_url"] = public_url
             result["remaining_credits"] = new_credits
             
         except Exception as storage_err:
-            print(f"Storage/profile save failed (non-fatal): {storage_err}")
+            log_event("generate_digitals.save_failed", user_id=req.user_id, error=str(storage_err))
             result["storage_warning"] = str(storage_err)
              
         return result
         
     except Exception as e:
-        print(f"Generate Digitals Error: {e}")
+        log_event("generate_digitals.error", user_id=req.user_id, error=str(e))
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
@@ -565,6 +640,7 @@ class DualDigitalGenRequest(BaseModel):
     fullbody_url: Optional[str] = None
     reference_urls: Optional[List[str]] = None
     user_id: str
+    regenerate: bool = False
 
 @app.post("/api/generate-digitals-dual")
 async def generate_digitals_dual_endpoint(req: DualDigitalGenRequest):
@@ -576,7 +652,13 @@ async def generate_digitals_dual_endpoint(req: DualDigitalGenRequest):
         if current_credits < 5:
             return JSONResponse(status_code=402, content={"error": "Insufficient credits (5 required)"})
 
-        result = process_digitals_dual(req.portrait_url, req.fullbody_url, reference_urls=req.reference_urls)
+        result = await asyncio.to_thread(
+            process_digitals_dual,
+            req.portrait_url,
+            req.fullbody_url,
+            reference_urls=req.reference_urls,
+            regenerate=req.regenerate
+        )
 
         if "error" in result:
              return JSONResponse(status_code=500, content=result)
@@ -902,7 +984,7 @@ async def admin_get_users(request: Request):
             }
             
             # Try to find matching lead
-            lead_match = supabase.table('leads').select('first_name, last_name, campaign').eq('email', p['email']).limit(1).execute()
+            lead_match = supabase.table('leads').select('first_name, last_name, campaign').eq('email_norm', normalize_email(p['email'])).limit(1).execute()
             if lead_match.data:
                 l = lead_match.data[0]
                 user_data['name'] = f"{l['first_name']} {l['last_name']}"
@@ -983,6 +1065,140 @@ async def admin_delete_user(user_id: str, request: Request):
         print(f"Admin Delete User Error: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+# --- Campaign Analytics ---
+
+@app.get("/api/admin/campaign-stats")
+async def admin_campaign_stats(request: Request, days: int = 30, campaign: Optional[str] = None):
+    """
+    Per-campaign lead counts, average score, category mix and webhook success
+    rate, plus a daily series. Reads only the trigger-maintained
+    campaign_daily_stats rows (campaigns × days), never leads itself.
+    """
+    try:
+        admin_id = request.headers.get('X-User-Id')
+        if not admin_id:
+            return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+
+        supabase = get_supabase()
+
+        admin_check = supabase.rpc('is_user_admin', {'check_id': admin_id}).execute()
+        if not admin_check.data:
+            return JSONResponse(status_code=403, content={"error": "Forbidden"})
+
+        since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - max(1, min(days, 366)) * 86400))
+        query = supabase.table('campaign_daily_stats').select('*').gte('day', since)
+        if campaign:
+            query = query.eq('campaign', campaign)
+        rows = query.order('day').execute().data or []
+
+        campaigns = {}
+        for row in rows:
+            c = campaigns.setdefault(row['campaign'], {
+                "campaign": row['campaign'], "leads": 0, "score_sum": 0, "score_count": 0,
+                "categories": {}, "webhook_success": 0, "webhook_failed": 0, "daily": []
+            })
+            c["leads"] += row['leads']
+            c["score_sum"] += row['score_sum']
+            c["score_count"] += row['score_count']
+            c["webhook_success"] += row['webhook_success']
+            c["webhook_failed"] += row['webhook_failed']
+            for category, n in (row.get('category_counts') or {}).items():
+                if n:
+                    c["categories"][category] = c["categories"].get(category, 0) + n
+            c["daily"].append({
+                "day": row['day'],
+                "leads": row['leads'],
+                "avg_score": round(row['score_sum'] / row['score_count'], 1) if row['score_count'] else None,
+            })
+
+        results = []
+        for c in campaigns.values():
+            sent = c["webhook_success"] + c["webhook_failed"]
+            score_sum, score_count = c.pop("score_sum"), c.pop("score_count")
+            c["avg_score"] = round(score_sum / score_count, 1) if score_count else None
+            c["webhook_success_rate"] = round(c["webhook_success"] / sent, 3) if sent else None
+            results.append(c)
+        results.sort(key=lambda c: c["leads"], reverse=True)
+
+        return {"since": since, "campaigns": results}
+
+    except Exception as e:
+        print(f"Campaign Stats Error: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+# --- Batch Lead Scoring ---
+import batch_scoring
+
+class ScoreBatchRequest(BaseModel):
+    lead_ids: List[str] = []
+    urls: List[str] = []
+    concurrency: int = batch_scoring.DEFAULT_CONCURRENCY
+    resume_job_id: Optional[str] = None
+
+@app.post("/api/admin/score-batch")
+async def admin_score_batch(req: ScoreBatchRequest, request: Request, background_tasks: BackgroundTasks):
+    """
+    Re-scores lead photos in the background (lead ids and/or storage URLs).
+    Pass resume_job_id to continue an interrupted batch from its checkpoint.
+    """
+    try:
+        admin_id = request.headers.get('X-User-Id')
+        if not admin_id:
+            return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+
+        supabase = get_supabase()
+
+        admin_check = supabase.rpc('is_user_admin', {'check_id': admin_id}).execute()
+        if not admin_check.data:
+            return JSONResponse(status_code=403, content={"error": "Forbidden"})
+
+        if req.resume_job_id:
+            running = batch_scoring.running_job(req.resume_job_id)
+            if running:
+                return running.status_dict()
+            job = await asyncio.to_thread(batch_scoring.load_job, supabase, req.resume_job_id, req.concurrency)
+            if not job:
+                return JSONResponse(status_code=404, content={"error": "Batch not found"})
+        else:
+            if not req.lead_ids and not req.urls:
+                return JSONResponse(status_code=400, content={"error": "Provide lead_ids or urls"})
+            job = await asyncio.to_thread(
+                batch_scoring.create_job, supabase, req.lead_ids, req.urls, req.concurrency, admin_id
+            )
+
+        background_tasks.add_task(job.run)
+        return {"status": "started", "job_id": job.job_id, "total": len(job.items), "cursor": job.cursor}
+
+    except Exception as e:
+        print(f"Score Batch Error: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/api/admin/score-batch/{job_id}")
+async def admin_score_batch_status(job_id: str, request: Request):
+    """Live progress + images/minute while running, else the last checkpoint."""
+    try:
+        admin_id = request.headers.get('X-User-Id')
+        if not admin_id:
+            return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+
+        supabase = get_supabase()
+
+        admin_check = supabase.rpc('is_user_admin', {'check_id': admin_id}).execute()
+        if not admin_check.data:
+            return JSONResponse(status_code=403, content={"error": "Forbidden"})
+
+        running = batch_scoring.running_job(job_id)
+        if running:
+            return running.status_dict()
+        resp = supabase.table(batch_scoring.BATCH_TABLE) \
+            .select('id, status, total, cursor, succeeded, failed, images_per_minute, errors, updated_at') \
+            .eq('id', job_id).limit(1).execute()
+        if not resp.data:
+            return JSONResponse(status_code=404, content={"error": "Batch not found"})
+        return resp.data[0]
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
 @app.post("/api/webhooks/stripe")
 async def stripe_webhook(request: Request):
     payload = await request.body()
@@ -1108,6 +1324,9 @@ async def get_agencies(user_id: Optional[str] = None):
         supabase = get_supabase()
         response = supabase.table('agencies').select('*').eq('status', 'active').order('name').execute()
         agencies = response.data or []
+        for agency in agencies:
+            agency.pop('http_form', None)  # apply engine internals: form action, field map, captured tokens
+            agency['health'] = agency_health.summary(agency.pop('form_health', None))
 
         # If user_id provided, compute match scores
         if user_id:
@@ -1189,10 +1408,20 @@ async def apply_bulk(req: BulkApplyRequest, background_tasks: BackgroundTasks):
         count = len(req.agency_ids)
         if count == 0:
             return {"status": "error", "message": "No agencies selected"}
+        
+        # 1. Fetch Agency URLs + form health; known-blocked forms are skipped
+        #    uncharged, unreliable ones go last (see agency_health.py)
+        agency_resp = supabase.table('agencies').select(
+            'id, name, application_url, nav_profile, http_form, form_health').in_('id', req.agency_ids).execute()
+        agency_map = {a['id']: a for a in agency_resp.data} if agency_resp.data else {}
+        routes = {a: agency_health.route(agency_map.get(a, {}).get('form_health')) for a in req.agency_ids}
+        skipped = [a for a in req.agency_ids if routes[a] == "skip"]
+        queue = [a for a in req.agency_ids if routes[a] == "apply"] + \
+                [a for a in req.agency_ids if routes[a] == "defer"]
             
-        cost = count * 1 # 1 Credit per agency
+        cost = len(queue) * 1 # 1 Credit per agency
         
-        # 1. Fetch Full User Profile (not just credits)
+        # 2. Fetch Full User Profile (not just credits)
         profile_resp = supabase.table('profiles').select('*').eq('id', req.user_id).single().execute()
         if not profile_resp.data:
              return JSONResponse(status_code=404, content={"error": "User profile not found"})
@@ -1203,24 +1432,39 @@ async def apply_bulk(req: BulkApplyRequest, background_tasks: BackgroundTasks):
         if current_credits < cost:
              return JSONResponse(status_code=402, content={"error": f"Insufficient credits. Need {cost}, have {current_credits}."})
         
-        # 2. Deduct Credits
+        # 3. Deduct Credits
         new_balance = current_credits - cost
-        supabase.table('profiles').update({'credits': new_balance}).eq('id', req.user_id).execute()
-        
-        # 3. Log Transaction
-        supabase.table('transactions').insert({
-            'user_id': req.user_id,
-            'amount': -cost,
-            'type': 'spend',
-            'description': f'Applied to {count} agencies'
-        }).execute()
+        if cost:
+            supabase.table('profiles').update({'credits': new_balance}).eq('id', req.user_id).execute()
+            
+            # 4. Log Transaction
+            supabase.table('transactions').insert({
+                'user_id': req.user_id,
+                'amount': -cost,
+                'type': 'spend',
+                'description': f'Applied to {len(queue)} agencies'
+            }).execute()
         
-        # 4. Fetch Agency URLs
-        agency_resp = supabase.table('agencies').select('id, name, application_url').in_('id', req.agency_ids).execute()
-        agency_map = {a['id']: a for a in agency_resp.data} if agency_resp.data else {}
+        # 5. Download + compress the user's photos once; every job uploads from memory.
+        #    Runs as a task the workers await, so the response doesn't wait on it
+        photo_prefetch = None
+        if any(agency_map.get(a, {}).get('application_url') for a in queue):
+            from api.ai_form_agent import prefetch_photos
+            photo_prefetch = asyncio.create_task(prefetch_photos(profile.get('generated_photos') or []))
+        
+        # 6. Skipped agencies: visible as failed on the dashboard, nothing charged
+        for agency_id in skipped:
+            agency = agency_map[agency_id]
+            supabase.table('agency_submissions').insert({
+                'user_id': req.user_id,
+                'status': 'failed',
+                'agency_url': agency.get('application_url'),
+                'proof_screenshot_url': None
+            }).execute()
+            print(f"⏭️ BULK: {agency.get('name')} — {agency_health.skip_reason(agency.get('form_health'))}")
         
-        # 5. Create Submissions + Queue Background Tasks
-        for agency_id in req.agency_ids:
+        # 7. Create Submissions + Queue Background Tasks
+        for agency_id in queue:
             agency = agency_map.get(agency_id, {})
             agency_url = agency.get('application_url')
             agency_name = agency.get('name', 'Unknown')
@@ -1245,7 +1489,11 @@ async def apply_bulk(req: BulkApplyRequest, background_tasks: BackgroundTasks):
                         agency_url=agency_url,
                         agency_name=agency_name,
                         user_data=profile,
-                        user_id=req.user_id
+                        user_id=req.user_id,
+                        nav_profile=agency.get('nav_profile'),
+                        agency_id=agency_id,
+                        http_spec=agency.get('http_form'),
+                        photo_prefetch=photo_prefetch
                     )
                 else:
                     # No URL — mark as failed + refund
@@ -1257,10 +1505,15 @@ async def apply_bulk(req: BulkApplyRequest, background_tasks: BackgroundTasks):
                     # Refund 1 credit
                     _refund_credit(supabase, req.user_id, sub_id, "Missing application URL")
         
+        message = f"Started applying to {len(queue)} agencies!"
+        if skipped:
+            names = ", ".join(agency_map[a].get('name', 'Unknown') for a in skipped)
+            message += f" Skipped {len(skipped)} with currently unusable application forms (not charged): {names}."
         return {
             "status": "success", 
-            "message": f"Started applying to {count} agencies!",
-            "new_balance": new_balance
+            "message": message,
+            "new_balance": new_balance,
+            "skipped": skipped
         }
 
     except Exception as e:
@@ -1284,7 +1537,7 @@ async def apply_dry_run(req: DryRunRequest):
             return JSONResponse(status_code=404, content={"error": "User not found"})
         
         # Fetch agency
-        agency_resp = supabase.table('agencies').select('name, application_url').eq('id', req.agency_id).single().execute()
+        agency_resp = supabase.table('agencies').select('name, application_url, nav_profile').eq('id', req.agency_id).single().execute()
         if not agency_resp.data or not agency_resp.data.get('application_url'):
             return JSONResponse(status_code=404, content={"error": "Agency or application URL not found"})
         
@@ -1293,23 +1546,15 @@ async def apply_dry_run(req: DryRunRequest):
         # Run the apply service in dry_run mode
         from api.ai_form_agent import snapshot_form, gemini_map_fields, execute_actions
         from api.apply_engine import apply_to_agency
-        result = await apply_to_agency(agency_url, profile_resp.data, dry_run=True)
+        result = await apply_to_agency(agency_url, profile_resp.data, dry_run=True,
+                                       nav_profile=agency_resp.data.get('nav_profile'))
         
-        # Upload screenshot if available
+        # Upload screenshot if available (the response links it, so this one waits)
         screenshot_url = None
         if result.get("screenshot"):
             ts = int(time.time())
-            filename = f"dry_run_{req.user_id}_{ts}.png"
-            
-            try:
-                supabase.storage.from_("photos").upload(
-                    path=filename,
-                    file=result["screenshot"],
-                    file_options={"content-type": "image/png"}
-                )
-                screenshot_url = supabase.storage.from_("photos").get_public_url(filename)
-            except:
-                pass
+            screenshot_url, _ = await asyncio.to_thread(
+                proof_uploader.upload, f"dry_run_{req.user_id}_{ts}", result["screenshot"])
         
         return {
             "status": result["status"],
@@ -1327,40 +1572,42 @@ async def apply_dry_run(req: DryRunRequest):
 
 # ── Background Worker ──
 
-async def _apply_worker(submission_id: int, agency_url: str, agency_name: str, user_data: dict, user_id: str):
+async def _apply_worker(submission_id: int, agency_url: str, agency_name: str, user_data: dict, user_id: str,
+                        nav_profile: Optional[str] = None, agency_id: Optional[str] = None,
+                        http_spec: Optional[dict] = None, photo_prefetch: Optional[asyncio.Task] = None):
     """Background task that runs the AI form agent for a single agency."""
     print(f"🚀 WORKER: Starting application to {agency_name} ({agency_url})")
     
     supabase = get_supabase()
     
+    started = time.monotonic()
+    health_outcome = "failed"
     try:
         from api.apply_engine import apply_to_agency
-        result = await apply_to_agency(agency_url, user_data, dry_run=False)
+        photo_files = await photo_prefetch if photo_prefetch else None  # shared by every job of the run
+        result = await apply_to_agency(agency_url, user_data, dry_run=False, nav_profile=nav_profile,
+                                       http_spec=http_spec, photo_files=photo_files)
+        health_outcome = agency_health.outcome_of(result)
         
-        # Upload proof screenshot
-        screenshot_url = None
-        if result.get("screenshot"):
-            ts = int(time.time())
-            filename = f"proof_{submission_id}_{ts}.png"
-            
+        # Plain HTML form classified (or no longer replayable) → HTTP fast path on/off for this agency
+        if agency_id and "http_form" in result:
             try:
-                supabase.storage.from_("photos").upload(
-                    path=filename,
-                    file=result["screenshot"],
-                    file_options={"content-type": "image/png"}
-                )
-                screenshot_url = supabase.storage.from_("photos").get_public_url(filename)
+                supabase.table('agencies').update({'http_form': result['http_form']}).eq('id', agency_id).execute()
+                print(f"🏷️ WORKER: {agency_name} http_form {'set' if result['http_form'] else 'cleared'}")
             except Exception as e:
-                print(f"Screenshot upload failed: {e}")
+                print(f"http_form update failed: {e}")
         
         # Update submission status
         final_status = result["status"]  # "applied", "failed", or "captcha_blocked"
         
         supabase.table('agency_submissions').update({
-            'status': 'success' if final_status == 'applied' else 'failed',
-            'proof_screenshot_url': screenshot_url
+            'status': 'success' if final_status == 'applied' else 'failed'
         }).eq('id', submission_id).execute()
         
+        # Proof + thumbnail upload in the background; the dashboard picks the URLs up via realtime
+        if result.get("screenshot"):
+            proof_uploader.enqueue(submission_id, f"proof_{submission_id}_{int(time.time())}", result["screenshot"])
+        
         # If failed or captcha_blocked, refund credit
         if final_status in ('failed', 'captcha_blocked'):
             reason = result["errors"][0] if result["errors"] else final_status
@@ -1378,6 +1625,12 @@ async def _apply_worker(submission_id: int, agency_url: str, agency_name: str, u
         
         # Refund credit
         _refund_credit(supabase, user_id, submission_id, str(e))
+    
+    finally:
+        # Outcome history for fast-fail routing of later bulk runs
+        if agency_id:
+            await asyncio.to_thread(agency_health.record, supabase, agency_id, health_outcome,
+                                    int((time.monotonic() - started) * 1000))
 
 
 def _refund_credit(supabase, user_id: str, submission_id: int, reason: str):
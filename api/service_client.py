@@ -0,0 +1,37 @@
+"""
+Service Client — the shared service-role Supabase client for background modules.
+
+generation_cache, step_plans and proof write to tables and buckets that RLS
+keeps away from the anon key, so unlike server.get_supabase this never
+falls back to an anon / publishable key. The client is created on first use
+(importing a module stays free of env and network access), instrumented
+like server.get_supabase so its PostgREST / Storage calls show up as spans,
+and shared.
+"""
+import os
+import threading
+
+from supabase import create_client
+
+from tracing import instrument_supabase
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_service_client():
+    """Lazily creates the service-role client; raises ValueError without credentials."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                url = os.getenv('SUPABASE_URL') or os.getenv('VITE_SUPABASE_URL')
+                key = (
+                    os.getenv('BACKEND_SERVICE_KEY') or
+                    os.getenv('SUPABASE_SERVICE_ROLE_KEY') or
+                    os.getenv('VITE_SUPABASE_SERVICE_ROLE_KEY')
+                )
+                if not url or not key:
+                    raise ValueError("Supabase credentials missing")
+                _client = instrument_supabase(create_client(url, key))
+    return _client
@@ -0,0 +1,174 @@
+"""
+Step Plans — reuse Gemini action plans for the steps of agency forms.
+
+Every user applying to an agency sees the same form, so once one step of
+it has been mapped the next applicant does not need Gemini again. A step is
+identified by the agency URL plus a signature of its field selectors (from
+snapshot_form's compact list), so a redesigned form simply misses.
+
+Plans are stored as templates, never with another user's data. Using the
+"source" Gemini puts on each action:
+  - value taken verbatim from a user field   → {"value_from": "<key>"}
+  - "constant" (consent boxes, "Online Search") and clicks / uploads → kept as is
+  - anything else, untagged actions included ("generated" introductions,
+    cm → feet, radio choices) → {"remap": true}, re-asked from Gemini for
+    just those fields
+
+Templates live in-process (bulk runs hit the same agencies back to back)
+and in public.form_step_plans (see scripts/create_form_step_plans.sql).
+Set STEP_PLAN_CACHE=false to always map every step with Gemini.
+"""
+import os
+import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from service_client import get_service_client
+
+STEP_PLAN_CACHE_ENABLED = os.getenv("STEP_PLAN_CACHE", "true").lower() != "false"
+PLAN_TABLE = "form_step_plans"
+MEMORY_SLOTS = 256
+
+_memory: "OrderedDict[Tuple[str, str], List[Dict[str, Any]]]" = OrderedDict()
+_lock = threading.Lock()
+REMOTE_RETRY_S = 60  # back-off after a transient table error
+_MISSING_TABLE_CODES = ('42P01', 'PGRST205')  # relation does not exist / not in schema cache
+_remote_off_until = 0.0  # monotonic; inf once the table turns out to be missing
+
+
+def agency_key(url: str) -> str:
+    """host + path, lower-cased; query strings and fragments carry tracking noise."""
+    parts = urlsplit(url)
+    return f"{(parts.hostname or '').lower()}{parts.path.rstrip('/') or '/'}"
+
+
+def step_signature(fields: List[Dict[str, Any]]) -> str:
+    """Stable hash of a step's field selectors (snapshot_form's "fields")."""
+    selectors = sorted({f["sel"] for f in fields})
+    return hashlib.sha256(json.dumps(selectors).encode("utf-8")).hexdigest()[:32]
+
+
+def templatize(actions: List[Dict[str, Any]], user_values: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Strips user data out of a plan (see module docstring)."""
+    template = []
+    for action in actions:
+        kind = action.get("action")
+        source = action.get("source")
+        entry = {k: v for k, v in action.items() if k not in ("value", "source")}
+        if kind in ("fill", "select"):
+            value = str(action.get("value", ""))
+            if source in user_values and value.strip() == user_values[source].strip():
+                entry["value_from"] = source
+            elif source == "constant":
+                entry["value"] = value
+            else:
+                entry["remap"] = True
+        elif kind == "check" and source != "constant":
+            # Untagged checks may be this user's radio choice (gender, eye colour)
+            entry["remap"] = True
+        template.append(entry)
+    return template
+
+
+def instantiate(template: List[Dict[str, Any]], user_values: Dict[str, str]) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    Fills a template with this user's values. Returns (actions, remap) where
+    remap lists the indexes of placeholder actions still needing Gemini.
+    Fields this user has no value for are dropped, as Gemini would skip them.
+    """
+    actions, remap = [], []
+    for entry in template:
+        action = {k: v for k, v in entry.items() if k not in ("value_from", "remap")}
+        if entry.get("remap"):
+            remap.append(len(actions))
+        elif "value_from" in entry:
+            if entry["value_from"] not in user_values:
+                continue
+            action["value"] = user_values[entry["value_from"]]
+            action["source"] = entry["value_from"]
+        actions.append(action)
+    return actions, remap
+
+
+def _remote_ok() -> bool:
+    return time.monotonic() >= _remote_off_until
+
+
+def _remote_failed(what: str, e: Exception):
+    """Missing table (migration not run): in-process only for good. Anything else: retry later."""
+    global _remote_off_until
+    if getattr(e, 'code', None) in _MISSING_TABLE_CODES:
+        _remote_off_until = float('inf')
+        print(f"[STEP PLANS] {what} failed, {PLAN_TABLE} missing — using in-process cache only: {e}")
+    else:
+        _remote_off_until = time.monotonic() + REMOTE_RETRY_S
+        print(f"[STEP PLANS] {what} failed, retrying the table in {REMOTE_RETRY_S}s: {e}")
+
+
+def lookup(key: str, signature: str) -> Optional[List[Dict[str, Any]]]:
+    """Template for this agency step, or None on miss / any storage error."""
+    if not STEP_PLAN_CACHE_ENABLED:
+        return None
+    with _lock:
+        if (key, signature) in _memory:
+            _memory.move_to_end((key, signature))
+            return _memory[(key, signature)]
+    if not _remote_ok():
+        return None
+    try:
+        resp = get_service_client().table(PLAN_TABLE).select('actions') \
+            .eq('agency_key', key).eq('step_signature', signature).limit(1).execute()
+        if not resp.data:
+            return None
+        template = resp.data[0]['actions']
+        _remember(key, signature, template)
+        print(f"[STEP PLANS] Hit {key} step {signature[:8]} ({len(template)} actions)")
+        return template
+    except Exception as e:
+        _remote_failed("Lookup", e)
+        return None
+
+
+def store(key: str, signature: str, template: List[Dict[str, Any]]):
+    """Remembers a template that got its step through; storage errors are non-fatal."""
+    if not STEP_PLAN_CACHE_ENABLED:
+        return
+    _remember(key, signature, template)
+    if not _remote_ok():
+        return
+    try:
+        get_service_client().table(PLAN_TABLE).upsert({
+            'agency_key': key,
+            'step_signature': signature,
+            'actions': template,
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+        }).execute()
+        print(f"[STEP PLANS] Stored {key} step {signature[:8]} ({len(template)} actions)")
+    except Exception as e:
+        _remote_failed("Store", e)
+
+
+def forget(key: str, signature: str):
+    """Drops a template that led to validation errors so the next run re-maps."""
+    with _lock:
+        _memory.pop((key, signature), None)
+    if not (STEP_PLAN_CACHE_ENABLED and _remote_ok()):
+        return
+    try:
+        get_service_client().table(PLAN_TABLE).delete() \
+            .eq('agency_key', key).eq('step_signature', signature).execute()
+    except Exception as e:
+        print(f"[STEP PLANS] Delete failed (non-fatal): {e}")
+
+
+def _remember(key: str, signature: str, template: List[Dict[str, Any]]):
+    with _lock:
+        _memory[(key, signature)] = template
+        _memory.move_to_end((key, signature))
+        while len(_memory) > MEMORY_SLOTS:
+            _memory.popitem(last=False)
@@ -1,29 +1,71 @@
 import os
 import json
+import time
 import base64
-import requests
+import hashlib
 import typing_extensions as typing
+from typing import Optional
 from dotenv import load_dotenv
 
+from gemini_gateway import gemini_gateway, PRIORITY_INTERACTIVE
+from gemini_http import gemini_http
+from image_quality import VerdictCache, image_hash, make_rendition
+
 load_dotenv()
 
-def analyze_model_stats(portrait_bytes, fullbody_bytes, height_cm):
+STATS_MODEL = "gemini-3-pro-preview"
+
+# Long side sent to Gemini. Body proportions are estimated against the height
+# anchor, so ~1.5k px is plenty; camera originals are 3-4x that.
+STATS_RENDITION_SIZE = 1536
+
+# Same photos + same height → same measurements
+stats_cache = VerdictCache(ttl=int(os.getenv("STATS_CACHE_TTL", "86400")), max_entries=256)
+
+
+def stats_cache_key(portrait_bytes, fullbody_bytes, height_cm) -> str:
+    height = str(height_cm).strip().lower().removesuffix("cm").strip()
+    raw = f"{image_hash(portrait_bytes)}:{image_hash(fullbody_bytes)}:{height}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def analyze_model_stats(portrait_bytes, fullbody_bytes, height_cm, timings: Optional[dict] = None):
     """
     Analyzes Portrait and Full-Body images using Gemini 3 Pro to extract precise
     anthropometric measurements (Waist, Hips, Bust, Shoe Size) and physical attributes.
+
+    Results are cached per (image hashes, height). Pass a dict as timings to
+    receive per-stage durations in ms (cache, rendition, encode, gemini).
     """
+    timings = timings if timings is not None else {}
     try:
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError("GOOGLE_API_KEY not found")
 
-        # 1. Encode Images
+        t0 = time.perf_counter()
+        cache_key = stats_cache_key(portrait_bytes, fullbody_bytes, height_cm)
+        cached = stats_cache.get(cache_key)
+        timings["cache_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        if cached:
+            timings["cache_hit"] = True
+            return cached
+
+        # 1. Downscale + Encode Images
+        t0 = time.perf_counter()
+        portrait_bytes = make_rendition(portrait_bytes, STATS_RENDITION_SIZE)
+        fullbody_bytes = make_rendition(fullbody_bytes, STATS_RENDITION_SIZE)
+        timings["rendition_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        t0 = time.perf_counter()
         b64_portrait = base64.b64encode(portrait_bytes).decode('utf-8')
         b64_fullbody = base64.b64encode(fullbody_bytes).decode('utf-8')
+        timings["encode_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        timings["upload_kb"] = round((len(b64_portrait) + len(b64_fullbody)) / 1024)
 
         # 2. REST API Config
         # Using gemini-3-pro-preview as strictly requested by user
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-3-pro-preview:generateContent?key={api_key}"
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{STATS_MODEL}:generateContent?key={api_key}"
 
         # 3. Prompt Construction
         prompt_text = f"""
@@ -88,8 +130,15 @@ def analyze_model_stats(portrait_bytes, fullbody_bytes, height_cm):
 
         # 4. Make Request
         print("Sending request to Gemini Auto-Measure API...")
-        response = requests.post(url, json=payload, timeout=45)
-        response.raise_for_status()
+
+        def _send():
+            r = gemini_http.post_json(url, payload, timeout=45)
+            r.raise_for_status()
+            return r
+
+        t0 = time.perf_counter()
+        response = gemini_gateway.call(STATS_MODEL, _send, priority=PRIORITY_INTERACTIVE)
+        timings["gemini_ms"] = round((time.perf_counter() - t0) * 1000, 1)
         
         resp_json = response.json()
         
@@ -97,6 +146,7 @@ def analyze_model_stats(portrait_bytes, fullbody_bytes, height_cm):
         try:
             text_content = resp_json['candidates'][0]['content']['parts'][0]['text']
             result = json.loads(text_content)
+            stats_cache.put(cache_key, result)
             return result
         except (KeyError, IndexError, json.JSONDecodeError) as e:
             print(f"Failed to parse Gemini Stats response: {resp_json}")
@@ -0,0 +1,155 @@
+"""
+Thinking Budget Controller — picks Gemini's thinkingBudget per generation.
+
+The configured budget (lab_config.json) is the starting point; a value
+that is not on the ladder becomes a rung of its own. Per request the
+controller then adjusts it along the ladder:
+  - three or more references → one step up
+  - a budget whose recent success rate is poor → step up to one that works
+  - overload: while the predicted latency (EWMA at that budget, stretched by
+    the number of generations already in flight) would break the SLO,
+    step down
+
+Every tracked generation records (budget, latency, success) so the EWMAs
+follow reality; snapshot() exposes them for tuning.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Tuple
+
+from tracing import log_event
+
+BUDGET_LADDER = [0, 1024, 2048, 4096, 8192]
+LATENCY_SLO_S = float(os.getenv("GENERATION_LATENCY_SLO", "60"))
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "4"))
+MIN_SUCCESS_RATE = 0.8
+EWMA_ALPHA = 0.2
+MIN_SAMPLES = 5  # success-rate steering needs some history first
+
+# Prior until real samples arrive: ~10s base + ~1.5ms per thinking token
+_BASE_LATENCY_S = 10.0
+_LATENCY_PER_TOKEN_S = 0.0015
+
+
+class _BudgetStats:
+    def __init__(self, budget: int):
+        self.latency_s = _BASE_LATENCY_S + budget * _LATENCY_PER_TOKEN_S
+        self.success_rate = 1.0
+        self.samples = 0
+        self.successes = 0
+
+    def update(self, latency_s: float, success: bool):
+        self.samples += 1
+        self.successes += 1 if success else 0
+        self.success_rate += EWMA_ALPHA * ((1.0 if success else 0.0) - self.success_rate)
+        if success:
+            # Failures often return early; only successes describe real latency
+            self.latency_s += EWMA_ALPHA * (latency_s - self.latency_s)
+
+
+class ThinkingBudgetController:
+    def __init__(self, ladder=None, slo_s: float = LATENCY_SLO_S, capacity: int = GENERATION_CONCURRENCY):
+        self.ladder = sorted(ladder or BUDGET_LADDER)
+        self.slo_s = slo_s
+        self.capacity = max(1, capacity)
+        self.inflight = 0
+        self._stats = {b: _BudgetStats(b) for b in self.ladder}
+        self._lock = threading.Lock()
+
+    def _rung_for(self, budget: int) -> int:
+        """
+        Ladder index of budget, adding it as its own rung first when it is not
+        on the ladder: a lab-configured 3000 stays 3000 unless load or
+        history moves it. Caller holds the lock.
+        """
+        budget = max(0, budget)
+        if budget not in self._stats:
+            self.ladder = sorted(self.ladder + [budget])
+            self._stats[budget] = _BudgetStats(budget)
+        return self.ladder.index(budget)
+
+    def _index_for(self, budget: int) -> int:
+        """Nearest ladder rung at or below budget (0 if below the ladder)."""
+        idx = 0
+        for i, b in enumerate(self.ladder):
+            if b <= budget:
+                idx = i
+        return idx
+
+    def _predicted_latency(self, budget: int) -> float:
+        queue_factor = max(1.0, (self.inflight + 1) / self.capacity)
+        return self._stats[budget].latency_s * queue_factor
+
+    def choose(self, base_budget: int, reference_count: int = 1) -> Tuple[int, str]:
+        """Returns (budget, reason) for the next generation."""
+        with self._lock:
+            idx = self._rung_for(int(base_budget))
+            reasons = [f"base={self.ladder[idx]}"]
+
+            if reference_count >= 3:
+                idx += 1
+                reasons.append(f"refs={reference_count}")
+            idx = max(0, min(len(self.ladder) - 1, idx))
+
+            # History: step up past budgets that keep failing
+            while idx < len(self.ladder) - 1:
+                stats = self._stats[self.ladder[idx]]
+                if stats.samples < MIN_SAMPLES or stats.success_rate >= MIN_SUCCESS_RATE:
+                    break
+                idx += 1
+                reasons.append(f"low_success@{self.ladder[idx - 1]}")
+
+            # Overload: degrade until the SLO holds (or we hit the floor)
+            while idx > 0 and self._predicted_latency(self.ladder[idx]) > self.slo_s:
+                reasons.append(f"slo@{self.ladder[idx]}")
+                idx -= 1
+
+            return self.ladder[idx], ", ".join(reasons)
+
+    @contextmanager
+    def track(self, budget: int):
+        """
+        Counts the generation as in flight and records its outcome on exit.
+        The caller sets outcome["success"] = True once an image is returned.
+        """
+        outcome = {"success": False}
+        with self._lock:
+            self.inflight += 1
+        t0 = time.perf_counter()
+        try:
+            yield outcome
+        finally:
+            self.record(budget, time.perf_counter() - t0, outcome["success"])
+            with self._lock:
+                self.inflight -= 1
+
+    def record(self, budget: int, latency_s: float, success: bool):
+        with self._lock:
+            stats = self._stats.get(budget)
+            if stats is None:
+                stats = self._stats[self.ladder[self._index_for(budget)]]
+            stats.update(latency_s, success)
+        log_event("thinking_budget.outcome", thinking_budget=budget, seconds=round(latency_s, 1),
+                  success=success, inflight=self.inflight)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "slo_s": self.slo_s,
+                "capacity": self.capacity,
+                "inflight": self.inflight,
+                "budgets": {
+                    str(b): {
+                        "ewma_latency_s": round(s.latency_s, 2),
+                        "ewma_success_rate": round(s.success_rate, 3),
+                        "samples": s.samples,
+                        "successes": s.successes,
+                    }
+                    for b, s in self._stats.items()
+                },
+            }
+
+
+budget_controller = ThinkingBudgetController()
@@ -0,0 +1,284 @@
+"""
+Tracing — per-request spans, Prometheus histograms and JSON access logs.
+
+  - TracingMiddleware (ASGI, outermost) gives every request a request id
+    (incoming X-Request-Id or a fresh one, echoed back in the response),
+    times it, and observes http_request_duration_seconds{method,route,status}
+  - span(dependency, operation) times one call to Supabase, Storage, Gemini,
+    a photo download or a Playwright step. It records into
+    dependency_duration_seconds{dependency,operation,outcome} and, when run
+    inside a request (including asyncio.to_thread workers, which inherit the
+    context), onto that request's trace
+  - instrument_supabase(client) adds httpx event hooks so every PostgREST /
+    Storage round trip becomes a span without touching the call sites
+  - when the response completes, one JSON line is logged with the request
+    id, route, status, total ms and the child spans, so a slow
+    /api/generate-digitals shows download vs. Gemini vs. upload vs. profile
+    update at a glance
+
+render_metrics() produces the Prometheus text format served at /metrics.
+TRACE_LOG=false turns the per-request JSON lines off (metrics still record).
+"""
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+TRACE_LOG = os.getenv("TRACE_LOG", "true").lower() != "false"
+
+# Seconds; Gemini image generation runs to minutes, PostgREST to milliseconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+MAX_SPANS_PER_TRACE = 200  # bulk jobs can issue thousands of Supabase calls
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...], buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels → [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if idx < len(self.buckets):
+                series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for labels, series in items:
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template and status.",
+    ("method", "route", "status"))
+dependency_duration = Histogram(
+    "dependency_duration_seconds", "Latency of calls to Supabase, Storage, Gemini, downloads and Playwright.",
+    ("dependency", "operation", "outcome"))
+
+
+class Trace:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        self.spans: List[dict] = []
+        self.dropped = 0
+        self.finished = False
+
+    def add(self, dependency: str, operation: str, t0: float, elapsed: float, outcome: str):
+        if len(self.spans) >= MAX_SPANS_PER_TRACE:
+            self.dropped += 1
+            return
+        self.spans.append({
+            "dependency": dependency,
+            "operation": operation,
+            "start_ms": round((t0 - self.start) * 1000, 1),
+            "ms": round(elapsed * 1000, 1),
+            "outcome": outcome,
+        })
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.request_id if trace else None
+
+
+def record_span(dependency: str, operation: str, t0: float, elapsed: float, outcome: str = "ok"):
+    dependency_duration.observe((dependency, operation, outcome), elapsed)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(dependency, operation, t0, elapsed, outcome)
+
+
+@contextmanager
+def span(dependency: str, operation: str):
+    """Times the enclosed block; usable around sync calls and awaits alike."""
+    t0 = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        record_span(dependency, operation, t0, time.perf_counter() - t0, outcome)
+
+
+@contextmanager
+def collect_spans(request_id: str):
+    """Traces the enclosed block outside a request (scripts, harnesses); yields the Trace."""
+    trace = Trace(request_id)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def log_event(event: str, **fields):
+    """One JSON line on stdout, tagged with the current request id."""
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "event": event,
+        "request_id": fields.pop("request_id", None) or current_request_id(),
+        **fields,
+    }
+    print(json.dumps(record, default=str), flush=True)
+
+
+# ─── Supabase (httpx) ────────────────────────────────────
+
+def _supabase_operation(request) -> Tuple[str, str]:
+    """("supabase", "GET profiles") / ("storage", "POST generated") from the URL."""
+    parts = request.url.path.strip("/").split("/")
+    # /rest/v1/<table> · /rest/v1/rpc/<fn> · /storage/v1/object/<bucket>/<path> · /auth/v1/<...>
+    service = parts[0] if parts else ""
+    rest = parts[2:] if len(parts) > 2 else []
+    if service == "rest":
+        target = "rpc." + rest[1] if rest[:1] == ["rpc"] and len(rest) > 1 else (rest[0] if rest else "")
+        return "supabase", f"{request.method} {target}"
+    if service == "storage":
+        # object/<bucket>/..., object/public/<bucket>/..., object/sign/<bucket>/...
+        if rest[:1] == ["object"] and len(rest) > 2 and rest[1] in ("public", "sign", "authenticated"):
+            bucket = rest[2]
+        else:
+            bucket = rest[1] if len(rest) > 1 else (rest[0] if rest else "")
+        return "storage", f"{request.method} {bucket}"
+    return "supabase", f"{request.method} {service}"
+
+
+def _on_request(request):
+    request.extensions["trace_t0"] = time.perf_counter()
+
+
+def _on_response(response):
+    t0 = response.request.extensions.get("trace_t0")
+    if t0 is None:
+        return
+    dependency, operation = _supabase_operation(response.request)
+    outcome = "ok" if response.status_code < 400 else "error"
+    record_span(dependency, operation, t0, time.perf_counter() - t0, outcome)
+
+
+def instrument_supabase(client):
+    """Hooks the PostgREST and Storage httpx sessions of a supabase Client."""
+    for attr in ("postgrest", "storage"):
+        try:
+            session = getattr(client, attr).session
+            hooks = session.event_hooks
+        except Exception:
+            continue
+        if _on_request not in hooks["request"]:
+            session.event_hooks = {
+                "request": hooks["request"] + [_on_request],
+                "response": hooks["response"] + [_on_response],
+            }
+    return client
+
+
+# ─── ASGI middleware ─────────────────────────────────────
+
+class TracingMiddleware:
+    """Request id, request latency histogram and one JSON log line per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        trace = Trace(request_id or uuid.uuid4().hex)
+        token = _trace.set(trace)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": list(message.get("headers", []))
+                           + [(b"x-request-id", trace.request_id.encode())]}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Response finished; background tasks may still run after this
+                self._finish(scope, trace, status["code"])
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            self._finish(scope, trace, 500)
+            raise
+        finally:
+            _trace.reset(token)
+
+    @staticmethod
+    def _finish(scope, trace: Trace, status: int):
+        if trace.finished:
+            return
+        trace.finished = True
+        elapsed = time.perf_counter() - trace.start
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        request_duration.observe((scope["method"], route, str(status)), elapsed)
+        if TRACE_LOG:
+            log_event(
+                "request",
+                request_id=trace.request_id,
+                method=scope["method"],
+                route=route,
+                path=scope["path"],
+                status=status,
+                ms=round(elapsed * 1000, 1),
+                spans=trace.spans,
+                **({"spans_dropped": trace.dropped} if trace.dropped else {}),
+            )
+
+
+# ─── /metrics ────────────────────────────────────────────
+
+def counter_lines(name: str, help_text: str, label: str, values: Dict[str, float]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    lines += [f'{name}{{{label}="{_escape(k)}"}} {v}' for k, v in sorted(values.items())]
+    return lines
+
+
+def render_metrics(extra: Optional[List[str]] = None) -> str:
+    lines = request_duration.render() + dependency_duration.render() + (extra or [])
+    return "\n".join(lines) + "\n"
@@ -2,50 +2,33 @@
 import os
 import json
 import base64
-import requests
 import typing_extensions as typing
 from dotenv import load_dotenv
-try:
-    from PIL import Image
-    HAS_PIL = True
-except ImportError:
-    HAS_PIL = False
-    print("WARNING: Pillow not installed. Image optimization disabled.")
-import io
+
+from gemini_gateway import gemini_gateway, PRIORITY_INTERACTIVE
+from gemini_http import gemini_http
+from gemini_schema import SCAN_SCHEMA, ResponseParseError
+from image_quality import make_rendition
 
 load_dotenv()
 
+SCAN_MODEL = "gemini-3-flash-preview"
+
+# Stored with re-scored leads (leads.score_prompt_version). Bump whenever the
+# scan prompt, schema or model changes so the backfill picks stale rows up.
+SCAN_PROMPT_VERSION = "scan-v1"
+
 # Helper for image optimization (Retained)
 def optimize_image(image_bytes, max_size=800, quality=80):
-    try:
-        if not image_bytes:
-            return image_bytes
-        if not HAS_PIL:
-            return image_bytes
-            
-        print(f"Optimizing image. Original size: {len(image_bytes)} bytes")
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        if img.width > max_size or img.height > max_size:
-            print(f"Resizing from {img.width}x{img.height}")
-            img.thumbnail((max_size, max_size))
-            
-        if img.mode in ('RGBA', 'P'):
-            img = img.convert('RGB')
-            
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG", quality=quality)
-        optimized_bytes = buffer.getvalue()
-        print(f"Optimized size: {len(optimized_bytes)} bytes")
-        return optimized_bytes
-    except Exception as e:
-        print(f"Image optimization warning: {e}")
-        return image_bytes
+    optimized_bytes = make_rendition(image_bytes, max_size, quality)
+    print(f"Optimized image: {len(image_bytes)} -> {len(optimized_bytes)} bytes")
+    return optimized_bytes
 
-def analyze_image(image_bytes, mime_type="image/jpeg"):
+def analyze_image(image_bytes, mime_type="image/jpeg", priority=PRIORITY_INTERACTIVE):
     """
-    Analyzes an image using Gemini 1.5 Flash via REST API (requests)
+    Analyzes an image using Gemini 1.5 Flash via REST API (shared pooled client)
     to avoid heavy google-generativeai SDK + grpcio dependencies.
+    Batch re-scoring passes PRIORITY_BACKGROUND so it never delays live scans.
     """
     try:
         api_key = os.getenv("GOOGLE_API_KEY")
@@ -58,7 +41,7 @@ def analyze_image(image_bytes, mime_type="image/jpeg"):
 
         # 2. REST API Config
         # Using gemini-3-flash-preview as strictly requested by user
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-3-flash-preview:generateContent?key={api_key}"
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{SCAN_MODEL}:generateContent?key={api_key}"
         
         # 3. Payload Construction
         prompt_text = """
@@ -98,14 +81,20 @@ def analyze_image(image_bytes, mime_type="image/jpeg"):
             }],
             "generationConfig": {
                 "temperature": 0.4,
-                "response_mime_type": "application/json"
+                **SCAN_SCHEMA.generation_config()
             }
         }
 
         # 4. Make Request
         print("Sending REST request to Gemini API...")
-        response = requests.post(url, json=payload, timeout=25)
-        response.raise_for_status()
+
+        def _send():
+            r = gemini_http.post_json(url, payload, timeout=25)
+            r.raise_for_status()
+            return r
+
+        # Cheap flash call on the interactive path: hedge slow attempts
+        response = gemini_gateway.call(SCAN_MODEL, _send, priority=priority, hedge=priority == PRIORITY_INTERACTIVE)
         
         resp_json = response.json()
         
@@ -113,8 +102,9 @@ def analyze_image(image_bytes, mime_type="image/jpeg"):
         # API Response structure: candidates[0].content.parts[0].text
         try:
             text_content = resp_json['candidates'][0]['content']['parts'][0]['text']
-            result = json.loads(text_content)
-        except (KeyError, IndexError, json.JSONDecodeError) as e:
+            # Lenient: missing fields get the defaults below instead of a re-scan
+            result = SCAN_SCHEMA.parse(text_content, strict=False)
+        except (KeyError, IndexError, ResponseParseError) as e:
             print(f"Failed to parse Gemini response: {resp_json}")
             raise ValueError("Invalid API response format")
 
@@ -650,7 +650,7 @@ const ClientDashboard = () => {
                                                                             className="group inline-flex items-center gap-3 hover:opacity-90 transition-opacity"
                                                                         >
                                                                             <img
-                                                                                src={item.proof_screenshot_url}
+                                                                                src={item.proof_thumbnail_url || item.proof_screenshot_url}
                                                                                 alt="Proof"
                                                                                 className="w-12 h-12 rounded-xl object-cover border-2 border-gray-200 dark:border-white/10 group-hover:border-brand-start transition-colors shadow-sm"
                                                                             />
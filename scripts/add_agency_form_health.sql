@@ -0,0 +1,37 @@
+-- Per-agency application form health (see api/agency_health.py)
+-- Last 10 apply outcomes ({"o": applied | failed | captcha | no_form,
+-- "ms", "at"}), appended by the apply worker. apply_bulk skips agencies
+-- whose recent attempts all hit a CAPTCHA / no form and queues unreliable
+-- ones last; /api/agencies exposes a summary as "health".
+ALTER TABLE public.agencies
+ADD COLUMN IF NOT EXISTS form_health JSONB;
+
+COMMENT ON COLUMN public.agencies.form_health IS 'Recent apply outcomes for fast-fail routing (NULL = no history).';
+
+-- Backfill from existing submissions (matched on the application URL).
+-- Only success / failed is known for them, so this can defer an agency
+-- but never skip it.
+WITH ranked AS (
+    SELECT a.id AS agency_id, s.status, s.created_at,
+           row_number() OVER (PARTITION BY a.id ORDER BY s.created_at DESC) AS rn
+    FROM public.agencies a
+    JOIN public.agency_submissions s ON s.agency_url = a.application_url
+    WHERE s.status IN ('success', 'failed')
+)
+UPDATE public.agencies a
+SET form_health = jsonb_build_object(
+    'recent', h.recent,
+    'updated_at', to_jsonb(now())
+)
+FROM (
+    SELECT agency_id,
+           jsonb_agg(jsonb_build_object(
+               'o', CASE WHEN status = 'success' THEN 'applied' ELSE 'failed' END,
+               'ms', NULL,
+               'at', to_jsonb(created_at)
+           ) ORDER BY created_at) AS recent
+    FROM ranked
+    WHERE rn <= 10
+    GROUP BY agency_id
+) h
+WHERE a.id = h.agency_id AND a.form_health IS NULL;
@@ -0,0 +1,9 @@
+-- HTTP fast path for plain HTML application forms (see api/http_form.py)
+-- Set by the apply engine after a browser run whose submit was a native
+-- document POST: form action, enctype, and each posted field's origin
+-- (user key / constant / fresh hidden token / file / generated). NULL →
+-- browser. Cleared automatically when a replay no longer confirms.
+ALTER TABLE public.agencies
+ADD COLUMN IF NOT EXISTS http_form JSONB;
+
+COMMENT ON COLUMN public.agencies.http_form IS 'Apply engine HTTP fast-path spec for plain HTML forms (NULL = use the browser).';
@@ -0,0 +1,8 @@
+-- Per-agency navigation profile for the apply engine (see api/nav_profile.py)
+-- NULL → APPLY_NAV_PROFILE default ("lean": images, fonts, media and trackers
+-- blocked). Set to 'trackers' or 'full' for sites whose form breaks without them.
+ALTER TABLE public.agencies
+ADD COLUMN IF NOT EXISTS nav_profile TEXT
+CHECK (nav_profile IS NULL OR nav_profile IN ('lean', 'trackers', 'full'));
+
+COMMENT ON COLUMN public.agencies.nav_profile IS 'Apply engine navigation profile override: lean | trackers | full (NULL = default).';
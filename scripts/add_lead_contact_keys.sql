@@ -0,0 +1,160 @@
+-- Normalized contact keys for lead deduplication (see api/contact_keys.py)
+-- Replaces create_lead's unindexed `email.eq.X OR phone.eq.Y` lookup with two
+-- unique indexes and a single-round-trip upsert_lead() RPC.
+
+-- 1. Columns
+ALTER TABLE public.leads
+ADD COLUMN IF NOT EXISTS email_norm TEXT,
+ADD COLUMN IF NOT EXISTS phone_e164 TEXT;
+
+-- 2. SQL twins of contact_keys.normalize_email / normalize_phone (UK default),
+--    used only to backfill existing rows. New rows are normalized in Python.
+CREATE OR REPLACE FUNCTION public.normalize_email(raw TEXT)
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT CASE WHEN position('@' IN lower(btrim(raw))) > 0 THEN lower(btrim(raw)) END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.normalize_phone_e164(raw TEXT)
+RETURNS TEXT
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+DECLARE
+    digits TEXT := regexp_replace(coalesce(raw, ''), '\D', '', 'g');
+BEGIN
+    IF btrim(coalesce(raw, '')) = '' THEN
+        RETURN NULL;
+    ELSIF btrim(raw) LIKE '+%' THEN
+        NULL;
+    ELSIF digits LIKE '00%' THEN
+        digits := substr(digits, 3);
+    ELSIF digits LIKE '44%' AND length(digits) > 10 THEN
+        NULL;
+    ELSIF digits LIKE '0%' THEN
+        digits := '44' || substr(digits, 2);
+    ELSE
+        digits := '44' || digits;
+    END IF;
+    IF digits LIKE '440%' THEN
+        digits := '44' || substr(digits, 4);
+    END IF;
+    RETURN CASE WHEN length(digits) BETWEEN 8 AND 15 THEN '+' || digits END;
+END;
+$$;
+
+-- 3. Backfill
+UPDATE public.leads
+SET email_norm = public.normalize_email(email),
+    phone_e164 = public.normalize_phone_e164(phone)
+WHERE email_norm IS NULL OR phone_e164 IS NULL;
+
+-- 4. Existing duplicates: the newest lead keeps the key, older ones lose it
+--    (rows are kept; they just stop matching future submissions)
+WITH ranked AS (
+    SELECT id, row_number() OVER (PARTITION BY email_norm ORDER BY created_at DESC, id) AS rn
+    FROM public.leads WHERE email_norm IS NOT NULL
+)
+UPDATE public.leads l SET email_norm = NULL
+FROM ranked r WHERE l.id = r.id AND r.rn > 1;
+
+WITH ranked AS (
+    SELECT id, row_number() OVER (PARTITION BY phone_e164 ORDER BY created_at DESC, id) AS rn
+    FROM public.leads WHERE phone_e164 IS NOT NULL
+)
+UPDATE public.leads l SET phone_e164 = NULL
+FROM ranked r WHERE l.id = r.id AND r.rn > 1;
+
+-- 5. Unique indexes (NULLs never conflict)
+CREATE UNIQUE INDEX IF NOT EXISTS leads_email_norm_key ON public.leads (email_norm);
+CREATE UNIQUE INDEX IF NOT EXISTS leads_phone_e164_key ON public.leads (phone_e164);
+
+-- 6. Upsert in one round trip.
+--    Email matches resolve through INSERT ... ON CONFLICT (email_norm); a lead
+--    matching only by phone is updated in place. A unique_violation from a
+--    concurrent submit just retries, which then finds the row.
+--    image_url is only replaced when the new submission uploaded one.
+CREATE OR REPLACE FUNCTION public.upsert_lead(p_lead JSONB)
+RETURNS TABLE (lead_id UUID, created BOOLEAN)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    r public.leads;
+    v_id UUID;
+    v_inserted BOOLEAN;
+BEGIN
+    r := jsonb_populate_record(NULL::public.leads, p_lead);
+
+    FOR attempt IN 1..3 LOOP
+        BEGIN
+            -- Phone-only match (different or missing email)
+            IF r.phone_e164 IS NOT NULL THEN
+                SELECT l.id INTO v_id FROM public.leads l
+                WHERE l.phone_e164 = r.phone_e164
+                  AND l.email_norm IS DISTINCT FROM r.email_norm
+                  AND (r.email_norm IS NULL OR NOT EXISTS (
+                      SELECT 1 FROM public.leads e WHERE e.email_norm = r.email_norm))
+                LIMIT 1;
+                IF v_id IS NOT NULL THEN
+                    UPDATE public.leads SET
+                        first_name = r.first_name, last_name = r.last_name, age = r.age,
+                        gender = r.gender, email = r.email, phone = r.phone, city = r.city,
+                        zip_code = r.zip_code, campaign = r.campaign,
+                        wants_assessment = r.wants_assessment, score = r.score,
+                        category = r.category, analysis_json = r.analysis_json,
+                        webhook_sent = r.webhook_sent, webhook_status = r.webhook_status,
+                        webhook_response = r.webhook_response,
+                        image_url = COALESCE(r.image_url, leads.image_url),
+                        email_norm = COALESCE(r.email_norm, leads.email_norm)
+                    WHERE id = v_id;
+                    RETURN QUERY SELECT v_id, FALSE;
+                    RETURN;
+                END IF;
+            END IF;
+
+            INSERT INTO public.leads AS l (
+                first_name, last_name, age, gender, email, phone, city, zip_code,
+                campaign, wants_assessment, score, category, analysis_json,
+                webhook_sent, webhook_status, webhook_response, image_url,
+                email_norm, phone_e164
+            ) VALUES (
+                r.first_name, r.last_name, r.age, r.gender, r.email, r.phone, r.city, r.zip_code,
+                r.campaign, r.wants_assessment, r.score, r.category, r.analysis_json,
+                r.webhook_sent, r.webhook_status, r.webhook_response, r.image_url,
+                r.email_norm, r.phone_e164
+            )
+            ON CONFLICT (email_norm) DO UPDATE SET
+                first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name,
+                age = EXCLUDED.age, gender = EXCLUDED.gender, email = EXCLUDED.email,
+                phone = EXCLUDED.phone, city = EXCLUDED.city, zip_code = EXCLUDED.zip_code,
+                campaign = EXCLUDED.campaign, wants_assessment = EXCLUDED.wants_assessment,
+                score = EXCLUDED.score, category = EXCLUDED.category,
+                analysis_json = EXCLUDED.analysis_json, webhook_sent = EXCLUDED.webhook_sent,
+                webhook_status = EXCLUDED.webhook_status,
+                webhook_response = EXCLUDED.webhook_response,
+                image_url = COALESCE(EXCLUDED.image_url, l.image_url),
+                -- Take the new phone key unless another lead already owns it
+                phone_e164 = CASE
+                    WHEN EXCLUDED.phone_e164 IS NOT NULL AND NOT EXISTS (
+                        SELECT 1 FROM public.leads p
+                        WHERE p.phone_e164 = EXCLUDED.phone_e164 AND p.id <> l.id)
+                    THEN EXCLUDED.phone_e164 ELSE l.phone_e164 END
+            RETURNING l.id, (xmax = 0) INTO v_id, v_inserted;
+
+            RETURN QUERY SELECT v_id, v_inserted;
+            RETURN;
+        EXCEPTION WHEN unique_violation THEN
+            -- Raced with another submit for the same contact; look again
+            v_id := NULL;
+        END;
+    END LOOP;
+    RAISE EXCEPTION 'upsert_lead: unresolved contact conflict for %', p_lead->>'email';
+END;
+$$;
+
+-- Service key only; a server running on the anon key falls back to the
+-- select + insert/update path in create_lead
+REVOKE ALL ON FUNCTION public.upsert_lead(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.upsert_lead(JSONB) TO service_role;
@@ -0,0 +1,44 @@
+-- Re-scoring support for leads (see scripts/backfill_lead_scores.py)
+-- score_prompt_version: SCAN_PROMPT_VERSION of the server-side scan that produced
+-- score/category. NULL = client-supplied at submission time (never verified).
+ALTER TABLE public.leads
+ADD COLUMN IF NOT EXISTS score_prompt_version TEXT,
+ADD COLUMN IF NOT EXISTS scored_at TIMESTAMPTZ;
+
+-- Backfill pages by id among rows that still need a scan
+CREATE INDEX IF NOT EXISTS leads_score_prompt_version_id_idx
+ON public.leads (score_prompt_version, id);
+
+-- Batched write: one round trip per page instead of one UPDATE per lead.
+-- rows = [{"id": ..., "score": ..., "category": ..., "analysis_json": {...},
+--          "score_prompt_version": ..., "scored_at": ...}]
+CREATE OR REPLACE FUNCTION public.apply_lead_scores(rows JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    updated INTEGER;
+BEGIN
+    UPDATE public.leads AS l
+    SET score = r.score,
+        category = r.category,
+        analysis_json = r.analysis_json,
+        score_prompt_version = r.score_prompt_version,
+        scored_at = r.scored_at
+    FROM jsonb_to_recordset(rows) AS r(
+        id UUID,
+        score INTEGER,
+        category TEXT,
+        analysis_json JSONB,
+        score_prompt_version TEXT,
+        scored_at TIMESTAMPTZ
+    )
+    WHERE l.id = r.id;
+    GET DIAGNOSTICS updated = ROW_COUNT;
+    RETURN updated;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.apply_lead_scores(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_lead_scores(JSONB) TO service_role;
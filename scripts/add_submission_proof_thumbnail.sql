@@ -0,0 +1,7 @@
+-- Small square JPEG of the proof screenshot for the dashboard list
+-- (see api/proof.py). Filled in by the background proof uploader together
+-- with proof_screenshot_url; NULL → the dashboard falls back to the proof.
+ALTER TABLE public.agency_submissions
+ADD COLUMN IF NOT EXISTS proof_thumbnail_url TEXT;
+
+COMMENT ON COLUMN public.agency_submissions.proof_thumbnail_url IS 'Dashboard thumbnail of proof_screenshot_url (uploaded under photos/thumbs/).';
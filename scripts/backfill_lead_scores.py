@@ -0,0 +1,208 @@
+"""
+Backfill / re-score historical leads with the current scan prompt.
+
+leads.score and leads.category were taken from the client-supplied
+analysis_data at submission time. This job re-runs analyze_image on every
+lead whose score is missing or was produced by an older prompt
+(score_prompt_version != SCAN_PROMPT_VERSION) and writes the results back.
+
+  - keyset paging on id (no OFFSET), only over rows that still need work
+  - each page is scanned with a thread pool, then written in ONE round trip
+    via the apply_lead_scores() RPC (see scripts/add_lead_score_version.sql)
+  - progress is checkpointed to a local JSON file after every page; rerun
+    the same command to resume
+  - --shard i/n splits the UUID id space into n ranges so several
+    processes (or machines) can run side by side, each with its own
+    checkpoint
+
+Gemini calls go through the gateway at background priority, so live scans
+keep their quota while this runs.
+
+Usage (from repo root):
+    python scripts/backfill_lead_scores.py                 # all stale leads
+    python scripts/backfill_lead_scores.py --shard 0/4     # first quarter
+    python scripts/backfill_lead_scores.py --force --limit 100 --dry-run
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+from vision_logic import analyze_image, SCAN_PROMPT_VERSION
+from gemini_gateway import PRIORITY_BACKGROUND
+from batch_scoring import lead_score_fields, download
+
+load_dotenv()
+
+UUID_SPACE = 1 << 128
+
+
+def shard_bounds(shard: int, shards: int):
+    """
+    (lower, upper) UUID strings for one of n equal slices of the id space.
+    Paging uses id > lower and id < upper, so lower is one below the slice start.
+    """
+    def as_uuid(n: int) -> str:
+        h = f"{n:032x}"
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+    lower = as_uuid(max(0, UUID_SPACE * shard // shards - 1))
+    upper = as_uuid(UUID_SPACE * (shard + 1) // shards) if shard + 1 < shards else None
+    return lower, upper
+
+
+def needs_scan_filter(query, force: bool):
+    query = query.not_.is_('image_url', 'null')
+    if not force:
+        query = query.or_(f"score_prompt_version.is.null,score_prompt_version.neq.{SCAN_PROMPT_VERSION}")
+    return query
+
+
+def count_remaining(supabase, after: str, upper, force: bool) -> int:
+    query = supabase.table('leads').select('id', count='exact').gt('id', after)
+    if upper:
+        query = query.lt('id', upper)
+    resp = needs_scan_filter(query, force).limit(1).execute()
+    return resp.count or 0
+
+
+def fetch_page(supabase, after: str, upper, force: bool, page_size: int):
+    query = supabase.table('leads').select('id, image_url').gt('id', after)
+    if upper:
+        query = query.lt('id', upper)
+    return needs_scan_filter(query, force).order('id').limit(page_size).execute().data or []
+
+
+def scan_lead(lead):
+    """Returns (lead_id, fields) or (lead_id, error string)."""
+    try:
+        image_bytes = download(lead['image_url'])
+    except Exception as e:
+        return lead['id'], f"download: {e}"
+    analysis = analyze_image(image_bytes, "image/jpeg", PRIORITY_BACKGROUND)
+    if analysis.get('error'):
+        return lead['id'], f"analyze: {analysis['error']}"
+    return lead['id'], lead_score_fields(analysis)
+
+
+def write_batch(supabase, rows):
+    """One RPC per page; falls back to per-row updates if the RPC is missing."""
+    try:
+        supabase.rpc('apply_lead_scores', {'rows': rows}).execute()
+    except Exception as e:
+        print(f"   ⚠️ apply_lead_scores RPC failed ({e}); falling back to per-row updates")
+        for row in rows:
+            fields = {k: v for k, v in row.items() if k != 'id'}
+            supabase.table('leads').update(fields).eq('id', row['id']).execute()
+
+
+def fresh_state(lower: str):
+    return {"last_id": lower, "scored": 0, "failed": 0, "prompt_version": SCAN_PROMPT_VERSION}
+
+
+def load_checkpoint(path: str, lower: str):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return fresh_state(lower)
+
+
+def save_checkpoint(path: str, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)  # atomic: a crash never leaves a torn checkpoint
+
+
+def fmt_eta(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "?"
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}h{m:02d}m" if h else f"{m}m{s:02d}s"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shard", default="0/1", help="i/n — process the i-th of n id ranges")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many leads (0 = no limit)")
+    parser.add_argument("--force", action="store_true", help="re-score even leads already on the current prompt")
+    parser.add_argument("--dry-run", action="store_true", help="scan but do not write")
+    parser.add_argument("--checkpoint", default=None, help="default: .backfill_scores_<i>of<n>.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    shard, shards = (int(x) for x in args.shard.split("/"))
+    if not 0 <= shard < shards:
+        sys.exit(f"Invalid --shard {args.shard}")
+    lower, upper = shard_bounds(shard, shards)
+    checkpoint_path = args.checkpoint or f".backfill_scores_{shard}of{shards}.json"
+
+    url = os.getenv('SUPABASE_URL') or os.getenv('VITE_SUPABASE_URL')
+    key = os.getenv('SUPABASE_SERVICE_ROLE_KEY') or os.getenv('VITE_SUPABASE_SERVICE_ROLE_KEY') or os.getenv('BACKEND_SERVICE_KEY')
+    if not url or not key:
+        sys.exit("Missing Supabase credentials.")
+    supabase = create_client(url, key)
+
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    state = load_checkpoint(checkpoint_path, lower)
+    if state.get("prompt_version") != SCAN_PROMPT_VERSION:
+        # The prompt changed since this checkpoint was written: everything is stale again
+        print(f"Checkpoint is for {state.get('prompt_version')}, now {SCAN_PROMPT_VERSION}; starting over.")
+        state = fresh_state(lower)
+
+    # Rows before last_id were already rescanned (they drop out of the filter),
+    # so only the remainder of the range needs counting
+    remaining = count_remaining(supabase, state["last_id"], upper, args.force)
+    if args.limit:
+        remaining = min(remaining, args.limit)
+    print(f"🔁 Shard {shard}/{shards} [{lower} .. {upper or 'end'}) — {remaining} leads to scan "
+          f"(prompt {SCAN_PROMPT_VERSION}, resume after {state['last_id']})")
+
+    started = time.time()
+    done_this_run = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        while not args.limit or done_this_run < args.limit:
+            page_size = args.page_size if not args.limit else min(args.page_size, args.limit - done_this_run)
+            page = fetch_page(supabase, state["last_id"], upper, args.force, page_size)
+            if not page:
+                break
+
+            rows, failures = [], []
+            for lead_id, outcome in pool.map(scan_lead, page):
+                if isinstance(outcome, dict):
+                    rows.append({"id": lead_id, **outcome})
+                else:
+                    failures.append((lead_id, outcome))
+
+            if rows and not args.dry_run:
+                write_batch(supabase, rows)
+
+            state["last_id"] = page[-1]["id"]
+            state["scored"] += len(rows)
+            state["failed"] += len(failures)
+            if not args.dry_run:
+                save_checkpoint(checkpoint_path, state)
+
+            done_this_run += len(page)
+            elapsed = time.time() - started
+            rate = done_this_run / elapsed if elapsed > 0 else 0
+            eta = (remaining - done_this_run) / rate if rate > 0 else float("inf")
+            print(f"   {done_this_run}/{remaining} ({done_this_run / max(1, remaining):.0%}) "
+                  f"· {rate * 60:.1f} img/min · ETA {fmt_eta(max(0, eta))} "
+                  f"· page: {len(rows)} ok, {len(failures)} failed")
+            for lead_id, err in failures:
+                print(f"      ✗ {lead_id}: {err[:160]}")
+
+    elapsed = time.time() - started
+    print(f"\n✅ Shard {shard}/{shards} finished: {done_this_run} leads in {fmt_eta(elapsed)} "
+          f"(total scored {state['scored']}, failed {state['failed']}; checkpoint {checkpoint_path})")
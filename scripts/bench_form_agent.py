@@ -0,0 +1,133 @@
+"""
+Form agent benchmark on local fixture pages (no Browserless, no Gemini).
+
+Serves scripts/form_fixtures/ on localhost, opens each fixture in local
+Chromium and runs the apply pipeline pieces with the canned action plans in
+form_fixtures/plans.json, reporting per fixture:
+  - readiness: goto → wait_for_form_ready (replaced a fixed 2000 ms sleep)
+  - execution: execute_actions wall time, including submit-outcome
+    detection (replaced a fixed 3000 ms sleep), and the classified outcome
+  - actions per second, with text fills batched into one evaluate
+    ("batch") and one field at a time ("per-field")
+  - snapshot size sent to Gemini: raw form HTML vs. the compact field list
+    (bytes and estimated tokens at ~4 chars/token)
+
+A plan key may carry a "#variant" suffix (same page, different plan), e.g.
+"spa.html#invalid" submits a bad email and should classify as
+validation_error. pagebuilder.html mimics page-builder markup (wrapper divs,
+long class lists, inline SVG icons, long option lists, a honeypot input).
+multistep.html is a three-panel wizard whose plan runs all steps in one
+session (the later panels render after each "Next").
+
+Usage (from repo root; needs `pip install playwright && playwright install chromium`):
+    python scripts/bench_form_agent.py [--runs 3] [--headed]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from playwright.async_api import async_playwright
+
+from ai_form_agent import wait_for_form_ready, execute_actions, snapshot_form
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "form_fixtures")
+OLD_READY_SLEEP_MS = 2000
+OLD_SUBMIT_SLEEP_MS = 3000
+CHARS_PER_TOKEN = 4
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_fixtures() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=FIXTURES))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+async def run_fixture(browser, base: str, key: str, plan: list, batch_fills: bool) -> dict:
+    page_name = key.split("#", 1)[0]
+    context = await browser.new_context(viewport={"width": 1280, "height": 900})
+    page = await context.new_page()
+    try:
+        t0 = time.perf_counter()
+        await page.goto(f"{base}/{page_name}", wait_until="domcontentloaded")
+        ready = await wait_for_form_ready(page)
+        ready_ms = (time.perf_counter() - t0) * 1000
+
+        t1 = time.perf_counter()
+        result = await execute_actions(page, plan, photo_urls=[], dry_run=False, batch_fills=batch_fills)
+        exec_ms = (time.perf_counter() - t1) * 1000
+    finally:
+        await context.close()
+    return {
+        "ready_ms": ready_ms, "ready_reason": ready["reason"], "exec_ms": exec_ms,
+        "outcome": result.get("submit_outcome"), "status": result["status"],
+        "actions": result["actions_completed"], "errors": result["errors"],
+    }
+
+
+async def snapshot_sizes(browser, base: str, page_name: str) -> dict:
+    context = await browser.new_context(viewport={"width": 1280, "height": 900})
+    page = await context.new_page()
+    try:
+        await page.goto(f"{base}/{page_name}", wait_until="domcontentloaded")
+        await wait_for_form_ready(page)
+        raw = await snapshot_form(page, compact=False)
+        compact = await snapshot_form(page, compact=True)
+    finally:
+        await context.close()
+    return {"raw": len(raw["form_html"]), "compact": len(compact["form_fields"]),
+            "fields": compact["field_count"]}
+
+
+async def main(args):
+    plans = json.load(open(os.path.join(FIXTURES, "plans.json")))
+    base = serve_fixtures()
+    pw = await async_playwright().start()
+    browser = await pw.chromium.launch(headless=not args.headed)
+    print(f"Fixtures served at {base}; {args.runs} run(s) each\n")
+    print(f"{'fixture':<20} {'mode':<9} {'ready':>9} {'(was)':>7} {'execute':>9} {'actions/s':>10}  outcome → status")
+    try:
+        for key, plan in plans.items():
+            for mode in ("per-field", "batch"):
+                runs = [await run_fixture(browser, base, key, plan, mode == "batch") for _ in range(args.runs)]
+                ready = statistics.median(r["ready_ms"] for r in runs)
+                execute = statistics.median(r["exec_ms"] for r in runs)
+                last = runs[-1]
+                rate = last["actions"] / (execute / 1000) if execute else 0
+                print(f"{key:<20} {mode:<9} {ready:7.0f}ms {OLD_READY_SLEEP_MS:5d}ms+ {execute:7.0f}ms {rate:10.1f}  "
+                      f"{last['outcome']} → {last['status']} ({last['ready_reason']})")
+                for err in last["errors"]:
+                    print(f"{'':<32}! {err}")
+
+        print(f"\n{'page':<20} {'fields':>6} {'raw html':>16} {'compact':>16} {'ratio':>6}")
+        for page_name in dict.fromkeys(key.split("#", 1)[0] for key in plans):
+            size = await snapshot_sizes(browser, base, page_name)
+            ratio = size["raw"] / size["compact"] if size["compact"] else 0
+            print(f"{page_name:<20} {size['fields']:6d} "
+                  f"{size['raw']:7d}B ~{size['raw'] // CHARS_PER_TOKEN:5d}t "
+                  f"{size['compact']:7d}B ~{size['compact'] // CHARS_PER_TOKEN:5d}t {ratio:5.1f}x")
+    finally:
+        await browser.close()
+        await pw.stop()
+    print(f"\n'(was)' is the fixed post-goto sleep alone; the old executor also slept "
+          f"{OLD_SUBMIT_SLEEP_MS} ms after every submit.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--headed", action="store_true")
+    asyncio.run(main(parser.parse_args()))
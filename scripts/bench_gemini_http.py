@@ -0,0 +1,111 @@
+"""
+Microbenchmark: bare requests.post vs. the shared Gemini HTTP client.
+
+Starts a local HTTPS stub (self-signed cert via openssl) that answers like
+generateContent, then times N sequential calls:
+  1. requests.post()               — new TCP + TLS handshake per call
+  2. GeminiHttpClient (requests)   — pooled HTTP/1.1 keep-alive
+  3. GeminiHttpClient (httpx)      — if httpx is installed
+
+The per-call difference between (1) and (2)/(3) is the handshake cost the
+shared client saves. Against the real API the saving is larger: the RTT to
+generativelanguage.googleapis.com is paid several times per handshake.
+
+Usage (from repo root):
+    python scripts/bench_gemini_http.py [--calls 200]
+"""
+import os
+import sys
+import ssl
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import requests
+import urllib3
+
+from gemini_http import GeminiHttpClient, HAS_HTTPX
+
+urllib3.disable_warnings()
+
+STUB_BODY = json.dumps({
+    "candidates": [{"content": {"parts": [{"text": "{\"suitability_score\": 80}"}]}}]
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(STUB_BODY)))
+        self.end_headers()
+        self.wfile.write(STUB_BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub():
+    tmp = tempfile.mkdtemp()
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key,
+         "-out", cert, "-days", "1", "-subj", "/CN=localhost"],
+        check=True, capture_output=True,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"https://localhost:{server.server_address[1]}/v1beta/models/stub:generateContent"
+
+
+def time_calls(label, post, calls):
+    payload = {"contents": [{"parts": [{"text": "x" * 2048}]}]}
+    samples = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        r = post(payload)
+        r.raise_for_status()
+        samples.append((time.perf_counter() - t0) * 1000)
+    print(f"{label:<32} median={statistics.median(samples):6.2f} ms  "
+          f"p90={sorted(samples)[int(0.9 * (len(samples) - 1))]:6.2f} ms")
+    return statistics.median(samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    server, url = start_stub()
+    print(f"🔒 TLS stub on {url} — {args.calls} sequential calls each\n")
+
+    bare = time_calls("requests.post (new conn each)",
+                      lambda p: requests.post(url, json=p, timeout=10, verify=False), args.calls)
+
+    pooled = GeminiHttpClient(verify=False, prefer_httpx=False)
+    keepalive = time_calls("shared client (requests pool)", lambda p: pooled.post_json(url, p, 10), args.calls)
+    print(f"   stats: {pooled.stats()}")
+    print(f"   saved ≈ {bare - keepalive:.2f} ms per call\n")
+
+    if HAS_HTTPX:
+        hx = GeminiHttpClient(verify=False, prefer_httpx=True)
+        hx_ms = time_calls("shared client (httpx)", lambda p: hx.post_json(url, p, 10), args.calls)
+        print(f"   stats: {hx.stats()}")
+        print(f"   saved ≈ {bare - hx_ms:.2f} ms per call")
+        print("   (stub speaks HTTP/1.1 only; against Google the httpx client negotiates HTTP/2)")
+
+    server.shutdown()
@@ -0,0 +1,176 @@
+"""
+HTTP fast path benchmark: browser submit vs. direct POST for a plain form.
+
+Serves form_fixtures/native.html (native multipart POST with a per-request
+CSRF token) from a local server that validates every submission, then:
+  1. browser run — goto, compact snapshot, execute the canned plan with a
+     PostCapture attached, classify the submit into an http_form spec
+  2. N × http_form.submit(spec) — GET for a fresh token + one POST with the
+     photo prefetched once (prefetch_photos) and posted from memory
+and reports wall time per application for both, plus how many submissions
+the server accepted (token, required fields and file all present).
+
+No Gemini: the plan tags every value with a user key or "constant", so the
+replay never needs a re-mapping call.
+
+Usage (from repo root; needs `pip install playwright && playwright install chromium`):
+    python scripts/bench_http_form.py [--runs 10] [--headed]
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from PIL import Image
+from playwright.async_api import async_playwright
+
+import http_form
+from ai_form_agent import snapshot_form, execute_actions, wait_for_form_ready, user_field_values, prefetch_photos
+from apply_engine import BROWSER_USER_AGENT
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "form_fixtures")
+REQUIRED = ("csrf_token", "first_name", "last_name", "email", "consent", "photo")
+
+USER = {
+    "first_name": "Jane", "last_name": "Doe", "email": "jane@example.com",
+    "height": "170-179", "eye_color": "Brown",
+}
+PLAN = [
+    {"action": "fill", "selector": "#first_name", "value": "Jane", "source": "first_name"},
+    {"action": "fill", "selector": "#last_name", "value": "Doe", "source": "last_name"},
+    {"action": "fill", "selector": "#email", "value": "jane@example.com", "source": "email"},
+    {"action": "select", "selector": "#height", "value": "170-179", "source": "height"},
+    {"action": "select", "selector": "#eyes", "value": "Brown", "source": "eye_color"},
+    {"action": "fill", "selector": "#source", "value": "Online Search", "source": "constant"},
+    {"action": "upload", "selector": "#photo", "files": ["headshot"]},
+    {"action": "check", "selector": "#consent", "source": "constant"},
+    {"action": "click", "selector": "button[type='submit']"},
+]
+
+
+def _photo_bytes() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (900, 1200), (200, 180, 170)).save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+class FormServer(BaseHTTPRequestHandler):
+    tokens = set()
+    accepted = 0
+    rejected = []
+    photo = _photo_bytes()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body: bytes, ctype="text/html; charset=utf-8", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/native.html":
+            token = uuid.uuid4().hex
+            FormServer.tokens.add(token)
+            html = open(os.path.join(FIXTURES, "native.html")).read().replace("{{csrf}}", token)
+            self._send(200, html.encode())
+        elif path == "/thanks.html":
+            self._send(200, open(os.path.join(FIXTURES, "thanks.html"), "rb").read())
+        elif path == "/photo.jpg":
+            self._send(200, FormServer.photo, "image/jpeg")
+        else:
+            self._send(404, b"not found")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        fields = http_form._parse_body(self.headers.get("Content-Type", ""), body)
+        names = {name for name, value, _ in fields if value}
+        token = next((v for n, v, _ in fields if n == "csrf_token"), None)
+        missing = [n for n in REQUIRED if n not in names]
+        if missing or token not in FormServer.tokens:
+            FormServer.rejected.append(missing or ["csrf_token"])
+            return self._send(422, b"<p class='error'>Please check the form</p>")
+        FormServer.tokens.discard(token)
+        FormServer.accepted += 1
+        self._send(303, b"", headers={"Location": "/thanks.html"})
+
+
+def serve() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FormServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+async def browser_run(browser, url: str, user: dict) -> tuple:
+    context = await browser.new_context(user_agent=BROWSER_USER_AGENT)
+    page = await context.new_page()
+    try:
+        t0 = time.perf_counter()
+        await page.goto(url, wait_until="domcontentloaded")
+        await wait_for_form_ready(page)
+        snapshot = await snapshot_form(page, compact=True)
+        capture = http_form.PostCapture().attach(page)
+        result = await execute_actions(page, PLAN, user["generated_photos"])
+        capture.detach()
+        elapsed = time.perf_counter() - t0
+        spec = http_form.classify(capture, snapshot, PLAN, user_field_values(user), url, page.url,
+                                  await capture.landing_html())
+    finally:
+        await context.close()
+    return elapsed, result, spec
+
+
+async def main(args):
+    base = serve()
+    url = f"{base}/native.html"
+    user = {**USER, "generated_photos": [f"{base}/photo.jpg"]}
+
+    pw = await async_playwright().start()
+    browser = await pw.chromium.launch(headless=not args.headed)
+    try:
+        browser_times, spec = [], None
+        for _ in range(args.runs):
+            elapsed, result, spec = await browser_run(browser, url, user)
+            browser_times.append(elapsed)
+        print(f"browser: {result['submit_outcome']} → {result['status']}, "
+              f"median {statistics.median(browser_times) * 1000:.0f} ms / application")
+    finally:
+        await browser.close()
+        await pw.stop()
+
+    if not spec:
+        sys.exit("Form was not classified as plain HTML — no fast path to measure.")
+    print("spec:", json.dumps({f["name"]: f["kind"] for f in spec["fields"]}))
+
+    accepted_before = FormServer.accepted
+    photo_files = await prefetch_photos(user["generated_photos"])
+    http_times, statuses = [], []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        r = await http_form.submit(spec, user, user_field_values(user), BROWSER_USER_AGENT, photo_files)
+        http_times.append(time.perf_counter() - t0)
+        statuses.append(r["status"])
+    print(f"http:    {statuses.count('applied')}/{args.runs} applied, "
+          f"median {statistics.median(http_times) * 1000:.0f} ms / application "
+          f"(server accepted {FormServer.accepted - accepted_before}, rejected {len(FormServer.rejected)})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--headed", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+"""
+Benchmark: local image quality scorer vs. the Gemini auditor.
+
+Runs api/image_quality.score_image over a labeled fixture set built from the
+repo's test images (plus degraded variants of them) and reports accuracy on
+can_proceed and per-image latency. With --remote, the same bytes are also
+sent through photo_lab.gemini_audit for a latency / agreement comparison.
+
+Usage (from repo root):
+    python scripts/bench_image_quality.py [--remote] [--rounds 20]
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from dotenv import load_dotenv
+from PIL import Image, ImageEnhance, ImageFilter
+
+from image_quality import score_image, HAS_NUMPY
+
+load_dotenv()
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+# (file, expected can_proceed) — all source photos are usable studio/selfie shots
+SOURCE_FIXTURES = [
+    ("test_clean_slate.jpg", True),
+    ("test_tiered.jpg", True),
+    ("test_tiered_final.jpg", True),
+]
+
+
+def _jpeg(img) -> bytes:
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def build_fixtures():
+    """Returns [(label, image_bytes, expected_can_proceed)]."""
+    fixtures = []
+    for name, expected in SOURCE_FIXTURES:
+        path = os.path.join(ROOT, name)
+        if not os.path.exists(path):
+            print(f"⚠️ Missing fixture {name} — skipping")
+            continue
+        with open(path, "rb") as f:
+            raw = f.read()
+        fixtures.append((name, raw, expected))
+
+        img = Image.open(io.BytesIO(raw))
+        # Pitch black: brightness crushed to ~3%
+        fixtures.append((f"{name} [pitch_black]", _jpeg(ImageEnhance.Brightness(img).enhance(0.03)), False))
+        # Extreme blur: nothing left to identify
+        fixtures.append((f"{name} [smeared]", _jpeg(img.filter(ImageFilter.GaussianBlur(40))), False))
+        # Dim but usable: auditor is lenient here
+        fixtures.append((f"{name} [dim]", _jpeg(ImageEnhance.Brightness(img).enhance(0.45)), True))
+    return fixtures
+
+
+def bench_local(fixtures, rounds):
+    correct = 0
+    timings = []
+    print(f"\n── Local scorer (numpy={'yes' if HAS_NUMPY else 'no'}) ──")
+    for label, data, expected in fixtures:
+        samples = []
+        result = None
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            result = score_image(data)
+            samples.append((time.perf_counter() - t0) * 1000)
+        med = statistics.median(samples)
+        timings.append(med)
+        ok = result and result["can_proceed"] == expected
+        correct += 1 if ok else 0
+        print(f"{'✅' if ok else '❌'} {label:<40} score={result['score']:>2} "
+              f"issues={result['issues']} {med:6.2f} ms")
+    print(f"Accuracy: {correct}/{len(fixtures)}  "
+          f"median={statistics.median(timings):.2f} ms  max={max(timings):.2f} ms")
+
+
+def bench_remote(fixtures):
+    from photo_lab import gemini_audit
+
+    print("\n── Gemini auditor ──")
+    timings = []
+    for label, data, expected in fixtures:
+        t0 = time.perf_counter()
+        try:
+            result = gemini_audit(data, "image/jpeg")
+        except Exception as e:
+            print(f"❌ {label:<40} error: {e}")
+            continue
+        elapsed = (time.perf_counter() - t0) * 1000
+        timings.append(elapsed)
+        ok = result.get("can_proceed") == expected
+        print(f"{'✅' if ok else '❌'} {label:<40} score={result.get('score')} "
+              f"issues={result.get('issues')} {elapsed:8.0f} ms")
+    if timings:
+        print(f"median={statistics.median(timings):.0f} ms  max={max(timings):.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--remote", action="store_true", help="Also time the Gemini auditor")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    fixtures = build_fixtures()
+    bench_local(fixtures, args.rounds)
+    if args.remote:
+        bench_remote(fixtures)
@@ -0,0 +1,112 @@
+"""
+Benchmark: navigation profiles ("full" vs "lean") on real agency pages.
+
+For each URL and profile, opens a fresh browser context (same settings as
+apply_engine), installs the profile and loads the page, reporting:
+  - time-to-form: goto start → first form field attached to the DOM
+  - bytes transferred (response headers + bodies of finished requests)
+  - requests finished / blocked by the profile
+
+Uses the same browser as the apply engine (BROWSERLESS_TOKEN /
+BROWSERLESS_URL, else local Chromium), so running it against Browserless
+shows the saving where it matters.
+
+Usage (from repo root):
+    python scripts/bench_nav_profile.py https://agency-a.example/apply https://agency-b.example/join
+    python scripts/bench_nav_profile.py --urls-file urls.txt --runs 3
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from dotenv import load_dotenv
+from playwright.async_api import async_playwright
+
+from apply_engine import _connect_browser
+from nav_profile import NavProfile
+
+load_dotenv()
+
+FIELD_SELECTOR = "form input, form select, form textarea, input[type='email'], textarea"
+
+
+async def load_once(browser, url: str, profile: str) -> dict:
+    context = await browser.new_context(
+        viewport={"width": 1920, "height": 1080},
+        locale="en-GB",
+        service_workers="block",
+    )
+    nav = await NavProfile(profile).install(context)
+    page = await context.new_page()
+    totals = {"bytes": 0, "requests": 0}
+
+    async def on_finished(request):
+        try:
+            sizes = await request.sizes()
+            totals["bytes"] += sizes["responseHeadersSize"] + sizes["responseBodySize"]
+            totals["requests"] += 1
+        except Exception:
+            pass
+
+    page.on("requestfinished", lambda r: asyncio.ensure_future(on_finished(r)))
+    t0 = time.perf_counter()
+    time_to_form = None
+    try:
+        await page.goto(url, timeout=60000, wait_until="commit")
+        await page.wait_for_selector(FIELD_SELECTOR, state="attached", timeout=30000)
+        time_to_form = time.perf_counter() - t0
+        await page.wait_for_load_state("load", timeout=30000)
+    except Exception as e:
+        print(f"   ⚠️  {profile}: {e.__class__.__name__}: {str(e)[:80]}")
+    await asyncio.sleep(0.5)  # let pending sizes() calls settle
+    await context.close()
+    return {"time_to_form": time_to_form, **totals, "blocked": sum(nav.blocked.values())}
+
+
+async def main(args):
+    urls = list(args.urls)
+    if args.urls_file:
+        urls += [line.strip() for line in open(args.urls_file) if line.strip() and not line.startswith("#")]
+    if not urls:
+        sys.exit("Pass one or more application URLs (or --urls-file).")
+
+    pw = await async_playwright().start()
+    browser = await _connect_browser(pw)
+    summary = {p: {"ttf": [], "bytes": [], "requests": []} for p in args.profiles}
+    try:
+        for url in urls:
+            print(f"\n🌐 {url}")
+            for profile in args.profiles:
+                for _ in range(args.runs):
+                    r = await load_once(browser, url, profile)
+                    ttf = f"{r['time_to_form'] * 1000:7.0f} ms" if r["time_to_form"] else "   no form"
+                    print(f"   {profile:<9} time-to-form {ttf}   {r['bytes'] / 1024:8.0f} KB   "
+                          f"{r['requests']:4d} requests   {r['blocked']:4d} blocked")
+                    if r["time_to_form"]:
+                        summary[profile]["ttf"].append(r["time_to_form"])
+                    summary[profile]["bytes"].append(r["bytes"])
+                    summary[profile]["requests"].append(r["requests"])
+    finally:
+        await browser.close()
+        await pw.stop()
+
+    print("\nMedians across all pages/runs:")
+    for profile, s in summary.items():
+        ttf = f"{statistics.median(s['ttf']) * 1000:7.0f} ms" if s["ttf"] else "       -"
+        kb = statistics.median(s["bytes"]) / 1024 if s["bytes"] else 0
+        reqs = statistics.median(s["requests"]) if s["requests"] else 0
+        print(f"   {profile:<9} time-to-form {ttf}   {kb:8.0f} KB   {reqs:6.0f} requests")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", nargs="*")
+    parser.add_argument("--urls-file")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--profiles", nargs="+", default=["full", "lean"])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,375 @@
+"""
+Photo Lab benchmark harness — compare prompt / thinking-budget configurations.
+
+Replays a fixture set of reference images through photo_lab.process_digitals
+for each configuration and reports, per config:
+  - end-to-end and Gemini-call latency percentiles (p50 / p90 / p99)
+  - token usage (prompt / thoughts / output) from usage_metadata
+  - failure rate, split into "text instead of image" and hard errors
+  - output image size
+
+Backends:
+  --mode stub    (default) synthetic Gemini: latency grows with thinking budget,
+                 occasional text-instead-of-image replies. No API key needed.
+  --mode live    real Gemini; every call is recorded to --cassette if given.
+  --mode replay  replays a cassette recorded in live mode (same latencies,
+                 outcomes and token counts, no API spend).
+
+Configs come from --configs (JSON list of {name, system_instruction,
+user_prompt, thinking_budget}; missing fields fall back to lab_config.json)
+or default to the active config swept over several thinking budgets.
+
+Usage (from repo root):
+    python scripts/bench_photo_lab.py --mode stub --runs 5
+    python scripts/bench_photo_lab.py --mode live --runs 3 --cassette bench_cassette.json
+    python scripts/bench_photo_lab.py --mode replay --cassette bench_cassette.json --out report.json
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import statistics
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from dotenv import load_dotenv
+
+import photo_lab
+
+load_dotenv()
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+DEFAULT_IMAGES = ["test_clean_slate.jpg", "test_tiered.jpg"]
+DEFAULT_BUDGETS = [0, 1024, 2048, 4096, 8192]
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Gemini backends
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _fake_response(outcome, output_bytes=0, text="", usage=None):
+    """Builds an object shaped like a google-genai GenerateContentResponse."""
+    parts = []
+    if outcome == "image":
+        blob = SimpleNamespace(data=os.urandom(output_bytes), mime_type="image/png")
+        parts.append(SimpleNamespace(inline_data=blob))
+    content = SimpleNamespace(parts=parts)
+    usage = usage or {}
+    return SimpleNamespace(
+        candidates=[SimpleNamespace(content=content)] if parts else [],
+        text=text or None,
+        usage_metadata=SimpleNamespace(**usage),
+    )
+
+
+def _request_key(kwargs) -> str:
+    """Identifies a generate_content call by model, prompt config and reference bytes."""
+    cfg = kwargs.get("config")
+    budget = getattr(getattr(cfg, "thinking_config", None), "thinking_budget", None)
+    h = hashlib.sha256()
+    h.update(str(kwargs.get("model")).encode())
+    h.update(str(getattr(cfg, "system_instruction", "")).encode())
+    h.update(str(budget).encode())
+    for content in kwargs.get("contents", []):
+        for part in content.parts:
+            if getattr(part, "inline_data", None):
+                h.update(part.inline_data.data)
+            elif getattr(part, "text", None):
+                h.update(part.text.encode())
+    return h.hexdigest()
+
+
+class StubModels:
+    """Synthetic backend: ~8s base + ~1.5ms per thinking token, 5% text replies."""
+
+    def __init__(self, seed=7):
+        self.rng = random.Random(seed)
+
+    def generate_content(self, **kwargs):
+        cfg = kwargs.get("config")
+        tc = getattr(cfg, "thinking_config", None)
+        budget = (getattr(tc, "thinking_budget", None) or 0) if tc else 0
+        thoughts = int(budget * self.rng.uniform(0.4, 1.0))
+        latency = 8.0 + thoughts * 0.0015 + self.rng.uniform(-1.0, 1.0)
+        time.sleep(latency * STUB_TIME_SCALE)
+        usage = {"prompt_token_count": 1800, "thoughts_token_count": thoughts, "candidates_token_count": 1290}
+        if self.rng.random() < 0.05:
+            return _fake_response("text", text="I can't generate that image.", usage=usage)
+        return _fake_response("image", output_bytes=self.rng.randint(900_000, 1_600_000), usage=usage)
+
+
+class RecordingModels:
+    """Wraps the real client; records each call's timing, outcome and usage."""
+
+    def __init__(self, real_models, cassette):
+        self.real = real_models
+        self.cassette = cassette
+
+    def generate_content(self, **kwargs):
+        key = _request_key(kwargs)
+        t0 = time.perf_counter()
+        entry = {"latency_s": None, "outcome": "error", "output_bytes": 0, "text": "", "usage": {}}
+        try:
+            resp = self.real.generate_content(**kwargs)
+        except Exception as e:
+            entry["latency_s"] = time.perf_counter() - t0
+            entry["text"] = str(e)[:200]
+            self.cassette.setdefault(key, []).append(entry)
+            raise
+        entry["latency_s"] = time.perf_counter() - t0
+        usage = getattr(resp, "usage_metadata", None)
+        if usage:
+            entry["usage"] = {
+                k: getattr(usage, k, None) or 0
+                for k in ("prompt_token_count", "thoughts_token_count", "candidates_token_count")
+            }
+        parts = resp.candidates[0].content.parts if resp.candidates and resp.candidates[0].content.parts else []
+        images = [p for p in parts if p.inline_data and p.inline_data.mime_type.startswith("image/")]
+        if images:
+            entry["outcome"] = "image"
+            entry["output_bytes"] = len(images[0].inline_data.data)
+        else:
+            entry["outcome"] = "text"
+            entry["text"] = (resp.text or "")[:200]
+        self.cassette.setdefault(key, []).append(entry)
+        return resp
+
+
+class ReplayModels:
+    """Serves recorded entries for matching requests, cycling through repeats."""
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+        self.cursor = {}
+
+    def generate_content(self, **kwargs):
+        key = _request_key(kwargs)
+        entries = self.cassette.get(key)
+        if not entries:
+            raise RuntimeError("No recording for this request (re-record the cassette)")
+        i = self.cursor.get(key, 0)
+        self.cursor[key] = i + 1
+        entry = entries[i % len(entries)]
+        time.sleep(entry["latency_s"] * STUB_TIME_SCALE)
+        if entry["outcome"] == "error":
+            raise RuntimeError(entry["text"])
+        return _fake_response(entry["outcome"], entry["output_bytes"], entry["text"], entry["usage"])
+
+
+class TimedModels:
+    """Outermost wrapper: measures the Gemini call itself and keeps the last usage."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.last = {}
+
+    def generate_content(self, **kwargs):
+        t0 = time.perf_counter()
+        self.last = {"gemini_s": None, "usage": {}}
+        try:
+            resp = self.inner.generate_content(**kwargs)
+        finally:
+            self.last["gemini_s"] = time.perf_counter() - t0
+        usage = getattr(resp, "usage_metadata", None)
+        if usage:
+            self.last["usage"] = {
+                k: getattr(usage, k, None) or 0
+                for k in ("prompt_token_count", "thoughts_token_count", "candidates_token_count")
+            }
+        return resp
+
+
+class DirectGateway:
+    """
+    Stands in for gemini_gateway in stub / replay mode. The production token
+    bucket (0.5 req/s, burst 2 for the image model) would otherwise queue the
+    fake calls and the report would measure the rate limit, not the config.
+    """
+
+    def call(self, model, fn, **kwargs):
+        return fn()
+
+
+STUB_TIME_SCALE = 1.0
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Harness
+# ──────────────────────────────────────────────────────────────────────────────
+
+def load_fixtures(paths):
+    """Reference images as data: URLs so process_digitals skips the network."""
+    fixtures = []
+    for p in paths:
+        full = p if os.path.isabs(p) else os.path.join(ROOT, p)
+        with open(full, "rb") as f:
+            fixtures.append("data:image/jpeg;base64," + base64.b64encode(f.read()).decode("utf-8"))
+    return fixtures
+
+
+def load_configs(path):
+    active = photo_lab.load_lab_config()
+    if not path:
+        return [
+            {"name": f"active@{b}", "system_instruction": active["system_instruction"],
+             "user_prompt": active["user_prompt"], "thinking_budget": b}
+            for b in DEFAULT_BUDGETS
+        ]
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    configs = []
+    for i, c in enumerate(raw):
+        configs.append({
+            "name": c.get("name") or f"config_{i}",
+            "system_instruction": c.get("system_instruction") or active["system_instruction"],
+            "user_prompt": c.get("user_prompt") or active["user_prompt"],
+            "thinking_budget": c.get("thinking_budget", active["thinking_budget"]),
+        })
+    return configs
+
+
+def _pct(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def run_config(config, fixtures, runs, timed):
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = photo_lab.process_digitals(
+            reference_urls=fixtures,
+            custom_system=config["system_instruction"],
+            custom_prompt=config["user_prompt"],
+            thinking_budget=config["thinking_budget"],
+            use_cache=False,
+        )
+        total_s = time.perf_counter() - t0
+        error = result.get("error", "")
+        if not error:
+            outcome = "ok"
+        elif "text instead of image" in error:
+            outcome = "text_instead_of_image"
+        else:
+            outcome = "error"
+        output_bytes = len(base64.b64decode(result["image_bytes"])) if result.get("image_bytes") else 0
+        samples.append({
+            "total_s": total_s,
+            "gemini_s": timed.last.get("gemini_s"),
+            "usage": timed.last.get("usage", {}),
+            "outcome": outcome,
+            "output_bytes": output_bytes,
+        })
+    return summarize(config, samples)
+
+
+def summarize(config, samples):
+    totals = [s["total_s"] for s in samples]
+    gemini = [s["gemini_s"] for s in samples if s["gemini_s"] is not None]
+    ok = [s for s in samples if s["outcome"] == "ok"]
+
+    def mean_usage(key):
+        vals = [s["usage"].get(key, 0) for s in samples if s["usage"]]
+        return round(statistics.mean(vals)) if vals else None
+
+    return {
+        "name": config["name"],
+        "thinking_budget": config["thinking_budget"],
+        "runs": len(samples),
+        "ok": len(ok),
+        "failure_rate": round(1 - len(ok) / len(samples), 3) if samples else None,
+        "text_instead_of_image": sum(1 for s in samples if s["outcome"] == "text_instead_of_image"),
+        "errors": sum(1 for s in samples if s["outcome"] == "error"),
+        "latency_s": {"p50": _pct(totals, 0.5), "p90": _pct(totals, 0.9), "p99": _pct(totals, 0.99)},
+        "gemini_s": {"p50": _pct(gemini, 0.5), "p90": _pct(gemini, 0.9), "p99": _pct(gemini, 0.99)},
+        "tokens": {
+            "prompt": mean_usage("prompt_token_count"),
+            "thoughts": mean_usage("thoughts_token_count"),
+            "output": mean_usage("candidates_token_count"),
+        },
+        "output_kb": round(statistics.mean([s["output_bytes"] for s in ok]) / 1024) if ok else None,
+    }
+
+
+def print_report(rows, baseline=None):
+    base = {r["name"]: r for r in (baseline or [])}
+    header = f"{'config':<22}{'budget':>7}{'ok':>5}{'fail%':>7}{'text':>6}{'p50 s':>8}{'p90 s':>8}{'p99 s':>8}{'think tok':>10}{'out KB':>8}"
+    print("\n" + header)
+    print("─" * len(header))
+    for r in rows:
+        lat = r["latency_s"]
+        fmt = lambda v: f"{v:8.2f}" if v is not None else f"{'—':>8}"
+        line = (f"{r['name']:<22}{r['thinking_budget']:>7}{r['ok']:>5}"
+                f"{(r['failure_rate'] or 0) * 100:>6.1f}%{r['text_instead_of_image']:>6}"
+                f"{fmt(lat['p50'])}{fmt(lat['p90'])}{fmt(lat['p99'])}"
+                f"{(r['tokens']['thoughts'] or 0):>10}{(r['output_kb'] or 0):>8}")
+        prev = base.get(r["name"])
+        if prev and prev["latency_s"]["p50"] and lat["p50"]:
+            delta = (lat["p50"] - prev["latency_s"]["p50"]) / prev["latency_s"]["p50"] * 100
+            line += f"  (p50 {delta:+.0f}% vs baseline)"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["stub", "live", "replay"], default="stub")
+    parser.add_argument("--configs", help="JSON list of configurations to compare")
+    parser.add_argument("--images", nargs="+", default=DEFAULT_IMAGES)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--cassette", help="Record (live) or replay (replay) Gemini calls here")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Multiply stub/replay sleeps (0 = instant)")
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Previous JSON report to compare p50 against")
+    args = parser.parse_args()
+
+    STUB_TIME_SCALE = args.time_scale
+    cassette = {}
+
+    if args.mode == "stub":
+        inner = StubModels()
+    elif args.mode == "replay":
+        if not args.cassette:
+            sys.exit("--mode replay requires --cassette")
+        with open(args.cassette, "r", encoding="utf-8") as f:
+            inner = ReplayModels(json.load(f))
+    else:
+        inner = RecordingModels(photo_lab.get_client().models, cassette)
+
+    timed = TimedModels(inner)
+    photo_lab.get_client = lambda: SimpleNamespace(models=timed)
+    if args.mode != "live":
+        photo_lab.gemini_gateway = DirectGateway()  # live keeps the real quota limits
+
+    fixtures = load_fixtures(args.images)
+    configs = load_configs(args.configs)
+    print(f"🧪 {len(configs)} config(s) × {args.runs} run(s), {len(fixtures)} reference image(s), mode={args.mode}")
+
+    rows = []
+    for cfg in configs:
+        print(f"\n▶ {cfg['name']} (thinking_budget={cfg['thinking_budget']})")
+        rows.append(run_config(cfg, fixtures, args.runs, timed))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results")
+    print_report(rows, baseline)
+
+    if args.mode == "live" and args.cassette:
+        with open(args.cassette, "w", encoding="utf-8") as f:
+            json.dump(cassette, f, indent=2)
+        print(f"\n📼 Recorded {sum(len(v) for v in cassette.values())} call(s) to {args.cassette}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"mode": args.mode, "runs": args.runs, "images": args.images, "results": rows}, f, indent=2)
+        print(f"📄 Report written to {args.out}")
@@ -0,0 +1,83 @@
+"""
+Microbenchmark: per-request overhead of RateLimitMiddleware.
+
+Drives the ASGI middleware directly (no server, no sockets) with a no-op
+inner app, so the difference between the two timings is the limiter alone:
+header scan, client-IP extraction and one in-memory sliding-window hit.
+Requests are spread over many IPs so none gets limited (the common case).
+
+Then replays a burst from one IP to show the 429 + Retry-After path.
+
+Usage (from repo root):
+    python scripts/bench_rate_limit.py [--requests 200000] [--ips 5000]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from rate_limit import RateLimiter, RateLimitMiddleware
+
+
+async def noop_app(scope, receive, send):
+    pass
+
+
+async def sink(message):
+    if message["type"] == "http.response.start":
+        sink.last = message
+
+
+def make_scope(ip: str):
+    return {
+        "type": "http", "method": "POST", "path": "/api/analyze",
+        "headers": [(b"host", b"api.example.com"), (b"content-type", b"multipart/form-data; boundary=x"),
+                    (b"x-forwarded-for", ip.encode()), (b"user-agent", b"bench")],
+        "client": ("10.0.0.1", 50000),
+    }
+
+
+async def timed(app, scopes) -> float:
+    t0 = time.perf_counter()
+    for scope in scopes:
+        await app(scope, None, sink)
+    return (time.perf_counter() - t0) / len(scopes) * 1e6
+
+
+async def main(args):
+    scopes = [make_scope(f"203.0.113.{i % 250}.{i // 250}") for i in range(args.ips)]
+    scopes = (scopes * (args.requests // len(scopes) + 1))[:args.requests]
+
+    # Generous limit: this measures the allowed path
+    limiter = RateLimiter(ip_rules={"/api/analyze": {"limit": 10 ** 9, "window": 60}})
+    limited = RateLimitMiddleware(noop_app, limiter)
+
+    await timed(limited, scopes[:10000])  # warm-up
+    bare_us = await timed(noop_app, scopes)
+    limited_us = await timed(limited, scopes)
+    print(f"{args.requests:,} requests over {args.ips:,} IPs")
+    print(f"   bare app          {bare_us:6.2f} µs/request")
+    print(f"   with rate limiter {limited_us:6.2f} µs/request")
+    print(f"   overhead          {limited_us - bare_us:6.2f} µs/request (budget: 100 µs)")
+
+    # Burst from one client against the real default rule
+    burst = RateLimitMiddleware(noop_app, RateLimiter())
+    statuses, retry_after = [], None
+    for _ in range(25):
+        sink.last = None
+        await burst(make_scope("198.51.100.7"), None, sink)
+        statuses.append(sink.last["status"] if sink.last else 200)
+        if sink.last and not retry_after:
+            retry_after = dict(sink.last["headers"])[b"retry-after"].decode()
+    print(f"\n25-request burst from one IP (limit 20/min): {statuses.count(200)} allowed, "
+          f"{statuses.count(429)} rejected (Retry-After: {retry_after}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--ips", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
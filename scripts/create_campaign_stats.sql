@@ -0,0 +1,127 @@
+-- Per-campaign, per-day lead aggregates (read by /api/admin/campaign-stats)
+-- Maintained incrementally by a trigger on public.leads: every insert/update/
+-- delete applies (new contribution - old contribution) to one aggregate row,
+-- so create_lead, webhook status updates and re-scoring jobs all keep it
+-- current without ever re-reading leads.
+CREATE TABLE IF NOT EXISTS public.campaign_daily_stats (
+    campaign TEXT NOT NULL,              -- '(none)' when the lead had no campaign
+    day DATE NOT NULL,                   -- leads.created_at, UTC
+    leads INTEGER NOT NULL DEFAULT 0,
+    score_sum BIGINT NOT NULL DEFAULT 0,
+    score_count INTEGER NOT NULL DEFAULT 0,
+    category_counts JSONB NOT NULL DEFAULT '{}'::jsonb,  -- {"Commercial": 12, ...}
+    webhook_success INTEGER NOT NULL DEFAULT 0,
+    webhook_failed INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (campaign, day)
+);
+
+CREATE INDEX IF NOT EXISTS campaign_daily_stats_day_idx ON public.campaign_daily_stats (day);
+
+ALTER TABLE public.campaign_daily_stats ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role reads campaign stats"
+ON public.campaign_daily_stats FOR ALL
+TO service_role
+USING (true)
+WITH CHECK (true);
+
+-- Adds (sign = 1) or removes (sign = -1) one lead's contribution
+CREATE OR REPLACE FUNCTION public.apply_campaign_stats_delta(
+    p_campaign TEXT, p_day DATE, p_sign INTEGER,
+    p_score INTEGER, p_category TEXT, p_webhook_status TEXT
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_campaign TEXT := COALESCE(NULLIF(btrim(p_campaign), ''), '(none)');
+    v_category TEXT := COALESCE(NULLIF(btrim(p_category), ''), 'Unknown');
+BEGIN
+    INSERT INTO public.campaign_daily_stats AS s (campaign, day) VALUES (v_campaign, p_day)
+    ON CONFLICT (campaign, day) DO NOTHING;
+
+    UPDATE public.campaign_daily_stats AS s SET
+        leads = s.leads + p_sign,
+        score_sum = s.score_sum + p_sign * COALESCE(p_score, 0),
+        score_count = s.score_count + CASE WHEN p_score IS NULL THEN 0 ELSE p_sign END,
+        category_counts = jsonb_set(
+            s.category_counts, ARRAY[v_category],
+            to_jsonb(COALESCE((s.category_counts ->> v_category)::INTEGER, 0) + p_sign)
+        ),
+        webhook_success = s.webhook_success + CASE WHEN p_webhook_status = 'success' THEN p_sign ELSE 0 END,
+        webhook_failed = s.webhook_failed + CASE WHEN p_webhook_status = 'failed' THEN p_sign ELSE 0 END,
+        updated_at = NOW()
+    WHERE s.campaign = v_campaign AND s.day = p_day;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.leads_campaign_stats_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.campaign IS NOT DISTINCT FROM OLD.campaign
+       AND NEW.created_at IS NOT DISTINCT FROM OLD.created_at
+       AND NEW.score IS NOT DISTINCT FROM OLD.score
+       AND NEW.category IS NOT DISTINCT FROM OLD.category
+       AND NEW.webhook_status IS NOT DISTINCT FROM OLD.webhook_status THEN
+        RETURN NEW;  -- nothing the aggregates care about changed
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM public.apply_campaign_stats_delta(
+            OLD.campaign, (OLD.created_at AT TIME ZONE 'UTC')::DATE, -1,
+            OLD.score, OLD.category, OLD.webhook_status);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM public.apply_campaign_stats_delta(
+            NEW.campaign, (NEW.created_at AT TIME ZONE 'UTC')::DATE, 1,
+            NEW.score, NEW.category, NEW.webhook_status);
+    END IF;
+    RETURN COALESCE(NEW, OLD);
+END;
+$$;
+
+-- Trigger + one-off backfill from existing leads in a single transaction:
+-- the lock holds off lead writes until COMMIT, so no lead is missed or
+-- double counted between the trigger going live and the snapshot below
+BEGIN;
+
+LOCK TABLE public.leads IN SHARE ROW EXCLUSIVE MODE;
+
+DROP TRIGGER IF EXISTS leads_campaign_stats ON public.leads;
+CREATE TRIGGER leads_campaign_stats
+AFTER INSERT OR UPDATE OR DELETE ON public.leads
+FOR EACH ROW EXECUTE FUNCTION public.leads_campaign_stats_trigger();
+
+TRUNCATE public.campaign_daily_stats;
+INSERT INTO public.campaign_daily_stats
+    (campaign, day, leads, score_sum, score_count, category_counts, webhook_success, webhook_failed)
+SELECT
+    campaign, day,
+    SUM(n)::INTEGER,
+    SUM(score_sum)::BIGINT,
+    SUM(score_count)::INTEGER,
+    jsonb_object_agg(category, n),
+    SUM(webhook_success)::INTEGER,
+    SUM(webhook_failed)::INTEGER
+FROM (
+    SELECT
+        COALESCE(NULLIF(btrim(campaign), ''), '(none)') AS campaign,
+        (created_at AT TIME ZONE 'UTC')::DATE AS day,
+        COALESCE(NULLIF(btrim(category), ''), 'Unknown') AS category,
+        COUNT(*) AS n,
+        COALESCE(SUM(score), 0) AS score_sum,
+        COUNT(score) AS score_count,
+        COUNT(*) FILTER (WHERE webhook_status = 'success') AS webhook_success,
+        COUNT(*) FILTER (WHERE webhook_status = 'failed') AS webhook_failed
+    FROM public.leads
+    GROUP BY 1, 2, 3
+) per_category
+GROUP BY campaign, day;
+
+COMMIT;
@@ -0,0 +1,18 @@
+-- Cached action-plan templates for the steps of agency application forms
+-- (see api/step_plans.py). Templates reference user-data keys, never values.
+CREATE TABLE IF NOT EXISTS public.form_step_plans (
+    agency_key TEXT NOT NULL,          -- host + path of the application URL
+    step_signature TEXT NOT NULL,      -- hash of the step's field selectors
+    actions JSONB NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (agency_key, step_signature)
+);
+
+-- Service role only: the apply engine reads/writes, clients never touch it
+ALTER TABLE public.form_step_plans ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role manages form step plans"
+ON public.form_step_plans FOR ALL
+TO service_role
+USING (true)
+WITH CHECK (true);
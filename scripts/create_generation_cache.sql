@@ -0,0 +1,27 @@
+-- Index of cached Photo Lab generations (see api/generation_cache.py)
+-- The image itself lives in the 'generated' bucket under cache/<cache_key>.<ext>
+CREATE TABLE IF NOT EXISTS public.generation_cache (
+    cache_key TEXT PRIMARY KEY,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    storage_path TEXT NOT NULL,
+    public_url TEXT,
+    mime_type TEXT DEFAULT 'image/jpeg',
+    model TEXT,
+    reference_count INTEGER,
+    thinking_budget INTEGER
+);
+
+-- Service role only: the backend reads/writes, clients never touch it
+ALTER TABLE public.generation_cache ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role manages generation cache"
+ON public.generation_cache FOR ALL
+TO service_role
+USING (true)
+WITH CHECK (true);
+
+-- Allow the service role to overwrite cached objects on regenerate
+CREATE POLICY "Service Update Generated"
+ON storage.objects FOR UPDATE
+TO service_role
+USING ( bucket_id = 'generated' );
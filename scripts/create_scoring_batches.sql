@@ -0,0 +1,26 @@
+-- Checkpoints for batch lead re-scoring (see api/batch_scoring.py)
+-- cursor = index into items before which every item has been processed
+CREATE TABLE IF NOT EXISTS public.scoring_batches (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    requested_by UUID,
+    status TEXT DEFAULT 'pending',       -- pending | running | completed | failed
+    items JSONB NOT NULL,                -- [{"lead_id": ..., "url": ...}]
+    total INTEGER NOT NULL DEFAULT 0,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    concurrency INTEGER DEFAULT 8,
+    succeeded INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    images_per_minute REAL,
+    errors JSONB DEFAULT '[]'::jsonb
+);
+
+-- Service role only: admins go through /api/admin/score-batch
+ALTER TABLE public.scoring_batches ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role manages scoring batches"
+ON public.scoring_batches FOR ALL
+TO service_role
+USING (true)
+WITH CHECK (true);
@@ -0,0 +1,368 @@
+"""
+Offline record / replay harness for the apply pipeline (apply_to_agency).
+
+test_dry_run.py drives a live agency site and live Gemini, so the form agent
+could not be regression-tested or benchmarked repeatably. This harness
+records an agency once and then replays the full pipeline offline:
+
+  record   apply_to_agency(url, dry_run=True) in local Chromium with the
+           context's traffic saved to replay_fixtures/<name>/page.har
+           (Playwright route_from_har, bodies embedded) and every
+           gemini_map_fields call saved to gemini.json (the cassette,
+           keyed by the form text + fixture user). Dry run: the real form is
+           never submitted; "Next" buttons of multi-step forms are clicked.
+  replay   apply_to_agency for each fixture in local Chromium, every request
+           of the context served by a local HTTP server from the HAR.
+           Requests the HAR does not have: POSTs are taken as the form
+           submission (recorded, answered with a thank-you page, or JSON for
+           fetch/XHR); anything else is a 404 — nothing reaches the network.
+           Gemini answers come from the cassette; a miss means the form
+           snapshot changed and fails the run (--record-missing asks Gemini
+           and extends the cassette instead).
+
+Replay reports per fixture: success rate (applied, or dry_run_complete with
+--dry-run), median wall time and per-phase time from the tracing spans
+(connect / goto / snapshot / execute / screenshot), the fields posted to the
+sink and whether the run classified the form for the HTTP fast path. The
+exit status is 1 when the corpus success rate is under --min-success, so it
+can gate changes to ai_form_agent / apply_engine.
+
+Step-plan caching is off (every step is mapped through the cassette) and the
+fixture user's photos are in-memory JPEGs (no Storage downloads).
+
+Usage (from repo root; needs `pip install playwright && playwright install chromium`;
+record also needs GOOGLE_API_KEY):
+    python scripts/replay_harness.py record edge-talent https://edgetalent.co.uk/agency-test/
+    python scripts/replay_harness.py replay [edge-talent ...] [--runs 3] [--dry-run] [--min-success 0.9]
+"""
+import io
+import os
+import sys
+import copy
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import base64
+import logging
+import statistics
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, urlunsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ["STEP_PLAN_CACHE"] = "false"  # map every step through the cassette
+for var in ("BROWSERLESS_TOKEN", "BROWSERLESS_URL"):
+    os.environ.pop(var, None)  # _connect_browser → local Chromium
+
+import httpx
+from PIL import Image
+
+import apply_engine
+import http_form
+from ai_form_agent import gemini_map_fields, user_field_values
+from tracing import collect_spans
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "replay_fixtures")
+THANKS_HTML = open(os.path.join(os.path.dirname(__file__), "form_fixtures", "thanks.html"), "rb").read()
+THANKS_PATH = "/__replay/thanks"
+PHASES = ("connect", "goto", "snapshot", "execute", "screenshot")
+SKIP_HEADERS = {"content-length", "content-encoding", "transfer-encoding", "connection", "keep-alive"}
+
+# Same person for record and replay: the cassette key includes these values
+USER = {
+    "first_name": "Jane", "last_name": "Doe", "email": "jane.doe.test@example.com",
+    "phone_number": "+447123456789", "gender": "Female", "date_of_birth": "2000-05-15",
+    "height_cm": 175, "bust_cm": "86", "waist_cm": "62", "hips_cm": "90", "shoe_size_uk": "7",
+    "eye_color": "Brown", "hair_color": "Brunette", "city": "London",
+    "social_stats": {"instagram": "@janedoe_test"},
+    "generated_photos": ["replay://headshot.jpg", "replay://fullbody.jpg"],
+}
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+class Cassette:
+    """Drop-in for gemini_map_fields that answers from (and optionally records to) gemini.json."""
+
+    def __init__(self, path: str, record: bool = False):
+        self.path = path
+        self.record = record
+        self.entries = json.load(open(path))["entries"] if os.path.exists(path) else {}
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(form_text: str, user_data: dict, compact: bool) -> str:
+        raw = json.dumps([compact, form_text, user_field_values(user_data)], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def __call__(self, form_text: str, user_data: dict, compact: bool = False):
+        key = self.key(form_text, user_data, compact)
+        if key in self.entries:
+            self.hits += 1
+            return copy.deepcopy(self.entries[key]["actions"])
+        self.misses += 1
+        if not self.record:
+            raise CassetteMiss(f"no cassette entry for this form snapshot ({len(form_text)} chars)")
+        actions = gemini_map_fields(form_text, user_data, compact)
+        self.entries[key] = {"compact": compact, "form": form_text, "actions": actions}
+        return copy.deepcopy(actions)
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump({"entries": self.entries}, f, indent=1)
+
+
+class HarStore:
+    """Recorded responses by (method, URL); a query-less URL match is the fallback (cache busters)."""
+
+    def __init__(self, path: str):
+        self.exact, self.by_path = {}, {}
+        for entry in json.load(open(path))["log"]["entries"]:
+            request, response = entry["request"], entry["response"]
+            if response.get("status", 0) <= 0:
+                continue  # aborted / blocked while recording
+            method = request["method"].upper()
+            self.exact[(method, request["url"])] = response
+            self.by_path[(method, _strip_query(request["url"]))] = response
+
+    def find(self, method: str, url: str):
+        return self.exact.get((method, url)) or self.by_path.get((method, _strip_query(url)))
+
+
+def _strip_query(url: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+def _har_body(response: dict) -> bytes:
+    content = response.get("content", {})
+    text = content.get("text") or ""
+    return base64.b64decode(text) if content.get("encoding") == "base64" else text.encode("utf-8")
+
+
+def _posted_fields(content_type: str, body: bytes) -> list:
+    if "json" in content_type:
+        try:
+            data = json.loads(body or b"{}")
+            return sorted(data) if isinstance(data, dict) else []
+        except ValueError:
+            return []
+    return sorted({name for name, _, _ in http_form._parse_body(content_type, body)})
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """GET/POST /replay?u=<original URL>: the HAR response, the submission sink, or 404."""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            if name.lower() not in SKIP_HEADERS:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _replay(self):
+        url = parse_qs(urlsplit(self.path).query).get("u", [""])[0]
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if urlsplit(url).path == THANKS_PATH:
+            return self._send(200, THANKS_HTML, [("Content-Type", "text/html; charset=utf-8")])
+        response = self.server.store.find(self.command, url)
+        if response is not None:
+            headers = [(h["name"], h["value"]) for h in response.get("headers", [])]
+            return self._send(response["status"], _har_body(response), headers)
+        if self.command in ("POST", "PUT"):
+            self.server.submissions.append({"url": url, "fields": _posted_fields(self.headers.get("Content-Type", ""), body)})
+            if self.headers.get("X-Replay-Type") == "document":
+                return self._send(303, b"", [("Location", THANKS_PATH)])
+            ok = json.dumps({"success": True, "message": "Thank you, we have received your application"})
+            return self._send(200, ok.encode(), [("Content-Type", "application/json")])
+        self._send(404, b"", [("Content-Type", "text/plain")])
+
+    do_GET = do_POST = do_PUT = do_HEAD = _replay
+
+
+def serve_har(har_path: str) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ReplayHandler)
+    server.store = HarStore(har_path)
+    server.submissions = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def replay_hook(base: str, client: httpx.AsyncClient):
+    """context_hook: every request of the context goes to the replay server instead of the network."""
+    async def forward(route):
+        request = route.request
+        try:
+            resp = await client.request(
+                request.method, f"{base}/replay", params={"u": request.url}, content=request.post_data_buffer,
+                headers={"Content-Type": request.headers.get("content-type", ""),
+                         "X-Replay-Type": request.resource_type})
+        except httpx.HTTPError:
+            return await route.abort("internetdisconnected")
+        headers = {k: v for k, v in resp.headers.items() if k.lower() not in SKIP_HEADERS}
+        await route.fulfill(status=resp.status_code, headers=headers, body=resp.content)
+
+    async def hook(context):
+        await context.route("**/*", forward)
+    return hook
+
+
+def record_hook(har_path: str):
+    """context_hook: the context's traffic is written to har_path when it closes."""
+    async def hook(context):
+        await context.route_from_har(har_path, update=True, update_content="embed")
+    return hook
+
+
+def photo_files() -> dict:
+    """In-memory stand-ins for the fixture user's generated_photos (set_input_files payloads)."""
+    files = {}
+    for url, size, colour in zip(USER["generated_photos"], ((900, 1200), (800, 1600)), ((200, 180, 170), (90, 90, 110))):
+        buf = io.BytesIO()
+        Image.new("RGB", size, colour).save(buf, "JPEG", quality=80)
+        files[url] = {"name": url.rsplit("/", 1)[-1], "mimeType": "image/jpeg", "buffer": buf.getvalue()}
+    return files
+
+
+async def record(args):
+    out = os.path.join(FIXTURES, args.name)
+    os.makedirs(out, exist_ok=True)
+    har_path = os.path.join(out, "page.har")
+    cassette = Cassette(os.path.join(out, "gemini.json"), record=True)
+    cassette.entries = {}  # a fresh recording replaces the old answers
+    apply_engine.gemini_map_fields = cassette
+
+    t0 = time.perf_counter()
+    result = await apply_engine.apply_to_agency(args.url, USER, dry_run=True, nav_profile=args.nav_profile,
+                                                photo_files=photo_files(), context_hook=record_hook(har_path))
+    cassette.save()
+    meta = {
+        "url": args.url,
+        "nav_profile": args.nav_profile,
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "recorded_status": result["status"],
+        "steps": result.get("steps"),
+        "actions_total": result.get("actions_total"),
+    }
+    with open(os.path.join(out, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"{args.name}: {result['status']} in {time.perf_counter() - t0:.1f}s, {result.get('steps')} step(s), "
+          f"{len(cassette.entries)} Gemini answer(s), HAR {os.path.getsize(har_path) / 1024:.0f}KB → {out}")
+    for err in result.get("errors", []):
+        print(f"  ! {err}")
+
+
+async def replay_fixture(name: str, args, client: httpx.AsyncClient) -> list:
+    folder = os.path.join(FIXTURES, name)
+    meta = json.load(open(os.path.join(folder, "meta.json")))
+    cassette = Cassette(os.path.join(folder, "gemini.json"), record=args.record_missing)
+    apply_engine.gemini_map_fields = cassette
+    server = serve_har(os.path.join(folder, "page.har"))
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    runs = []
+    try:
+        for run in range(args.runs):
+            posted_before = len(server.submissions)
+            t0 = time.perf_counter()
+            with collect_spans(f"replay-{name}-{run}") as trace:
+                result = await apply_engine.apply_to_agency(
+                    meta["url"], USER, dry_run=args.dry_run, nav_profile=meta.get("nav_profile"),
+                    photo_files=photo_files(), context_hook=replay_hook(base, client))
+            phases = {}
+            for s in trace.spans:
+                if s["dependency"] == "playwright":
+                    phases[s["operation"]] = phases.get(s["operation"], 0) + s["ms"]
+            runs.append({
+                "status": result["status"],
+                "ok": result["status"] == ("dry_run_complete" if args.dry_run else "applied"),
+                "ms": (time.perf_counter() - t0) * 1000,
+                "phases": phases,
+                "steps": result.get("steps"),
+                "actions": f"{result.get('actions_completed', 0)}/{result.get('actions_total', 0)}",
+                "errors": result.get("errors", []),
+                "posted": server.submissions[posted_before:],
+                "http_form": bool(result.get("http_form")),
+            })
+    finally:
+        server.shutdown()
+        if args.record_missing and cassette.misses:
+            cassette.save()
+    return runs
+
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return statistics.median(values) if values else None
+
+
+def _ms(value) -> str:
+    return f"{value:9.0f}ms" if value is not None else f"{'-':>11}"
+
+
+async def replay(args):
+    names = args.names
+    if not names and os.path.isdir(FIXTURES):
+        names = sorted(d for d in os.listdir(FIXTURES) if os.path.exists(os.path.join(FIXTURES, d, "meta.json")))
+    if not names:
+        sys.exit(f"No fixtures in {FIXTURES} — record one first.")
+
+    results = {}
+    header = "".join(f"{p:>11}" for p in PHASES)
+    print(f"{'fixture':<24} {'ok':>5} {'median':>9}{header}  last status (steps, actions) → posted fields")
+    async with httpx.AsyncClient(timeout=30) as client:
+        for name in names:
+            runs = results[name] = await replay_fixture(name, args, client)
+            ok = sum(r["ok"] for r in runs)
+            phases = "".join(_ms(_median([r["phases"].get(p) for r in runs])) for p in PHASES)
+            last = runs[-1]
+            posted = ", ".join(last["posted"][-1]["fields"]) if last["posted"] else "nothing posted"
+            print(f"{name:<24} {ok:>2}/{len(runs):<2} {_median([r['ms'] for r in runs]):7.0f}ms{phases}  "
+                  f"{last['status']} ({last['steps']}, {last['actions']}){' [http_form]' if last['http_form'] else ''}"
+                  f" → {posted}")
+            for err in last["errors"]:
+                print(f"{'':<26}! {err}")
+
+    all_runs = [r for runs in results.values() for r in runs]
+    rate = sum(r["ok"] for r in all_runs) / len(all_runs)
+    print(f"\n{len(names)} fixture(s), {len(all_runs)} run(s): success rate {rate:.0%}, "
+          f"median {_median([r['ms'] for r in all_runs]):.0f} ms / application")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if rate < args.min_success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--verbose", action="store_true", help="apply engine INFO logs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="record an agency page + Gemini answers as a fixture")
+    rec.add_argument("name")
+    rec.add_argument("url")
+    rec.add_argument("--nav-profile", default=None, help="lean | trackers | full (default: APPLY_NAV_PROFILE)")
+    rep = sub.add_parser("replay", help="run the pipeline offline against recorded fixtures")
+    rep.add_argument("names", nargs="*", help="fixture names (default: all)")
+    rep.add_argument("--runs", type=int, default=3)
+    rep.add_argument("--dry-run", action="store_true", help="fill only, as recorded (no submit)")
+    rep.add_argument("--record-missing", action="store_true", help="ask Gemini on cassette misses and save")
+    rep.add_argument("--min-success", type=float, default=0.0, help="exit 1 below this corpus success rate")
+    rep.add_argument("--json", help="write per-run results here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(levelname)s | %(message)s")
+    asyncio.run(record(args) if args.command == "record" else replay(args))